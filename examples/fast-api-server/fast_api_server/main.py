@@ -19,14 +19,11 @@ from openassistants.functions.crud import (
     PythonLibrary,
 )
 from openassistants.utils.langchain_util import LangChainCachedEmbeddings
-from openassistants_fastapi import RouteAssistants, create_router
+from openassistants_fastapi import RouteAssistants, create_router, watch_libraries
 from pydantic import Field, TypeAdapter
 
 from fast_api_server.find_email_by_name_function import find_email_by_name_function
 
-app = FastAPI()
-
-
 # Specify all the function types that are allowed in the local YAML library
 AllFunctionTypes = Annotated[
     QueryFunction
@@ -81,6 +78,9 @@ You're also allowed to answer questions that refer to anything in the current ch
 
 route_assistants = RouteAssistants(assistants={"hooli": hooli_assistant})
 
+# reload the functions when the YAML files in library/ change
+app = FastAPI(lifespan=watch_libraries(route_assistants))
+
 api_router = create_router(route_assistants)
 
 # IMPORTANT! Do not ship this to production! You should be more restrictive
@@ -4,6 +4,7 @@ from openassistants_fastapi.routes import (
     RouteAssistants,
     chat_handler,
     create_router,
+    watch_libraries,
 )
 
 __all__ = [
@@ -12,4 +13,5 @@ __all__ = [
     "ChatResponse",
     "chat_handler",
     "create_router",
+    "watch_libraries",
 ]
@@ -1,27 +1,46 @@
+import asyncio
 import dataclasses
-from typing import Annotated, List, Optional
+from contextlib import asynccontextmanager
+from typing import Annotated, AsyncIterator, Dict, List, Literal, Optional
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, FastAPI, HTTPException
 from openassistants.core.assistant import Assistant
 from openassistants.data_models.chat_messages import OpasMessage
 from openassistants.utils.async_utils import last_value
+from openassistants.utils.llm_scheduler import ModelMetrics
+from openassistants.utils.tracing import Span, TraceCollector
 from pydantic import BaseModel, Field
 from sse_starlette import EventSourceResponse
 
-from openassistants_fastapi.utils.sse import AsyncStreamVersion, sse_json_patch
+from openassistants_fastapi.utils.sse import (
+    AsyncStreamVersion,
+    sse_deltas,
+    sse_json_patch_deltas,
+)
 
 
 class ChatRequest(BaseModel):
     messages: Annotated[List[OpasMessage], Field(min_items=1)]
     stream: bool = False
+    stream_format: Annotated[
+        Literal["json_patch", "deltas"],
+        Field(
+            description="json_patch: JSON patches of the response, "
+            "deltas: message deltas that carry only the appended text"
+        ),
+    ] = "json_patch"
     autorun: Annotated[
         bool, Field(description="automatically run identified function")
     ] = True
     force_select_function: Optional[str] = None
+    debug: Annotated[
+        bool, Field(description="attach the request trace to the final response")
+    ] = False
 
 
 class ChatResponse(BaseModel):
     messages: Annotated[List[OpasMessage], Field(min_items=1)]
+    trace: Optional[Span] = None
 
 
 @dataclasses.dataclass
@@ -29,18 +48,51 @@ class RouteAssistants:
     assistants: dict[str, Assistant]
 
 
+def watch_libraries(route_assistants: RouteAssistants):
+    """
+    FastAPI lifespan that reloads the functions of every assistant when their
+    libraries change, e.g. FastAPI(lifespan=watch_libraries(route_assistants)).
+    Install openassistants[watch] to use inotify instead of polling.
+    """
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+        tasks = [
+            asyncio.create_task(assistant.watch_libraries())
+            for assistant in route_assistants.assistants.values()
+        ]
+        try:
+            yield
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    return lifespan
+
+
 async def chat_handler(
     assistant: Assistant,
     body: ChatRequest,
 ) -> EventSourceResponse | ChatResponse:
     async def stream() -> AsyncStreamVersion[ChatResponse]:
-        async for version in assistant.run_chat(
-            body.messages, body.autorun, body.force_select_function
+        trace_collector = TraceCollector()
+        last_version = None
+        async for last_version in assistant.run_chat(
+            body.messages,
+            body.autorun,
+            body.force_select_function,
+            trace_hooks=[trace_collector] if body.debug else [],
         ):
-            yield ChatResponse(messages=version)
+            yield ChatResponse(messages=last_version)
+
+        if body.debug and last_version is not None:
+            yield ChatResponse(messages=last_version, trace=trace_collector.last)
 
-    if body.stream:
-        return sse_json_patch(stream())
+    if body.stream and body.stream_format == "deltas":
+        return sse_deltas(stream())
+    elif body.stream:
+        return sse_json_patch_deltas(stream())
     else:
         return await last_value(stream())
 
@@ -62,4 +114,16 @@ def create_router(route_assistants: RouteAssistants) -> APIRouter:
 
         return await chat_handler(assistant, body)
 
+    @v1alpha_router.get("/assistants/{assistant_id}/llm_metrics")
+    async def llm_metrics(assistant_id: str) -> Dict[str, ModelMetrics]:
+        """
+        Queue depth, calls in flight and time waited by model, empty when the
+        assistant has no LLM scheduler
+        """
+        if assistant_id not in route_assistants.assistants:
+            raise HTTPException(status_code=404, detail="assistant not found")
+
+        scheduler = route_assistants.assistants[assistant_id].llm_scheduler
+        return scheduler.metrics() if scheduler is not None else {}
+
     return v1alpha_router
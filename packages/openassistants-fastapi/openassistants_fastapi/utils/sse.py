@@ -1,10 +1,26 @@
 import inspect
 import logging
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
 import jsonpatch  # type: ignore
 from fastapi.encoders import jsonable_encoder
+from openassistants.data_models.chat_messages import (
+    OpasAssistantMessage,
+    OpasFunctionMessage,
+    OpasMessage,
+)
+from openassistants.data_models.function_output import TextOutput
 from openassistants.utils.async_utils import AsyncStreamVersion
+from openassistants.utils.deltas import (
+    AddMessage,
+    AddOutput,
+    AppendContent,
+    AppendOutputText,
+    MessageDelta,
+    ReplaceMessage,
+    ReplaceOutput,
+    diff_messages,
+)
 from pydantic import BaseModel
 from sse_starlette import EventSourceResponse, ServerSentEvent
 
@@ -38,7 +54,171 @@ async def _patch_iter(src: AsyncStreamVersion) -> AsyncStreamVersion[str]:
 def sse_json_patch(
     src: AsyncStreamVersion,
 ) -> EventSourceResponse:
+    """
+    JSON patches between whole versions, for versions of any shape. See
+    sse_json_patch_deltas for versions with a `messages` field.
+    """
     return EventSourceResponse(
         content=_patch_iter(src),
         ping_message_factory=lambda: ServerSentEvent(),
     )
+
+
+def _delta_to_operation(
+    delta: MessageDelta, messages: List[OpasMessage]
+) -> Dict[str, Any]:
+    """
+    JSON Patch has no operation to append to a string, appended text replaces the
+    whole string. See sse_deltas for a format that only sends the appended text.
+    """
+    path = f"/messages/{delta.message_index}"
+    match delta:
+        case AddMessage():
+            return {"op": "add", "path": path, "value": jsonable_encoder(delta.message)}
+        case ReplaceMessage():
+            return {
+                "op": "replace",
+                "path": path,
+                "value": jsonable_encoder(delta.message),
+            }
+        case AppendContent():
+            message = messages[delta.message_index]
+            assert isinstance(message, OpasAssistantMessage)
+            return {
+                "op": "replace",
+                "path": f"{path}/content",
+                "value": message.content,
+            }
+        case AddOutput():
+            return {
+                "op": "add",
+                "path": f"{path}/outputs/{delta.output_index}",
+                "value": jsonable_encoder(delta.output),
+            }
+        case ReplaceOutput():
+            return {
+                "op": "replace",
+                "path": f"{path}/outputs/{delta.output_index}",
+                "value": jsonable_encoder(delta.output),
+            }
+        case AppendOutputText():
+            message = messages[delta.message_index]
+            assert isinstance(message, OpasFunctionMessage)
+            output = message.outputs[delta.output_index]
+            assert isinstance(output, TextOutput)
+            return {
+                "op": "replace",
+                "path": f"{path}/outputs/{delta.output_index}/text",
+                "value": output.text,
+            }
+    raise TypeError(f"unknown delta: {delta}")
+
+
+async def _delta_patch_iter(src: AsyncStreamVersion) -> AsyncStreamVersion[str]:
+    """
+    JSON patches between versions that hold a growing `messages` list.
+
+    Only the changes between versions are encoded, the messages are never diffed
+    as a whole. The remaining fields are expected to be small and are diffed as
+    plain JSON.
+    """
+    if not inspect.isasyncgen(src):
+        raise TypeError("src must be an async generator")
+    num_sent = 0
+    old_messages: Optional[List[OpasMessage]] = None
+    old_rest: Dict[str, Any] = {}
+    try:
+        async for new in src:
+            new_messages: List[OpasMessage] = new.messages
+            new_rest = jsonable_encoder(new, exclude={"messages"})
+
+            patch = jsonpatch.JsonPatch.from_diff(old_rest, new_rest).patch
+            if old_messages is None or len(new_messages) < len(old_messages):
+                patch.append(
+                    {
+                        "op": "add",
+                        "path": "/messages",
+                        "value": jsonable_encoder(new_messages),
+                    }
+                )
+            else:
+                patch.extend(
+                    _delta_to_operation(delta, new_messages)
+                    for delta in diff_messages(old_messages, new_messages)
+                )
+
+            old_messages = new_messages
+            old_rest = new_rest
+            yield _SSEJSONPatch(patch=patch).json()
+            num_sent += 1
+    except Exception as e:
+        logger.exception("Error while streaming response")
+        yield _SSEJSONPatch(error=dict(code=None, detail=str(e))).json()
+    finally:
+        logger.info(f"closing SSE JSON Patch stream. Sent {num_sent} messages.")
+
+
+def sse_json_patch_deltas(
+    src: AsyncStreamVersion,
+) -> EventSourceResponse:
+    """
+    JSON patches of versions with a `messages` field
+    """
+    return EventSourceResponse(
+        content=_delta_patch_iter(src),
+        ping_message_factory=lambda: ServerSentEvent(),
+    )
+
+
+class _SSEDeltas(BaseModel):
+    deltas: Optional[List[MessageDelta]] = None
+    patch: Optional[Any] = None
+    error: Optional[Any] = None
+
+
+async def _deltas_iter(src: AsyncStreamVersion) -> AsyncStreamVersion[str]:
+    """
+    A JSON patch of the remaining fields, then the message deltas between
+    versions that hold a growing `messages` list. Appended text is sent on its
+    own, see AppendContent and AppendOutputText. When the list shrinks, the patch
+    replaces it as a whole instead.
+    """
+    if not inspect.isasyncgen(src):
+        raise TypeError("src must be an async generator")
+    num_sent = 0
+    old_messages: Optional[List[OpasMessage]] = None
+    old_rest: Dict[str, Any] = {}
+    try:
+        async for new in src:
+            new_messages: List[OpasMessage] = new.messages
+            new_rest = jsonable_encoder(new, exclude={"messages"})
+
+            patch = jsonpatch.JsonPatch.from_diff(old_rest, new_rest).patch
+            if old_messages is None or len(new_messages) < len(old_messages):
+                patch.append({"op": "add", "path": "/messages", "value": []})
+                old_messages = []
+
+            yield _SSEDeltas(
+                deltas=diff_messages(old_messages, new_messages), patch=patch
+            ).json()
+            old_messages = new_messages
+            old_rest = new_rest
+            num_sent += 1
+    except Exception as e:
+        logger.exception("Error while streaming response")
+        yield _SSEDeltas(error=dict(code=None, detail=str(e))).json()
+    finally:
+        logger.info(f"closing SSE deltas stream. Sent {num_sent} messages.")
+
+
+def sse_deltas(
+    src: AsyncStreamVersion,
+) -> EventSourceResponse:
+    """
+    Message deltas of versions with a `messages` field, for clients that apply
+    AddMessage, AppendContent etc. themselves
+    """
+    return EventSourceResponse(
+        content=_deltas_iter(src),
+        ping_message_factory=lambda: ServerSentEvent(),
+    )
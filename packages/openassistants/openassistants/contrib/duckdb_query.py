@@ -14,6 +14,17 @@ class DuckDBQueryFunction(SQLAlchemyFunction):
     def __init__(self, **kwargs):
         super().__init__(engine=create_engine("duckdb:///:memory:"), **kwargs)
 
+    def __getstate__(self):
+        # engines can't be pickled, e.g. into a function catalog
+        state = super().__getstate__()
+        private = dict(state["__pydantic_private__"] or {})
+        private.pop("_engine", None)
+        return state | {"__pydantic_private__": private}
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._engine = create_engine("duckdb:///:memory:")
+
     async def _execute_sqls(
         self, deps: FunctionExecutionDependency
     ) -> List[pd.DataFrame]:
@@ -28,7 +28,14 @@ from openassistants.utils import yaml
 from openassistants.utils.async_utils import AsyncStreamVersion
 from openassistants.utils.history_representation import opas_to_interactions
 from openassistants.utils.langchain_util import string_from_message
+from openassistants.utils.llm_scheduler import (
+    LLMPriority,
+    astream_in_slot,
+    token_counting_enabled,
+)
 from openassistants.utils.strings import resolve_str_template
+from openassistants.utils.tokens import count_message_tokens, count_tokens
+from openassistants.utils.tracing import record_llm_call, span
 from pydantic import Field, PrivateAttr
 from sqlalchemy import text
 from sqlalchemy.engine import Engine
@@ -140,13 +147,23 @@ You will:
         )
 
         full: str = ""
+        prompt_tokens = (
+            count_message_tokens(lc_messages) if token_counting_enabled() else 0
+        )
+
+        with span("summarization") as active:
+            async for response_message in astream_in_slot(
+                deps.summarization_chat_model,
+                lc_messages,
+                {"tags": ["summarization"]},
+                prompt_tokens,
+                LLMPriority.SUMMARIZATION,
+            ):
+                full += string_from_message(response_message)
+                yield full
 
-        async for response_message in deps.summarization_chat_model.astream(
-            lc_messages,
-            {"tags": ["summarization"]},
-        ):
-            full += string_from_message(response_message)
-            yield full
+            if active is not None:
+                record_llm_call(prompt_tokens, count_tokens(full))
 
     async def execute(
         self,
@@ -159,7 +176,8 @@ You will:
 
         results: List[FunctionOutput] = []
 
-        dataframes = await self._execute_sqls(deps)
+        with span("sql"):
+            dataframes = await self._execute_sqls(deps)
         if self.data_table_output:
             results.extend(
                 [
@@ -170,7 +188,8 @@ You will:
 
             yield results
 
-        visualizations = await self._execute_visualizations(dataframes, deps)
+        with span("visualization"):
+            visualizations = await self._execute_visualizations(dataframes, deps)
 
         results.extend(
             [VisualizationOutput(visualization=viz) for viz in visualizations]
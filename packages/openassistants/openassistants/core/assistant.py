@@ -1,6 +1,11 @@
 import asyncio
-from typing import Any, Dict, List, Optional, Tuple
+import contextlib
+import hashlib
+import json
+import logging
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
 
+import jsonschema
 from langchain.chat_models.base import BaseChatModel
 from langchain.chat_models.openai import ChatOpenAI
 from langchain.embeddings import OpenAIEmbeddings
@@ -13,6 +18,7 @@ from openassistants.data_models.chat_messages import (
     OpasUserMessage,
 )
 from openassistants.data_models.function_input import FunctionCall, FunctionInputRequest
+from openassistants.data_models.function_output import FunctionOutput
 from openassistants.functions.base import (
     FunctionExecutionDependency,
     IEntity,
@@ -20,19 +26,92 @@ from openassistants.functions.base import (
     IFunctionLibrary,
 )
 from openassistants.functions.crud import PythonLibrary
-from openassistants.llm_function_calling.entity_resolution import resolve_entities
+from openassistants.functions.registry import FunctionRegistry
+from openassistants.llm_function_calling.cache import IGenerationCache
+from openassistants.llm_function_calling.entity_index import EntityIndexManager
+from openassistants.llm_function_calling.entity_resolution import (
+    entity_arguments_resolved,
+    resolve_entities,
+    resolve_entities_with_arguments,
+)
 from openassistants.llm_function_calling.fallback import perform_general_qa
 from openassistants.llm_function_calling.infilling import (
+    ArgumentDecisionDict,
     generate_argument_decisions,
     generate_arguments,
+    generate_arguments_and_decisions,
+)
+from openassistants.llm_function_calling.prompt_context import PromptContext
+from openassistants.llm_function_calling.sample_questions import (
+    SampleQuestionMatcher,
 )
 from openassistants.llm_function_calling.selection import (
+    IFunctionSelector,
     SelectFunctionResult,
     select_function,
 )
-from openassistants.utils.async_utils import AsyncStreamVersion
+from openassistants.llm_function_calling.shortlist import FunctionShortlist
+from openassistants.utils.async_utils import (
+    AsyncStreamVersion,
+    Prefetch,
+    T,
+    coalesce,
+)
 from openassistants.utils.langchain_util import LangChainCachedEmbeddings
-from openassistants.utils.vision import image_url_to_text
+from openassistants.utils.llm_scheduler import LLMScheduler, use_llm_scheduler
+from openassistants.utils.lru_cache import LRUCache
+from openassistants.utils.stage_policy import StagePolicy, StageRunner, use_stage_runner
+from openassistants.utils.tokens import load_encoding
+from openassistants.utils.tracing import ITraceHook, set_trace_attribute, span, trace
+from openassistants.utils.vision import aimage_url_to_text, image_cache_key
+
+logger = logging.getLogger(__name__)
+
+
+def _message_content_key(content: list) -> str:
+    return hashlib.sha256(
+        json.dumps(content, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def _retrieve_exception(task: asyncio.Task) -> None:
+    # speculative tasks may fail or be discarded without being awaited
+    if not task.cancelled():
+        task.exception()
+
+
+class _Speculation:
+    """
+    The infilling of a function and the execution started speculatively with the
+    arguments it generated, if any
+    """
+
+    infilling: "asyncio.Task[Tuple[bool, dict]]"
+    execution: Optional[Tuple[dict, Prefetch]] = None
+
+    def outputs(
+        self, arguments: Optional[dict]
+    ) -> Optional[AsyncStreamVersion[Sequence[FunctionOutput]]]:
+        """
+        The outputs of the execution if it was started with these arguments.
+        Otherwise the execution is cancelled and None is returned.
+        """
+        if self.execution is None:
+            return None
+        execution_arguments, prefetch = self.execution
+        if arguments is not None and arguments == execution_arguments:
+            return prefetch.stream()
+        prefetch.cancel()
+        return None
+
+    def cancel(self) -> None:
+        self.infilling.cancel()
+        if self.execution is not None:
+            self.execution[1].cancel()
+
+
+def _outputs_structure(outputs: Sequence[FunctionOutput]) -> Tuple[str, ...]:
+    return tuple(output.type for output in outputs)
 
 
 class Assistant:
@@ -41,10 +120,33 @@ class Assistant:
     function_summarization: BaseChatModel
     function_fallback: BaseChatModel
     entity_embedding_model: Embeddings
+    entity_index_manager: EntityIndexManager
+    function_shortlist: Optional[FunctionShortlist]
+    llm_cache: Optional[IGenerationCache]
     function_libraries: List[IFunctionLibrary]
     scope_description: str
+    trace_hooks: List[ITraceHook]
+    stream_flush_interval_ms: Optional[float]
+    stream_flush_max_pending: Optional[int]
+    history_token_budget: Optional[int]
+    history_dataframe_max_rows: Optional[int]
+    selection_chunk_token_budget: Optional[int]
+    selection_max_concurrency: Optional[int]
+    hierarchical_selection: bool
+    function_selector: Optional[IFunctionSelector]
+    function_selector_threshold: float
+    speculative_infilling: bool
+    speculative_infilling_max_candidates: int
+    speculative_execution: bool
+    llm_scheduler: Optional[LLMScheduler]
+    stage_policies: Dict[str, StagePolicy]
+    selection_max_rounds: int
+    image_description_cache: LRUCache[str, str]
 
-    _cached_all_functions: List[IFunction]
+    _registry: Optional[FunctionRegistry]
+    _sample_question_matcher: Optional[SampleQuestionMatcher]
+    _flattened_messages: LRUCache[str, str]
+    _stage_runner: Optional[StageRunner]
 
     def __init__(
         self,
@@ -55,8 +157,31 @@ class Assistant:
         function_fallback: Optional[BaseChatModel] = None,
         vision_model: Optional[BaseChatModel] = None,
         entity_embedding_model: Optional[Embeddings] = None,
+        entity_index_manager: Optional[EntityIndexManager] = None,
+        function_shortlist: Optional[FunctionShortlist] = None,
         scope_description: str = "General assistant.",
         add_index: bool = True,
+        sample_question_matching: bool = False,
+        llm_cache: Optional[IGenerationCache] = None,
+        combined_infilling: bool = False,
+        pipelined_entity_resolution: bool = False,
+        trace_hooks: Optional[List[ITraceHook]] = None,
+        stream_flush_interval_ms: Optional[float] = None,
+        stream_flush_max_pending: Optional[int] = None,
+        history_token_budget: Optional[int] = None,
+        history_dataframe_max_rows: Optional[int] = None,
+        image_description_cache: Optional[LRUCache[str, str]] = None,
+        selection_chunk_token_budget: Optional[int] = None,
+        selection_max_concurrency: Optional[int] = 8,
+        hierarchical_selection: bool = False,
+        selection_max_rounds: int = 4,
+        function_selector: Optional[IFunctionSelector] = None,
+        function_selector_threshold: float = 0.8,
+        speculative_infilling: bool = False,
+        speculative_infilling_max_candidates: int = 2,
+        speculative_execution: bool = False,
+        llm_scheduler: Optional[LLMScheduler] = None,
+        stage_policies: Optional[Dict[str, StagePolicy]] = None,
     ):
         # instantiate dynamically vs as default args
         self.function_identification = function_identification or ChatOpenAI(
@@ -79,8 +204,40 @@ class Assistant:
         self.entity_embedding_model = (
             entity_embedding_model or LangChainCachedEmbeddings(OpenAIEmbeddings())
         )
+        self.entity_index_manager = entity_index_manager or EntityIndexManager(
+            self.entity_embedding_model
+        )
+        self.function_shortlist = function_shortlist
+        self.sample_question_matching = sample_question_matching
+        self.llm_cache = llm_cache
+        self.combined_infilling = combined_infilling
+        self.pipelined_entity_resolution = pipelined_entity_resolution
+        self.trace_hooks = trace_hooks or []
+        self.stream_flush_interval_ms = stream_flush_interval_ms
+        self.stream_flush_max_pending = stream_flush_max_pending
+        self.history_token_budget = history_token_budget
+        self.history_dataframe_max_rows = history_dataframe_max_rows
+        self.image_description_cache = image_description_cache or LRUCache(256)
+        self.selection_chunk_token_budget = selection_chunk_token_budget
+        self.selection_max_concurrency = selection_max_concurrency
+        self.hierarchical_selection = hierarchical_selection
+        self.selection_max_rounds = selection_max_rounds
+        self.function_selector = function_selector
+        self.function_selector_threshold = function_selector_threshold
+        self.speculative_infilling = speculative_infilling
+        self.speculative_infilling_max_candidates = speculative_infilling_max_candidates
+        self.speculative_execution = speculative_execution
+        self.llm_scheduler = llm_scheduler
+        # by stage, e.g. "filter_functions" or "generate_arguments"
+        self.stage_policies = stage_policies or {}
+        self._stage_runner = (
+            StageRunner(self.stage_policies) if self.stage_policies else None
+        )
         self.function_libraries = libraries
 
+        # now rather than inside the first request
+        load_encoding()
+
         if add_index:
             index_func: IFunction = IndexFunction(
                 id="index",
@@ -99,29 +256,122 @@ class Assistant:
 
             self.function_libraries.append(PythonLibrary(functions=[index_func]))
 
-        self._cached_all_functions = []
+        self._registry = None
+        self._sample_question_matcher = None
+        self._reload_lock = asyncio.Lock()
+        self._flattened_messages = LRUCache(1024)
+
+    async def reload_functions(self) -> FunctionRegistry:
+        """
+        Load the functions from the libraries again and swap in the new registry.
+        Requests that are already running keep using the previous one.
+        Concurrent reloads run one after the other.
+        """
+        async with self._reload_lock:
+            return await self._load_functions()
+
+    async def _load_functions(self) -> FunctionRegistry:
+        functions: List[IFunction] = []
+        groups: Dict[str, str] = {}
+        signatures: Dict[str, str] = {}
+        for index, library in enumerate(self.function_libraries):
+            library_functions = await library.get_all_functions()
+            functions.extend(library_functions)
+            group = getattr(library, "library_id", None) or f"library-{index}"
+            for function in library_functions:
+                groups.setdefault(function.get_id(), group)
+            if (catalog := getattr(library, "catalog", None)) is not None:
+                for function in library_functions:
+                    # functions parsed again since the catalog was loaded differ
+                    function_id = function.get_id()
+                    if catalog.functions.get(function_id) is function:
+                        signatures[function_id] = catalog.signatures[function_id]
+                if self.function_shortlist is not None:
+                    catalog.seed_shortlist(self.function_shortlist)
+        return self.set_functions(functions, groups, signatures)
+
+    def set_functions(
+        self,
+        functions: Sequence[IFunction],
+        groups: Optional[Mapping[str, str]] = None,
+        signatures: Optional[Mapping[str, str]] = None,
+    ) -> FunctionRegistry:
+        """
+        groups maps function ids to their library and signatures holds
+        precomputed signatures, see FunctionRegistry
+        """
+        registry = FunctionRegistry(
+            functions, previous=self._registry, groups=groups, signatures=signatures
+        )
+        matcher = (
+            SampleQuestionMatcher(registry.functions)
+            if self.sample_question_matching
+            else None
+        )
+        # swap both at once, without awaiting in between
+        self._registry, self._sample_question_matcher = registry, matcher
+        return registry
+
+    async def watch_libraries(self) -> None:
+        """
+        Reload the functions whenever a library reports a change.
+        Runs until cancelled, e.g. as a background task of the server.
+        """
+
+        async def watch(library: IFunctionLibrary):
+            async for _ in library.watch():
+                try:
+                    await self.reload_functions()
+                except Exception:
+                    # keep serving the previous functions, e.g. for a half-saved file
+                    logger.exception("Failed to reload functions")
+
+        await asyncio.gather(*[watch(library) for library in self.function_libraries])
+
+    async def get_registry(self) -> FunctionRegistry:
+        if (registry := self._registry) is None:
+            async with self._reload_lock:
+                registry = self._registry
+                # unless loaded by a concurrent request while waiting for the lock
+                if registry is None:
+                    registry = await self._load_functions()
+        return registry
 
     async def get_all_functions(self) -> List[IFunction]:
-        if not self._cached_all_functions:
-            functions: List[IFunction] = []
-            for library in self.function_libraries:
-                functions.extend(await library.get_all_functions())
-            self._cached_all_functions = functions
-        return self._cached_all_functions
+        return (await self.get_registry()).functions
 
     async def get_function_by_id(self, function_id: str) -> Optional[IFunction]:
-        functions = await self.get_all_functions()
-        for function in functions:
-            if function.get_id() == function_id:
-                return function
-        return None
+        return (await self.get_registry()).get(function_id)
+
+    def coalesce_versions(
+        self,
+        src: AsyncStreamVersion[T],
+        structure_key: Optional[Callable[[T], Any]] = None,
+    ) -> AsyncStreamVersion[T]:
+        """
+        Limit how often token by token outputs are passed on to run_chat consumers.
+        Disabled unless stream_flush_interval_ms is set.
+        """
+        if self.stream_flush_interval_ms is None:
+            return src
+        return coalesce(
+            src,
+            self.stream_flush_interval_ms,
+            self.stream_flush_max_pending,
+            structure_key,
+        )
 
     async def execute_function(
         self,
         function: IFunction,
         func_args: Dict[str, Any],
         dependencies: Dict[str, Any],
+        outputs: Optional[AsyncStreamVersion[Sequence[FunctionOutput]]] = None,
     ):
+        """
+        outputs is the output stream of an execution with these arguments that
+        was already started, e.g. speculatively
+        """
         deps = FunctionExecutionDependency(
             arguments=func_args,
             **dependencies,
@@ -134,41 +384,185 @@ class Assistant:
 
         yield [function_call_invocation]
 
-        async for version in function.execute(deps):
-            yield [
-                function_call_invocation,
-                OpasFunctionMessage(name=function.get_id(), outputs=list(version)),
-            ]
+        with span("execute_function", function_id=function.get_id()):
+            async for version in self.coalesce_versions(
+                outputs or function.execute(deps), _outputs_structure
+            ):
+                yield [
+                    function_call_invocation,
+                    OpasFunctionMessage(name=function.get_id(), outputs=list(version)),
+                ]
 
     async def do_infilling(
         self,
-        dependencies: dict,
+        prompt_context: PromptContext,
         message: OpasUserMessage,
         selected_function: IFunction,
         args_json_schema: dict,
         entities_info: Dict[str, List[IEntity]],
+        on_arguments: Optional[Callable[[dict], None]] = None,
+        seeded_arguments: Optional[Dict[str, Any]] = None,
     ) -> Tuple[bool, dict]:
-        # Perform infilling and generate argument decisions in parallel
-        chat_history: List[OpasMessage] = dependencies.get("chat_history")  # type: ignore
-        arguments_future = asyncio.create_task(
-            generate_arguments(
+        """
+        on_arguments is called with the generated arguments as soon as they are
+        available. With separate calls that is before the argument decisions,
+        with combined_infilling both arrive together and there is nothing to
+        overlap.
+
+        The LLM only fills the arguments that are not seeded, see
+        _known_arguments.
+        """
+        known_arguments = self._known_arguments(seeded_arguments, entities_info)
+        if self.combined_infilling:
+            # Get argument values and decisions from a single LLM call
+            arguments, argument_decisions = await generate_arguments_and_decisions(
                 selected_function,
                 self.function_infilling,
                 message.content,
-                chat_history,
+                prompt_context,
                 entities_info,
+                self.llm_cache,
+                known_arguments,
             )
-        )
+            if on_arguments is not None:
+                on_arguments(arguments)
+        else:
+            # Perform infilling and generate argument decisions in parallel
+            arguments_future = asyncio.create_task(
+                generate_arguments(
+                    selected_function,
+                    self.function_infilling,
+                    message.content,
+                    prompt_context,
+                    entities_info,
+                    self.llm_cache,
+                    known_arguments,
+                )
+            )
+            argument_decisions_future = asyncio.create_task(
+                generate_argument_decisions(
+                    selected_function,
+                    self.function_infilling,
+                    message.content,
+                    prompt_context,
+                    self.llm_cache,
+                    seeded_arguments,
+                )
+            )
+            arguments = await arguments_future
+            if on_arguments is not None:
+                on_arguments(arguments)
+            argument_decisions = await argument_decisions_future
+
+        return self._check_arguments(arguments, argument_decisions, args_json_schema)
+
+    async def do_pipelined_infilling(
+        self,
+        prompt_context: PromptContext,
+        message: OpasUserMessage,
+        selected_function: IFunction,
+        args_json_schema: dict,
+        seeded_arguments: Optional[Dict[str, Any]],
+        on_arguments: Optional[Callable[[dict], None]] = None,
+    ) -> Tuple[bool, dict]:
+        """
+        Entity resolution and infilling with argument decisions running alongside.
+        The preliminary arguments used for entity lookup are kept as the final
+        arguments when they already name resolved entities exactly. In that case
+        they are passed to on_arguments before the argument decisions are awaited.
+        Otherwise the arguments are generated while the decisions are still running.
+        """
+        if len(await selected_function.get_entity_configs()) == 0:
+            # no entities to look up, nothing to reuse
+            if self._seeded_arguments_complete(seeded_arguments, args_json_schema, {}):
+                return True, seeded_arguments  # type: ignore
+            return await self.do_infilling(
+                prompt_context,
+                message,
+                selected_function,
+                args_json_schema,
+                {},
+                on_arguments,
+                seeded_arguments,
+            )
+
         argument_decisions_future = asyncio.create_task(
             generate_argument_decisions(
                 selected_function,
                 self.function_infilling,
                 message.content,
-                chat_history,
+                prompt_context,
+                self.llm_cache,
+                seeded_arguments,
             )
         )
-        arguments = await arguments_future
-        argument_decisions = await argument_decisions_future
+        arguments_future: Optional[asyncio.Task[dict]] = None
+
+        def start_infilling() -> asyncio.Task[dict]:
+            return asyncio.create_task(
+                generate_arguments(
+                    selected_function,
+                    self.function_infilling,
+                    message.content,
+                    prompt_context,
+                    entities_info,
+                    self.llm_cache,
+                    self._known_arguments(seeded_arguments, entities_info),
+                )
+            )
+
+        try:
+            (
+                entities_info,
+                preliminary_arguments,
+            ) = await resolve_entities_with_arguments(
+                selected_function,
+                self.function_infilling,
+                self.entity_index_manager,
+                message.content,
+                prompt_context,
+                seeded_arguments,
+                self.llm_cache,
+            )
+
+            if self._seeded_arguments_complete(
+                seeded_arguments, args_json_schema, entities_info
+            ):
+                return True, seeded_arguments  # type: ignore
+
+            if entity_arguments_resolved(preliminary_arguments, entities_info):
+                if on_arguments is not None:
+                    on_arguments(preliminary_arguments)
+                argument_decisions = await argument_decisions_future
+                if all(
+                    arg_name in preliminary_arguments
+                    for arg_name, arg_decision in argument_decisions.items()
+                    if arg_decision["needed"] and arg_decision["can_be_found"]
+                ):
+                    arguments = preliminary_arguments
+                else:
+                    # a needed argument is missing after all
+                    arguments_future = start_infilling()
+                    arguments = await arguments_future
+            else:
+                arguments_future = start_infilling()
+                arguments = await arguments_future
+                if on_arguments is not None:
+                    on_arguments(arguments)
+                argument_decisions = await argument_decisions_future
+        finally:
+            argument_decisions_future.cancel()
+            if arguments_future is not None:
+                arguments_future.cancel()
+
+        return self._check_arguments(arguments, argument_decisions, args_json_schema)
+
+    @staticmethod
+    def _check_arguments(
+        arguments: dict,
+        argument_decisions: ArgumentDecisionDict,
+        args_json_schema: dict,
+    ) -> Tuple[bool, dict]:
         # Filter arguments that are not needed or cannot be inferred
         arguments = {
             arg_name: arg_value
@@ -197,48 +591,270 @@ class Assistant:
 
         return complete, arguments
 
+    @staticmethod
+    def _seeded_arguments_complete(
+        seeded_arguments: Optional[Dict[str, Any]],
+        args_json_schema: dict,
+        entities_info: Dict[str, List[IEntity]],
+    ) -> bool:
+        """
+        Whether the seeded arguments can be used as is, without infilling
+        """
+        if seeded_arguments is None or len(entities_info) > 0:
+            return False
+        if set(seeded_arguments) != set(args_json_schema["properties"]):
+            return False
+        try:
+            jsonschema.validate(seeded_arguments, args_json_schema)
+        except jsonschema.ValidationError:
+            return False
+        return True
+
+    @staticmethod
+    def _known_arguments(
+        seeded_arguments: Optional[Dict[str, Any]],
+        entities_info: Dict[str, List[IEntity]],
+    ) -> Dict[str, Any]:
+        """
+        The seeded arguments that infilling keeps as they are. Seeded entity
+        arguments were only used to look up the entities, the LLM still picks
+        one of these.
+        """
+        return {
+            arg_name: arg_value
+            for arg_name, arg_value in (seeded_arguments or {}).items()
+            if arg_name not in entities_info
+        }
+
+    async def infill_arguments(
+        self,
+        prompt_context: PromptContext,
+        message: OpasUserMessage,
+        selected_function: IFunction,
+        seeded_arguments: Optional[Dict[str, Any]],
+        on_arguments: Optional[Callable[[dict], None]] = None,
+    ) -> Tuple[bool, dict]:
+        """
+        Entity resolution and argument infilling for the selected function,
+        see do_infilling and do_pipelined_infilling for on_arguments
+        """
+        selected_function_arg_json_schema = (
+            selected_function.get_parameters_json_schema()
+        )
+
+        if len(selected_function_arg_json_schema["properties"]) == 0:
+            return True, {}
+
+        if self.pipelined_entity_resolution:
+            with span("pipelined_infilling"):
+                return await self.do_pipelined_infilling(
+                    prompt_context,
+                    message,
+                    selected_function,
+                    selected_function_arg_json_schema,
+                    seeded_arguments,
+                    on_arguments,
+                )
+
+        with span("resolve_entities"):
+            entities_info = await resolve_entities(
+                selected_function,
+                self.function_infilling,
+                self.entity_index_manager,
+                message.content,
+                prompt_context,
+                seeded_arguments,
+                self.llm_cache,
+            )
+
+        if self._seeded_arguments_complete(
+            seeded_arguments, selected_function_arg_json_schema, entities_info
+        ):
+            return True, seeded_arguments  # type: ignore
+
+        with span("infilling"):
+            return await self.do_infilling(
+                prompt_context,
+                message,
+                selected_function,
+                selected_function_arg_json_schema,
+                entities_info,
+                on_arguments,
+                seeded_arguments,
+            )
+
+    async def _speculative_execution(
+        self,
+        function: IFunction,
+        arguments: dict,
+        dependencies: Dict[str, Any],
+    ) -> AsyncStreamVersion[Sequence[FunctionOutput]]:
+        deps = FunctionExecutionDependency(arguments=arguments, **dependencies)
+        with span("speculative_execution", function_id=function.get_id()):
+            async for version in function.execute(deps):
+                yield version
+
+    async def _speculative_infilling(
+        self,
+        prompt_context: PromptContext,
+        message: OpasUserMessage,
+        candidate: IFunction,
+        on_arguments: Optional[Callable[[dict], None]],
+    ) -> Tuple[bool, dict]:
+        with span("speculative_infilling", function_id=candidate.get_id()):
+            return await self.infill_arguments(
+                prompt_context, message, candidate, None, on_arguments
+            )
+
+    def _start_infilling(
+        self,
+        prompt_context: PromptContext,
+        message: OpasUserMessage,
+        function: IFunction,
+        seeded_arguments: Optional[Dict[str, Any]],
+        dependencies: Dict[str, Any],
+        autorun: bool,
+        candidate: bool = False,
+    ) -> _Speculation:
+        """
+        Infill the arguments of the function in a task. With speculative_execution,
+        a side effect free function that can autorun starts executing as soon as
+        valid arguments are generated. This applies to the selected function and
+        also to a candidate that is still being selected.
+        """
+        speculation = _Speculation()
+        args_json_schema = function.get_parameters_json_schema()
+
+        def execute(arguments: dict) -> None:
+            try:
+                jsonschema.validate(arguments, args_json_schema)
+            except jsonschema.ValidationError:
+                return
+            speculation.execution = (
+                arguments,
+                Prefetch(
+                    self._speculative_execution(function, arguments, dependencies)
+                ),
+            )
+
+        on_arguments = (
+            execute
+            if self.speculative_execution
+            and autorun
+            and not function.get_confirm()
+            and function.get_side_effect_free()
+            else None
+        )
+        speculation.infilling = asyncio.create_task(
+            self._speculative_infilling(prompt_context, message, function, on_arguments)
+            if candidate
+            else self.infill_arguments(
+                prompt_context, message, function, seeded_arguments, on_arguments
+            )
+        )
+        return speculation
+
     async def run_function_selection(
         self,
         chat_history: List[OpasMessage],
+        registry: Optional[FunctionRegistry] = None,
+        on_candidates: Optional[Callable[[List[IFunction]], None]] = None,
     ) -> SelectFunctionResult:
-        all_functions = await self.get_all_functions()
+        if registry is None:
+            registry = await self.get_registry()
 
         last_message = chat_history[-1]
 
         assert isinstance(last_message, OpasUserMessage)
         assert isinstance(last_message.content, str)
 
-        select_function_result = await select_function(
-            self.function_identification,
-            all_functions,
-            last_message.content,
-        )
+        with span("select_function"):
+            select_function_result = await select_function(
+                self.function_identification,
+                registry,
+                last_message.content,
+                chunk_token_budget=self.selection_chunk_token_budget,
+                max_concurrency=self.selection_max_concurrency,
+                shortlist=self.function_shortlist,
+                cache=self.llm_cache,
+                hierarchical=self.hierarchical_selection,
+                max_rounds=self.selection_max_rounds,
+                selector=self.function_selector,
+                selector_threshold=self.function_selector_threshold,
+                on_candidates=on_candidates,
+            )
 
         return select_function_result
 
     async def handle_user_plaintext(
         self,
         message: OpasUserMessage,
-        all_functions: List[IFunction],
+        registry: FunctionRegistry,
         dependencies: Dict[str, Any],
         autorun: bool,
         force_select_function: Optional[str],
     ) -> AsyncStreamVersion[List[OpasMessage]]:
         selected_function: Optional[IFunction] = None
+        # arguments known before infilling, e.g. from a matched sample question
+        seeded_arguments: Optional[Dict[str, Any]] = None
         # perform entity resolution
         chat_history: List[OpasMessage] = dependencies.get("chat_history")  # type: ignore
+        prompt_context = PromptContext(
+            chat_history,
+            self.history_token_budget,
+            registry,
+            self.history_dataframe_max_rows,
+        )
 
         # Perform function selection
         if force_select_function is not None:
-            filtered = [f for f in all_functions if f.get_id() == force_select_function]
-            if len(filtered) == 0:
+            selected_function = registry.get(force_select_function)
+            if selected_function is None:
                 raise ValueError("function not found")
-            selected_function = filtered[0]
+
+        # Skip LLM selection when the query unambiguously matches a sample question
+        if selected_function is None and self._sample_question_matcher is not None:
+            if match := self._sample_question_matcher.match(message.content):
+                selected_function = match.function
+                seeded_arguments = match.arguments
+
+        # infilling of the selected function, if it was started during selection
+        speculation: Optional[_Speculation] = None
 
         if selected_function is None:
-            function_selection = await self.run_function_selection(
-                chat_history=chat_history,
-            )
+            speculations: Dict[str, _Speculation] = {}
+
+            def speculate(candidates: List[IFunction]) -> None:
+                if len(candidates) > self.speculative_infilling_max_candidates:
+                    return
+                for candidate in candidates:
+                    candidate_speculation = self._start_infilling(
+                        prompt_context,
+                        message,
+                        candidate,
+                        None,
+                        dependencies,
+                        autorun,
+                        candidate=True,
+                    )
+                    candidate_speculation.infilling.add_done_callback(
+                        _retrieve_exception
+                    )
+                    speculations[candidate.get_id()] = candidate_speculation
+
+            try:
+                function_selection = await self.run_function_selection(
+                    chat_history=chat_history,
+                    registry=registry,
+                    on_candidates=speculate if self.speculative_infilling else None,
+                )
+                if function_selection.function:
+                    speculation = speculations.pop(
+                        function_selection.function.get_id(), None
+                    )
+            finally:
+                for candidate_speculation in speculations.values():
+                    candidate_speculation.cancel()
 
             if function_selection.function:
                 selected_function = function_selection.function
@@ -258,11 +874,13 @@ class Assistant:
             else:
                 # In case no function was found and no suggested functions were found
                 # attempt to directly perform the request requested by the user.
-                async for output in perform_general_qa(
-                    chat=self.function_fallback,
-                    chat_history=dependencies.get("chat_history"),  # type: ignore
-                    user_query=message.content,
-                    scope_description=self.scope_description,
+                async for output in self.coalesce_versions(
+                    perform_general_qa(
+                        chat=self.function_fallback,
+                        chat_history=prompt_context,
+                        user_query=message.content,
+                        scope_description=self.scope_description,
+                    )
                 ):
                     yield [
                         OpasAssistantMessage(content=output),
@@ -270,38 +888,38 @@ class Assistant:
 
                 return
 
+        set_trace_attribute("function_id", selected_function.get_id())
+
         selected_function_arg_json_schema = (
             selected_function.get_parameters_json_schema()
         )
 
-        entities_info = await resolve_entities(
-            selected_function,
-            self.function_infilling,
-            self.entity_embedding_model,
-            message.content,
-            chat_history,
-        )
+        can_autorun = autorun
+        if selected_function.get_confirm():
+            can_autorun = False
 
-        # perform argument infilling
-        if len(selected_function_arg_json_schema["properties"]) > 0:
-            complete, arguments = await self.do_infilling(
-                dependencies,
+        if speculation is None:
+            speculation = self._start_infilling(
+                prompt_context,
                 message,
                 selected_function,
-                selected_function_arg_json_schema,
-                entities_info,
+                seeded_arguments,
+                dependencies,
+                autorun,
             )
-        else:
-            complete, arguments = True, {}
+        try:
+            complete, arguments = await speculation.infilling
+        except BaseException:
+            speculation.cancel()
+            raise
 
-        can_autorun = autorun
-        if selected_function.get_confirm():
-            can_autorun = False
+        # the execution started before the argument decisions, if it still applies
+        outputs = speculation.outputs(arguments if can_autorun and complete else None)
 
         if can_autorun and complete:
             # execute
             async for version in self.execute_function(
-                selected_function, arguments, dependencies
+                selected_function, arguments, dependencies, outputs
             ):
                 yield version
             return
@@ -324,17 +942,13 @@ class Assistant:
     async def handle_user_input(
         self,
         message: OpasUserMessage,
-        all_functions: List[IFunction],
+        registry: FunctionRegistry,
         dependencies: Dict[str, Any],
     ) -> AsyncStreamVersion[List[OpasMessage]]:
         if message.input_response is None:
             raise ValueError("message must have input_response")
 
-        selected_function: Optional[IFunction] = None
-
-        for f in all_functions:
-            if f.get_id() == message.input_response.name:
-                selected_function = f
+        selected_function = registry.get(message.input_response.name)
 
         if selected_function is None:
             raise ValueError("function not found")
@@ -354,11 +968,17 @@ class Assistant:
             if isinstance(content, dict) and content.get("type") == "image_url":
                 image_description = "Image described as {}".format(content["filename"])
                 if self.vision_model is not None and idx == len(messages) - 1:
-                    image_description = image_url_to_text(
+                    image_description = await aimage_url_to_text(
                         vision_model=self.vision_model,
                         image_url=content["image_url"],
                         text_context=text_context,
+                        cache=self.image_description_cache,
                     )
+                elif cached_description := self.image_description_cache.get(
+                    image_cache_key(content["image_url"], text_context)
+                ):
+                    # described when it was sent, reuse that for the history
+                    image_description = cached_description
                 message.content[i] = {
                     "type": "text",
                     "text": image_description,
@@ -367,9 +987,20 @@ class Assistant:
             piece["text"] for piece in message.content if piece.get("type") == "text"
         )
 
+    async def _flatten_list_message(self, messages, message, idx):
+        key = _message_content_key(message.content)
+        # clients resend the history every turn, reuse what earlier turns produced
+        if idx != len(messages) - 1 and (
+            flattened := self._flattened_messages.get(key)
+        ):
+            message.content = flattened
+            return
+        await self.convert_list_message(messages, message, idx)
+        self._flattened_messages.set(key, message.content)
+
     async def pre_process_messages(self, messages):
         tasks = [
-            self.convert_list_message(messages, message, idx)
+            self._flatten_list_message(messages, message, idx)
             for idx, message in enumerate(messages)
             if isinstance(message, OpasUserMessage)
             and isinstance(message.content, list)
@@ -382,10 +1013,36 @@ class Assistant:
         messages: List[OpasMessage],
         autorun: bool = True,
         force_select_function: Optional[str] = None,
+        trace_hooks: Sequence[ITraceHook] = (),
+    ) -> AsyncStreamVersion[List[OpasMessage]]:
+        """
+        trace_hooks receive the span tree of this request, in addition to the
+        hooks of the assistant
+        """
+        with trace("run_chat", [*self.trace_hooks, *trace_hooks]), (
+            use_llm_scheduler(self.llm_scheduler)
+            if self.llm_scheduler is not None
+            else contextlib.nullcontext()
+        ), (
+            use_stage_runner(self._stage_runner)
+            if self._stage_runner is not None
+            else contextlib.nullcontext()
+        ):
+            async for version in self._run_chat(
+                messages, autorun, force_select_function
+            ):
+                yield version
+
+    async def _run_chat(
+        self,
+        messages: List[OpasMessage],
+        autorun: bool,
+        force_select_function: Optional[str],
     ) -> AsyncStreamVersion[List[OpasMessage]]:
         last_message = messages[-1]
 
-        messages = await self.pre_process_messages(messages)
+        with span("pre_process_messages"):
+            messages = await self.pre_process_messages(messages)
 
         dependencies = {
             "chat_history": messages,
@@ -395,15 +1052,17 @@ class Assistant:
         if not isinstance(last_message, OpasUserMessage):
             raise ValueError("last message must be a user message")
 
+        registry = await self.get_registry()
+
         if last_message.input_response is not None:
             async for version in self.handle_user_input(
-                last_message, await self.get_all_functions(), dependencies
+                last_message, registry, dependencies
             ):
                 yield version
         else:
             async for version in self.handle_user_plaintext(
                 last_message,
-                await self.get_all_functions(),
+                registry,
                 dependencies,
                 autorun,
                 force_select_function,
@@ -1,18 +1,88 @@
-from typing import Any, List
+import json
+from typing import Any, List, Optional
 
 import pandas as pd
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr, model_serializer
 
 
 class SerializedDataFrame(BaseModel):
+    """
+    A dataframe in "split" orientation: column names, dtypes and rows.
+
+    Frames created with from_pd or from_arrow keep the pandas frame and only
+    render the JSON rows when they are first needed, e.g. when the model is
+    serialized. `data` is None for such frames, the rendered rows are cached.
+    Frames parsed from JSON are converted to pandas once, on the first to_pd
+    call.
+
+    The serialized form always has `data`, plus the `dtypes` of the columns when
+    known, which clients may ignore.
+    """
+
     columns: List[str]
-    data: List[List[Any]]
+    dtypes: Optional[List[str]] = None
+    data: Optional[List[List[Any]]] = None
+
+    _df: Optional[pd.DataFrame] = PrivateAttr(default=None)
+    _rows: Optional[List[List[Any]]] = PrivateAttr(default=None)
 
     @staticmethod
-    def from_pd(df: pd.DataFrame):
-        return SerializedDataFrame.model_validate_json(
-            df.to_json(orient="split", index=False, date_format="iso")
+    def from_pd(df: pd.DataFrame) -> "SerializedDataFrame":
+        """
+        Keeps a copy-on-write copy of the frame, no rows are rendered. The
+        column labels become their str() names, as they are in the JSON form.
+        """
+        serialized = SerializedDataFrame(
+            columns=[str(column) for column in df.columns],
+            dtypes=[str(dtype) for dtype in df.dtypes],
         )
+        stored = df.reset_index(drop=True)
+        stored.columns = pd.Index(serialized.columns)
+        serialized._df = stored
+        return serialized
+
+    @staticmethod
+    def from_arrow(table: Any) -> "SerializedDataFrame":
+        """
+        Create from a pyarrow Table, e.g. a query result fetched as Arrow
+        """
+        return SerializedDataFrame.from_pd(table.to_pandas())
+
+    def to_pd(self) -> pd.DataFrame:
+        """
+        The frame is cached, it must not be modified by the caller
+        """
+        if self._df is None:
+            df = pd.DataFrame(self.data or [], columns=self.columns)
+            for column, dtype in zip(self.columns, self.dtypes or []):
+                try:
+                    df[column] = df[column].astype(pd.api.types.pandas_dtype(dtype))
+                except (TypeError, ValueError):
+                    # keep the inferred dtype
+                    pass
+            self._df = df
+        return self._df
+
+    def to_rows(self) -> List[List[Any]]:
+        """
+        The rows are cached, they must not be modified by the caller
+        """
+        if self.data is not None:
+            return self.data
+        if self._rows is None:
+            self._rows = json.loads(
+                self.to_pd().to_json(orient="values", date_format="iso")
+            )
+        return self._rows
+
+    @model_serializer(mode="wrap")
+    def _serialize(self, handler) -> dict:
+        serialized = handler(self)
+        if serialized.get("data") is None:
+            serialized["data"] = self.to_rows()
+        return serialized
 
-    def to_pd(self):
-        return pd.DataFrame(**self.model_dump())
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, SerializedDataFrame):
+            return NotImplemented
+        return self.columns == other.columns and self.to_rows() == other.to_rows()
@@ -14,6 +14,7 @@ from openassistants.data_models.function_input import FunctionCall
 from openassistants.data_models.function_output import DataFrameOutput, TextOutput
 from openassistants.functions.base import IFunction
 from openassistants.utils.async_utils import last_value
+from openassistants.utils.llm_scheduler import LLMPriority, llm_priority
 from pydantic import BaseModel, ConfigDict, InstanceOf
 
 
@@ -101,6 +102,24 @@ class FunctionInteraction(FunctionInteractionNode):
         select_function: bool = True,
         invoke_function: bool = True,
         get_function_spec: bool = True,
+    ) -> "FunctionInteractionResponse":
+        # eval traffic yields to interactive requests sharing the LLM scheduler
+        with llm_priority(LLMPriority.EVAL):
+            return await self._run(
+                assistant,
+                ancestor_response,
+                select_function,
+                invoke_function,
+                get_function_spec,
+            )
+
+    async def _run(
+        self,
+        assistant: Assistant,
+        ancestor_response: List["FunctionInteractionResponse"],
+        select_function: bool,
+        invoke_function: bool,
+        get_function_spec: bool,
     ) -> "FunctionInteractionResponse":
         history: List[OpasMessage] = [
             m  # type: ignore
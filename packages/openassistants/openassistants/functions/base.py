@@ -1,7 +1,7 @@
 import abc
 import dataclasses
 import textwrap
-from typing import List, Mapping, Optional, Sequence
+from typing import AsyncIterator, List, Mapping, Optional, Sequence
 
 from langchain_core.language_models import BaseChatModel
 from openassistants.data_models.chat_messages import OpasMessage
@@ -67,6 +67,13 @@ class IFunction(abc.ABC):
     def get_confirm(self) -> bool:
         pass
 
+    def get_side_effect_free(self) -> bool:
+        """
+        Whether executing the function only reads data, so that it can be started
+        speculatively and its outputs discarded
+        """
+        return False
+
     def get_signature(self) -> str:
         # convert JSON Schema types to Python types signature
         params_repr = PyRepr.repr_json_schema(self.get_parameters_json_schema())
@@ -140,6 +147,7 @@ class BaseFunction(IFunction, BaseModel, abc.ABC):
     description: str
     sample_questions: List[str] = []
     confirm: bool = False
+    side_effect_free: bool = False
     parameters: BaseFunctionParameters = BaseFunctionParameters()
     is_fallback: bool = False
 
@@ -161,6 +169,9 @@ class BaseFunction(IFunction, BaseModel, abc.ABC):
     def get_confirm(self) -> bool:
         return self.confirm
 
+    def get_side_effect_free(self) -> bool:
+        return self.side_effect_free
+
     def get_parameters_json_schema(self) -> JSONSchema:
         return self.parameters.json_schema
 
@@ -175,3 +186,11 @@ class IFunctionLibrary(abc.ABC):
     @abc.abstractmethod
     async def get_all_functions(self) -> Sequence[IFunction]:
         pass
+
+    async def watch(self) -> AsyncIterator[None]:
+        """
+        Yields every time the functions of the library may have changed.
+        Libraries that never change return right away.
+        """
+        return
+        yield
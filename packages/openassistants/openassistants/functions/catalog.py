@@ -0,0 +1,184 @@
+"""
+Compiled function catalogs.
+
+A catalog is a single file holding the validated functions of a LocalYAMLLibrary,
+their signatures and optionally their embeddings. Loading it skips YAML parsing
+and JSON schema validation, which dominate the start up of large libraries.
+
+Compile a catalog with
+
+    python -m openassistants.functions.catalog DIRECTORY LIBRARY_ID PARSER OUTPUT
+
+where PARSER is the import path of the model parser, e.g. my_app.main:model_parser
+
+Catalogs are pickles, and loading a pickle can execute arbitrary code. Only load
+catalogs that you compiled yourself, from a path that only trusted users can
+write to.
+
+The functions must be picklable. Functions holding a live resource can't be
+cataloged, e.g. a QueryFunction with its SQLAlchemy engine, unless they drop and
+recreate it like DuckDBQueryFunction does with its in-memory engine.
+"""
+
+import argparse
+import dataclasses
+import hashlib
+import pickle
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+from langchain.embeddings.base import Embeddings
+from openassistants.functions.base import IFunction
+from openassistants.llm_function_calling.entity_index import embeddings_namespace
+from openassistants.llm_function_calling.shortlist import (
+    FunctionShortlist,
+    function_to_text,
+)
+from openassistants.utils.imports import import_object
+
+if TYPE_CHECKING:
+    from openassistants.functions.crud import LocalYAMLLibrary
+
+CATALOG_MAGIC = b"OPENASSISTANTS-CATALOG\n"
+CATALOG_FORMAT_VERSION = 1
+
+
+class CatalogError(Exception):
+    pass
+
+
+def source_hashes(directory: Path) -> Dict[str, str]:
+    """
+    sha256 of every YAML file in the library directory, by function id
+    """
+    return {
+        file.stem: hashlib.sha256(file.read_bytes()).hexdigest()
+        for file in sorted(directory.iterdir())
+        if file.suffix == ".yaml"
+    }
+
+
+@dataclasses.dataclass
+class FunctionCatalog:
+    library_id: str
+    sources: Dict[str, str]
+    functions: Dict[str, IFunction]
+    signatures: Dict[str, str]
+    embeddings_namespace: Optional[str] = None
+    embeddings: Optional[Dict[str, List[float]]] = None
+
+    def is_fresh(self, directory: Path) -> bool:
+        return self.sources == source_hashes(directory)
+
+    def seed_shortlist(self, shortlist: FunctionShortlist) -> bool:
+        """
+        Add the precomputed embeddings if they were made with the same model
+        """
+        if self.embeddings is None or self.embeddings_namespace != (
+            embeddings_namespace(shortlist.embeddings)
+        ):
+            return False
+        shortlist.add_precomputed(self.embeddings)
+        return True
+
+    def save(self, path: str) -> None:
+        try:
+            # a plain dict, so that catalogs saved from `python -m` load anywhere
+            data = pickle.dumps(
+                {
+                    field.name: getattr(self, field.name)
+                    for field in dataclasses.fields(self)
+                },
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            raise CatalogError(
+                f"Functions of library {self.library_id} can't be pickled, "
+                "e.g. because they hold a database engine"
+            ) from e
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(CATALOG_MAGIC)
+            f.write(CATALOG_FORMAT_VERSION.to_bytes(4, "big"))
+            f.write(data)
+
+    @staticmethod
+    def load(path: str) -> "FunctionCatalog":
+        """
+        Only load trusted catalogs, loading a pickle can execute arbitrary code
+        """
+        with open(path, "rb") as f:
+            if f.read(len(CATALOG_MAGIC)) != CATALOG_MAGIC:
+                raise CatalogError(f"Not a function catalog: {path}")
+            version = int.from_bytes(f.read(4), "big")
+            if version != CATALOG_FORMAT_VERSION:
+                raise CatalogError(
+                    f"Catalog format {version} is not supported, "
+                    f"expected {CATALOG_FORMAT_VERSION}: {path}"
+                )
+            try:
+                return FunctionCatalog(**pickle.load(f))
+            except Exception as e:
+                # e.g. function classes that were renamed since compiling
+                raise CatalogError(f"Failed to load catalog: {path}") from e
+
+
+def compile_catalog(
+    library: "LocalYAMLLibrary",
+    embeddings: Optional[Embeddings] = None,
+) -> FunctionCatalog:
+    sources = source_hashes(library.directory)
+    functions = {function.get_id(): function for function in library.read_all()}
+
+    catalog = FunctionCatalog(
+        library_id=library.library_id,
+        sources=sources,
+        functions=functions,
+        signatures={
+            function_id: function.get_signature()
+            for function_id, function in functions.items()
+        },
+    )
+
+    if embeddings is not None:
+        texts = [function_to_text(function) for function in functions.values()]
+        catalog.embeddings_namespace = embeddings_namespace(embeddings)
+        catalog.embeddings = dict(zip(texts, embeddings.embed_documents(texts)))
+
+    return catalog
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    from openassistants.functions.crud import LocalYAMLLibrary
+
+    parser = argparse.ArgumentParser(
+        description="Compile a YAML function library into a catalog file"
+    )
+    parser.add_argument("directory", help="the directory containing the library")
+    parser.add_argument("library_id")
+    parser.add_argument("model_parser", help="import path, e.g. my_app.main:parser")
+    parser.add_argument("output", help="path of the catalog file")
+    parser.add_argument(
+        "--embeddings",
+        help="import path of an Embeddings instance, or of a function returning one,"
+        " to precompute the function embeddings used by FunctionShortlist",
+    )
+    args = parser.parse_args(argv)
+
+    model_parser: Callable[[dict], IFunction] = import_object(args.model_parser)
+    library = LocalYAMLLibrary(args.library_id, model_parser, args.directory)
+
+    embeddings = None
+    if args.embeddings is not None:
+        embeddings = import_object(args.embeddings)
+        if not isinstance(embeddings, Embeddings):
+            embeddings = embeddings()
+
+    catalog = compile_catalog(library, embeddings)
+    catalog.save(args.output)
+    print(f"Compiled {len(catalog.functions)} functions into {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
 import abc
 import asyncio
 import json
+import logging
 from json.decoder import JSONDecodeError
 from pathlib import Path
 from typing import (
     Any,
+    AsyncIterator,
     Callable,
     Dict,
     List,
@@ -24,10 +26,13 @@ from openassistants.functions.base import (
     IFunction,
     IFunctionLibrary,
 )
+from openassistants.functions.catalog import CatalogError, FunctionCatalog
 from openassistants.utils import yaml as yaml_utils
 from pydantic import TypeAdapter
 from starlette.concurrency import run_in_threadpool
 
+logger = logging.getLogger(__name__)
+
 
 class BaseFileLibrary(IFunctionLibrary, abc.ABC):
     @abc.abstractmethod
@@ -55,15 +60,31 @@ class BaseFileLibrary(IFunctionLibrary, abc.ABC):
 
 
 class LocalYAMLLibrary(BaseFileLibrary):
+    """
+    Functions stored as one YAML file per function.
+
+    Parsed functions are kept along with the modification time and size of their
+    file, so loading the library again only parses the files that changed.
+
+    With a catalog_path, the first load uses the compiled catalog (see
+    openassistants.functions.catalog) unless it is missing or stale.
+    """
+
     def __init__(
         self,
         library_id: str,
         model_parser: Callable[[dict], IFunction],
         directory: str = "library",
+        poll_interval: float = 1.0,
+        catalog_path: Optional[str] = None,
     ):
         self.library_id = library_id
         self.model_parser = model_parser
         self.directory = Path(directory) / library_id
+        self.poll_interval = poll_interval
+        self.catalog_path = catalog_path
+        self.catalog: Optional[FunctionCatalog] = None
+        self._parsed: Dict[str, Tuple[Tuple[int, int], IFunction]] = {}
 
     def read(self, function_id: str) -> Optional[IFunction]:
         try:
@@ -81,6 +102,119 @@ class LocalYAMLLibrary(BaseFileLibrary):
             file.stem for file in self.directory.iterdir() if file.suffix == ".yaml"
         ]
 
+    def _file_stamps(self) -> Dict[str, Tuple[int, int]]:
+        stamps = {}
+        for file in self.directory.iterdir():
+            if file.suffix == ".yaml":
+                stat = file.stat()
+                stamps[file.stem] = (stat.st_mtime_ns, stat.st_size)
+        return stamps
+
+    def _load_catalog(self) -> Optional[FunctionCatalog]:
+        assert self.catalog_path is not None
+        try:
+            catalog = FunctionCatalog.load(self.catalog_path)
+        except (OSError, CatalogError):
+            logger.warning(f"Could not load catalog {self.catalog_path}", exc_info=True)
+            return None
+        if catalog.library_id != self.library_id or not catalog.is_fresh(
+            self.directory
+        ):
+            logger.warning(f"Catalog {self.catalog_path} is stale, reading YAML")
+            return None
+        return catalog
+
+    def _catalog_functions(
+        self, stamps: Dict[str, Tuple[int, int]]
+    ) -> Optional[List[IFunction]]:
+        """
+        The functions of the catalog, on the first load only
+        """
+        if self.catalog_path is None or self.catalog is not None or self._parsed:
+            return None
+        if (catalog := self._load_catalog()) is None:
+            return None
+        self.catalog = catalog
+        self._parsed = {
+            function_id: (stamps[function_id], function)
+            for function_id, function in catalog.functions.items()
+        }
+        return list(catalog.functions.values())
+
+    def _changed_ids(self, stamps: Dict[str, Tuple[int, int]]) -> List[str]:
+        return [
+            function_id
+            for function_id, stamp in stamps.items()
+            if (previous := self._parsed.get(function_id)) is None
+            or previous[0] != stamp
+        ]
+
+    def _update_parsed(
+        self,
+        stamps: Dict[str, Tuple[int, int]],
+        read: Dict[str, Optional[IFunction]],
+    ) -> List[IFunction]:
+        parsed = {}
+        for function_id, stamp in stamps.items():
+            if function_id not in read:
+                parsed[function_id] = self._parsed[function_id]
+            elif (function := read[function_id]) is not None:
+                parsed[function_id] = (stamp, function)
+            else:
+                raise RuntimeError(f"Failed to load: {function_id}")
+        self._parsed = parsed
+        return [function for _, function in parsed.values()]
+
+    def read_all(self) -> List[IFunction]:
+        """
+        Read all functions, parsing only the files that changed since the last call
+        """
+        stamps = self._file_stamps()
+        if (functions := self._catalog_functions(stamps)) is not None:
+            return functions
+        changed = self._changed_ids(stamps)
+        return self._update_parsed(
+            stamps, {function_id: self.read(function_id) for function_id in changed}
+        )
+
+    async def get_all_functions(self) -> Sequence[IFunction]:
+        """
+        Like read_all, with the changed files parsed concurrently
+        """
+        stamps = await run_in_threadpool(self._file_stamps)
+        functions = await run_in_threadpool(self._catalog_functions, stamps)
+        if functions is not None:
+            return functions
+        changed = self._changed_ids(stamps)
+        read = await asyncio.gather(
+            *[self.aread(function_id) for function_id in changed]
+        )
+        return self._update_parsed(stamps, dict(zip(changed, read)))
+
+    async def watch(self) -> AsyncIterator[None]:
+        """
+        Yields when a YAML file was added, changed or removed. Uses watchfiles
+        (inotify on Linux) when it is installed and polls the directory otherwise.
+        """
+        try:
+            from watchfiles import awatch  # type: ignore
+        except ImportError:
+            awatch = None
+
+        if awatch is not None:
+            async for changes in awatch(self.directory):
+                if any(Path(path).suffix == ".yaml" for _, path in changes):
+                    yield
+            return
+
+        stamps = await run_in_threadpool(self._file_stamps)
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            new_stamps = await run_in_threadpool(self._file_stamps)
+            if new_stamps != stamps:
+                stamps = new_stamps
+                yield
+
 
 class PythonLibrary(IFunctionLibrary):
     def __init__(self, functions: Sequence[IFunction]):
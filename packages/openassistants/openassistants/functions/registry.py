@@ -0,0 +1,119 @@
+from typing import Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+from openassistants.functions.base import IFunction
+from openassistants.utils.tokens import count_tokens
+
+
+class FunctionRegistry:
+    """
+    An index of the functions of an assistant, by id and by type.
+
+    A registry is never modified after it is built. Reloading builds a new one
+    and swaps it in, so a request keeps a consistent snapshot while it runs.
+
+    Function signatures and their token counts are computed once per function
+    object. A registry built with the previous one as `previous` keeps them for
+    the functions that didn't change.
+
+    `groups` maps function ids to a group, e.g. the library they come from, which
+    is used to cluster related functions during hierarchical selection.
+
+    `signatures` are precomputed signatures by function id, e.g. from a compiled
+    catalog. They must belong to the given function objects.
+    """
+
+    def __init__(
+        self,
+        functions: Sequence[IFunction],
+        previous: Optional["FunctionRegistry"] = None,
+        groups: Optional[Mapping[str, str]] = None,
+        signatures: Optional[Mapping[str, str]] = None,
+    ):
+        self.functions: List[IFunction] = list(functions)
+        self.groups: Mapping[str, str] = groups or {}
+        self.by_id: Dict[str, IFunction] = {}
+        self.by_type: Dict[str, List[IFunction]] = {}
+        self._positions: Dict[str, int] = {}
+
+        for position, function in enumerate(self.functions):
+            function_id = function.get_id()
+            if function_id in self.by_id:
+                # like a scan over the functions, the first one wins
+                continue
+            self.by_id[function_id] = function
+            self._positions[function_id] = position
+            self.by_type.setdefault(function.get_type(), []).append(function)
+
+        self.fallbacks: List[IFunction] = [
+            f for f in self.by_id.values() if f.get_is_fallback()
+        ]
+        self.non_fallbacks: List[IFunction] = [
+            f for f in self.by_id.values() if not f.get_is_fallback()
+        ]
+
+        # by id() of the function, holding on to the function keeps the id valid
+        self._signatures: Dict[int, Tuple[IFunction, str, int]] = {}
+        self._functions_texts: Dict[Tuple[str, ...], str] = {}
+        if previous is not None:
+            for function in self.by_id.values():
+                entry = previous._signatures.get(id(function))
+                if entry is not None and entry[0] is function:
+                    self._signatures[id(function)] = entry
+        for function_id, signature in (signatures or {}).items():
+            if (seeded := self.by_id.get(function_id)) is not None:
+                self._signatures.setdefault(
+                    id(seeded), (seeded, signature, count_tokens(signature))
+                )
+
+    def get(self, function_id: str) -> Optional[IFunction]:
+        return self.by_id.get(function_id)
+
+    def get_many(self, function_ids: Sequence[str]) -> List[IFunction]:
+        """
+        The functions with these ids, in registry order. Unknown ids are ignored.
+        """
+        positions = sorted(
+            {self._positions[f_id] for f_id in function_ids if f_id in self.by_id}
+        )
+        return [self.functions[position] for position in positions]
+
+    def cluster_key(self, function: IFunction) -> Tuple[str, str]:
+        """
+        Functions with the same key are related: same group and same type
+        """
+        return self.groups.get(function.get_id(), ""), function.get_type()
+
+    def _signature_entry(self, function: IFunction) -> Tuple[IFunction, str, int]:
+        entry = self._signatures.get(id(function))
+        if entry is None or entry[0] is not function:
+            signature = function.get_signature()
+            entry = (function, signature, count_tokens(signature))
+            self._signatures[id(function)] = entry
+        return entry
+
+    def signature(self, function: IFunction) -> str:
+        return self._signature_entry(function)[1]
+
+    def signature_tokens(self, function: IFunction) -> int:
+        return self._signature_entry(function)[2]
+
+    def functions_text(self, functions: Sequence[IFunction]) -> str:
+        """
+        The signatures of the functions, one after the other, as used in prompts
+        """
+        key = tuple(function.get_id() for function in functions)
+        if (text := self._functions_texts.get(key)) is None:
+            text = "\n".join(self.signature(function) for function in functions)
+            if len(self._functions_texts) >= 1024:
+                self._functions_texts.clear()
+            self._functions_texts[key] = text
+        return text
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    def __iter__(self) -> Iterator[IFunction]:
+        return iter(self.by_id.values())
+
+    def __contains__(self, function_id: object) -> bool:
+        return function_id in self.by_id
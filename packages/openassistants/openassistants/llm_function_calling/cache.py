@@ -0,0 +1,154 @@
+import abc
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, List, Optional
+
+from langchain.chat_models.base import BaseChatModel
+from langchain.schema.messages import BaseMessage
+from openassistants.utils.lru_cache import LRUCache
+from starlette.concurrency import run_in_threadpool
+
+
+def _model_identity(chat: BaseChatModel) -> Any:
+    try:
+        # the model type and the parameters that identify it, e.g. temperature
+        return chat.dict()
+    except Exception:
+        # e.g. a model that doesn't implement _llm_type
+        return [type(chat).__module__, type(chat).__qualname__, repr(chat)]
+
+
+def generation_cache_key(
+    chat: BaseChatModel,
+    messages: List[BaseMessage],
+    output_json_schema: Optional[dict],
+    task_name: str,
+) -> str:
+    """
+    Content address of a structured LLM call: the model and its parameters, the
+    rendered messages, the output schema and the task name
+    """
+    payload = json.dumps(
+        {
+            "model": _model_identity(chat),
+            "messages": [[m.type, m.content] for m in messages],
+            "schema": output_json_schema,
+            "task_name": task_name,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class IGenerationCache(abc.ABC):
+    """
+    Stores the JSON output of structured LLM calls by content address
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @abc.abstractmethod
+    async def _aget(self, key: str) -> Optional[str]:
+        pass
+
+    @abc.abstractmethod
+    async def aset(self, key: str, value: str) -> None:
+        pass
+
+    async def aget(self, key: str) -> Optional[str]:
+        value = await self._aget(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class InMemoryGenerationCache(IGenerationCache):
+    def __init__(self, max_size: int = 1024, ttl_seconds: Optional[float] = 3600):
+        super().__init__()
+        self._cache: LRUCache[str, str] = LRUCache(max_size, ttl_seconds)
+
+    async def _aget(self, key: str) -> Optional[str]:
+        return self._cache.get(key)
+
+    async def aset(self, key: str, value: str) -> None:
+        self._cache.set(key, value)
+
+
+class SQLiteGenerationCache(IGenerationCache):
+    """
+    A cache persisted in a local SQLite database, shared across restarts.
+    Expired rows are deleted when they are read and on every write.
+    """
+
+    def __init__(
+        self,
+        path: str = "/tmp/openassistants_llm_cache.sqlite",
+        ttl_seconds: Optional[float] = None,
+    ):
+        super().__init__()
+        self.ttl_seconds = ttl_seconds
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS generations "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS generations_created_at "
+                "ON generations (created_at)"
+            )
+
+    def _expired_before(self) -> Optional[float]:
+        if self.ttl_seconds is None:
+            return None
+        return time.time() - self.ttl_seconds
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, created_at FROM generations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if (expired_before := self._expired_before()) is not None and (
+                created_at < expired_before
+            ):
+                with self._connection:
+                    self._connection.execute(
+                        "DELETE FROM generations WHERE key = ?", (key,)
+                    )
+                return None
+        return value
+
+    def _set(self, key: str, value: str) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO generations VALUES (?, ?, ?)",
+                (key, value, time.time()),
+            )
+            # drop whatever expired since, so that the database doesn't keep growing
+            if (expired_before := self._expired_before()) is not None:
+                self._connection.execute(
+                    "DELETE FROM generations WHERE created_at < ?", (expired_before,)
+                )
+
+    async def _aget(self, key: str) -> Optional[str]:
+        return await run_in_threadpool(self._get, key)
+
+    async def aset(self, key: str, value: str) -> None:
+        await run_in_threadpool(self._set, key, value)
@@ -0,0 +1,334 @@
+"""
+Local function selection without LLM calls.
+
+TfidfFunctionSelector is trained from the functions themselves (id, description
+and sample questions) plus example queries, e.g. logged past selections or the
+messages of eval interaction trees. Fitting takes milliseconds, so only the
+examples are saved, and the model is fitted again for each function registry.
+
+Collect the examples of eval interaction trees with
+
+    python -m openassistants.llm_function_calling.classifier train \
+        ASSISTANT INTERACTIONS... --output EXAMPLES [--holdout 0.2]
+
+which keeps a random share of the examples out of training to report the
+accuracy on, and measure how many turns would skip LLM selection, and how
+accurately, with
+
+    python -m openassistants.llm_function_calling.classifier evaluate \
+        ASSISTANT INTERACTIONS... [--examples EXAMPLES] [--threshold 0.8]
+
+where ASSISTANT and INTERACTIONS are import paths, e.g. my_app.main:assistant
+and tests.test_my_app:core_interaction
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+from openassistants.functions.base import IFunction
+from openassistants.functions.registry import FunctionRegistry
+from openassistants.llm_function_calling.sample_questions import normalize_question
+from openassistants.llm_function_calling.selection import (
+    FunctionPrediction,
+    IFunctionSelector,
+)
+from openassistants.utils.imports import import_object
+from starlette.concurrency import run_in_threadpool
+
+_PLACEHOLDER = re.compile(r"\{\w+\}")
+_WORD = re.compile(r"\w+")
+
+
+def _features(text: str) -> Counter:
+    """
+    Words and character 3 to 5-grams of the words, with sublinear counts
+    """
+    counts: Counter = Counter()
+    for word in _WORD.findall(normalize_question(text).casefold()):
+        counts[f"w:{word}"] += 1
+        padded = f" {word} "
+        for n in (3, 4, 5):
+            for start in range(len(padded) - n + 1):
+                counts[f"c:{padded[start : start + n]}"] += 1
+    return Counter({feature: 1 + math.log(count) for feature, count in counts.items()})
+
+
+def function_training_texts(function: IFunction) -> List[str]:
+    texts = [function.get_id().replace("_", " "), function.get_description()]
+    if display_name := function.get_display_name():
+        texts.append(display_name)
+    # placeholders like {employee} stand for any text
+    texts.extend(
+        _PLACEHOLDER.sub(" ", question) for question in function.get_sample_questions()
+    )
+    return texts
+
+
+class _TfidfModel:
+    """
+    One l2 normalized TF-IDF vector per function, stored as an inverted index so
+    that scoring a query only touches the features it contains
+    """
+
+    def __init__(self, functions: Sequence[IFunction], documents: List[Counter]):
+        self.functions = list(functions)
+
+        document_frequency: Counter = Counter()
+        for document in documents:
+            document_frequency.update(document.keys())
+        n = len(documents)
+        self.idf = {
+            feature: math.log((1 + n) / (1 + frequency)) + 1
+            for feature, frequency in document_frequency.items()
+        }
+
+        postings: Dict[str, Tuple[List[int], List[float]]] = {}
+        for index, document in enumerate(documents):
+            weights = {f: tf * self.idf[f] for f, tf in document.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            for feature, weight in weights.items():
+                indexes, values = postings.setdefault(feature, ([], []))
+                indexes.append(index)
+                values.append(weight / norm)
+
+        self.postings = {
+            feature: (np.array(indexes), np.array(values, dtype=np.float32))
+            for feature, (indexes, values) in postings.items()
+        }
+
+    def scores(self, query: str) -> np.ndarray:
+        """
+        Cosine similarity of the query to every function
+        """
+        weights = {
+            feature: tf * self.idf[feature]
+            for feature, tf in _features(query).items()
+            if feature in self.idf
+        }
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+
+        scores = np.zeros(len(self.functions), dtype=np.float32)
+        for feature, weight in weights.items():
+            indexes, values = self.postings[feature]
+            scores[indexes] += values * (weight / norm)
+        return scores
+
+
+class TfidfFunctionSelector(IFunctionSelector):
+    """
+    Nearest function by TF-IDF similarity of words and character n-grams.
+
+    The confidence is the softmax probability of the best function, with the
+    similarities scaled by temperature. Queries that are not at least
+    min_similarity similar to any function get no prediction, they are likely
+    general questions for the fallback.
+
+    examples maps function ids to example user queries.
+    """
+
+    def __init__(
+        self,
+        examples: Optional[Mapping[str, Sequence[str]]] = None,
+        temperature: float = 20.0,
+        min_similarity: float = 0.3,
+    ):
+        self.examples: Dict[str, List[str]] = {
+            function_id: list(queries)
+            for function_id, queries in (examples or {}).items()
+        }
+        self.temperature = temperature
+        self.min_similarity = min_similarity
+        self._fitted: Optional[Tuple[FunctionRegistry, _TfidfModel]] = None
+        self._lock = asyncio.Lock()
+
+    def fit(self, functions: Sequence[IFunction]) -> _TfidfModel:
+        documents = []
+        for function in functions:
+            document: Counter = Counter()
+            texts = function_training_texts(function)
+            texts.extend(self.examples.get(function.get_id(), []))
+            for text in texts:
+                document.update(_features(text))
+            documents.append(document)
+        return _TfidfModel(functions, documents)
+
+    async def _model(self, registry: FunctionRegistry) -> _TfidfModel:
+        # registries are immutable, a reload creates a new one
+        if self._fitted is None or self._fitted[0] is not registry:
+            async with self._lock:
+                if self._fitted is None or self._fitted[0] is not registry:
+                    model = await run_in_threadpool(self.fit, registry.non_fallbacks)
+                    self._fitted = (registry, model)
+        return self._fitted[1]
+
+    def predict_with_model(
+        self, model: _TfidfModel, user_query: str
+    ) -> Optional[FunctionPrediction]:
+        if len(model.functions) == 0:
+            return None
+
+        scores = model.scores(user_query)
+        best = int(np.argmax(scores))
+        if scores[best] < self.min_similarity:
+            return None
+
+        exponents = np.exp((scores - scores[best]) * self.temperature)
+        return FunctionPrediction(
+            function=model.functions[best],
+            confidence=float(1 / exponents.sum()),
+        )
+
+    async def predict(
+        self, registry: FunctionRegistry, user_query: str
+    ) -> Optional[FunctionPrediction]:
+        return self.predict_with_model(await self._model(registry), user_query)
+
+    def save_examples(self, path: str) -> None:
+        Path(path).write_text(json.dumps(self.examples, indent=2))
+
+    @staticmethod
+    def load(path: str, **kwargs) -> "TfidfFunctionSelector":
+        return TfidfFunctionSelector(json.loads(Path(path).read_text()), **kwargs)
+
+
+def interaction_examples(interactions) -> List[Tuple[str, str]]:
+    """
+    (message, function id) of every node of FunctionInteraction trees
+    """
+    examples = []
+    stack = list(interactions)
+    while stack:
+        interaction = stack.pop(0)
+        examples.append((interaction.message, interaction.function))
+        stack.extend(interaction.children)
+    return examples
+
+
+def _load_interactions(paths: Sequence[str]) -> List[Tuple[str, str]]:
+    from openassistants.eval.interaction import FunctionInteraction
+
+    interactions = []
+    for path in paths:
+        loaded = import_object(path)
+        if isinstance(loaded, FunctionInteraction):
+            interactions.append(loaded)
+        else:
+            interactions.extend(loaded)
+    return interaction_examples(interactions)
+
+
+def split_examples(
+    examples: Sequence[Tuple[str, str]], holdout: float, seed: int = 0
+) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+    """
+    (training, held out) examples, the held out share is picked at random
+    """
+    shuffled = list(examples)
+    random.Random(seed).shuffle(shuffled)
+    n_holdout = round(len(shuffled) * holdout)
+    return shuffled[n_holdout:], shuffled[:n_holdout]
+
+
+def evaluate(
+    selector: TfidfFunctionSelector,
+    registry: FunctionRegistry,
+    examples: Sequence[Tuple[str, str]],
+    threshold: float,
+) -> Dict[str, float]:
+    model = selector.fit(registry.non_fallbacks)
+    correct = confident = confident_correct = 0
+    for message, function_id in examples:
+        prediction = selector.predict_with_model(model, message)
+        is_correct = prediction is not None and (
+            prediction.function.get_id() == function_id
+        )
+        correct += is_correct
+        if prediction is not None and prediction.confidence >= threshold:
+            confident += 1
+            confident_correct += is_correct
+
+    total = len(examples) or 1
+    return {
+        "accuracy": correct / total,
+        # the share of turns that would skip LLM selection
+        "coverage": confident / total,
+        "confident_accuracy": confident_correct / (confident or 1),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Train and evaluate the local function selection classifier"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train = subparsers.add_parser(
+        "train", help="collect the examples of interaction trees"
+    )
+    evaluate_parser = subparsers.add_parser(
+        "evaluate", help="measure accuracy and coverage on interaction trees"
+    )
+    for subparser in (train, evaluate_parser):
+        subparser.add_argument("assistant", help="import path of an Assistant")
+        subparser.add_argument(
+            "interactions",
+            nargs="+",
+            help="import paths of FunctionInteraction trees, or lists of them",
+        )
+    train.add_argument("--output", required=True, help="path of the examples file")
+    train.add_argument(
+        "--examples", help="existing examples file to add the interactions to"
+    )
+    train.add_argument(
+        "--holdout",
+        type=float,
+        default=0.2,
+        help="share of the interactions kept out of training for evaluation",
+    )
+    train.add_argument("--seed", type=int, default=0)
+    evaluate_parser.add_argument("--examples", help="examples file to train with")
+    evaluate_parser.add_argument("--threshold", type=float, default=0.8)
+    args = parser.parse_args(argv)
+
+    registry = asyncio.run(import_object(args.assistant).get_registry())
+    selector = (
+        TfidfFunctionSelector.load(args.examples)
+        if args.examples
+        else TfidfFunctionSelector()
+    )
+    examples = _load_interactions(args.interactions)
+
+    if args.command == "train":
+        training, held_out = split_examples(examples, args.holdout, args.seed)
+        for message, function_id in training:
+            queries = selector.examples.setdefault(function_id, [])
+            if message not in queries:
+                queries.append(message)
+        selector.save_examples(args.output)
+        print(f"Saved {len(training)} examples into {args.output}")
+        if held_out:
+            metrics = evaluate(selector, registry, held_out, 0.8)
+            print(f"Held out accuracy: {metrics['accuracy']:.3f}")
+    else:
+        # examples the selector was trained with would overstate the accuracy
+        trained = {
+            message for queries in selector.examples.values() for message in queries
+        }
+        unseen = [example for example in examples if example[0] not in trained]
+        metrics = evaluate(selector, registry, unseen, args.threshold)
+        print(f"Examples: {len(unseen)} ({len(examples) - len(unseen)} trained on)")
+        print(f"Accuracy: {metrics['accuracy']:.3f}")
+        print(f"Coverage at {args.threshold}: {metrics['coverage']:.3f}")
+        print(f"Accuracy when confident: {metrics['confident_accuracy']:.3f}")
+
+
+if __name__ == "__main__":
+    main()
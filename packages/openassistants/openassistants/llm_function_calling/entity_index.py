@@ -0,0 +1,163 @@
+import asyncio
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from openassistants.functions.base import IEntity
+from starlette.concurrency import run_in_threadpool
+from usearch.index import Index
+
+logger = logging.getLogger(__name__)
+
+
+def entity_to_text(entity: IEntity) -> str:
+    text = entity.get_identity()
+
+    if entity.get_description():
+        text += f" ({entity.get_description()})"
+
+    return text
+
+
+def embeddings_namespace(embeddings: Embeddings) -> str:
+    """
+    A stable name for an embedder, so that indexes built with different embedding
+    models never collide.
+    """
+    if (namespace := getattr(embeddings, "namespace", None)) is not None:
+        return str(namespace)
+    return f"{embeddings.__class__.__name__}({getattr(embeddings, 'model', '')})"
+
+
+def entities_fingerprint(entities: Sequence[IEntity], namespace: str) -> str:
+    digest = hashlib.sha256(namespace.encode())
+    for entity in entities:
+        digest.update(b"\x00")
+        digest.update(entity_to_text(entity).encode())
+    return digest.hexdigest()
+
+
+class EntityIndex:
+    """
+    A vector index over the identities of an entity list.
+    Keys in the usearch index are positions in `identities`.
+    """
+
+    def __init__(self, index: Index, identities: List[str]):
+        self.index = index
+        self.identities = identities
+
+    @staticmethod
+    def build(identities: List[str], vectors: List[List[float]]) -> "EntityIndex":
+        matrix = np.array(vectors, dtype=np.float32)
+        index = Index(ndim=matrix.shape[1], metric="cos")
+        index.add(np.arange(len(identities)), matrix)
+        return EntityIndex(index, identities)
+
+    def search(self, vector: List[float], k: int) -> List[str]:
+        matches = self.index.search(np.array(vector, dtype=np.float32), k)
+        return [self.identities[int(key)] for key in matches.keys]
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.index.save(str(path.with_suffix(".usearch")))
+        path.with_suffix(".json").write_text(json.dumps(self.identities))
+
+    @staticmethod
+    def load(path: Path) -> Optional["EntityIndex"]:
+        index_file = path.with_suffix(".usearch")
+        identities_file = path.with_suffix(".json")
+        if not index_file.exists() or not identities_file.exists():
+            return None
+        index = Index.restore(str(index_file))
+        if index is None:
+            return None
+        return EntityIndex(index, json.loads(identities_file.read_text()))
+
+
+class EntityIndexManager:
+    """
+    Builds one vector index per distinct entity list and reuses it across requests.
+
+    Indexes are keyed by a fingerprint of the entity contents and the embedding
+    model and kept in memory. With a `directory`, e.g. a cache directory of the
+    user running the server, they are also persisted there so that restarts
+    don't have to re-embed.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        directory: Optional[str] = None,
+    ):
+        self.embeddings = embeddings
+        self.directory = Path(directory) if directory is not None else None
+        self._indexes: Dict[str, EntityIndex] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _path(self, fingerprint: str) -> Optional[Path]:
+        if self.directory is None:
+            return None
+        return self.directory / fingerprint
+
+    async def _build(
+        self, fingerprint: str, entities: Sequence[IEntity]
+    ) -> EntityIndex:
+        path = self._path(fingerprint)
+
+        if path is not None:
+            try:
+                loaded = await run_in_threadpool(EntityIndex.load, path)
+            except Exception:
+                logger.exception(f"Failed to load entity index from {path}")
+                loaded = None
+            if loaded is not None:
+                return loaded
+
+        identities = [entity.get_identity() for entity in entities]
+        vectors = await self.embeddings.aembed_documents(
+            [entity_to_text(entity) for entity in entities]
+        )
+        index = await run_in_threadpool(EntityIndex.build, identities, vectors)
+
+        if path is not None:
+            try:
+                await run_in_threadpool(index.save, path)
+            except Exception:
+                logger.exception(f"Failed to persist entity index to {path}")
+
+        return index
+
+    async def get_index(self, entities: Sequence[IEntity]) -> EntityIndex:
+        fingerprint = entities_fingerprint(
+            entities, embeddings_namespace(self.embeddings)
+        )
+
+        if (index := self._indexes.get(fingerprint)) is not None:
+            return index
+
+        # only one coroutine builds a given index, the others wait for it
+        lock = self._locks.setdefault(fingerprint, asyncio.Lock())
+        async with lock:
+            if (index := self._indexes.get(fingerprint)) is None:
+                index = await self._build(fingerprint, entities)
+                self._indexes[fingerprint] = index
+        self._locks.pop(fingerprint, None)
+
+        return index
+
+    async def search(
+        self, entities: Sequence[IEntity], query: str, k: int = 3
+    ) -> List[str]:
+        """
+        Returns the identities of the k entities closest to the query
+        """
+        if len(entities) == 0:
+            return []
+        index = await self.get_index(entities)
+        vector = await self.embeddings.aembed_query(query)
+        return index.search(vector, min(k, len(entities)))
@@ -1,94 +1,116 @@
 import asyncio
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from langchain.chat_models.base import BaseChatModel
 from langchain.embeddings.base import Embeddings
-from langchain.schema import Document
-from langchain.vectorstores.usearch import USearch
 from openassistants.data_models.chat_messages import OpasMessage
 from openassistants.functions.base import (
     IEntity,
     IEntityConfig,
     IFunction,
 )
+from openassistants.llm_function_calling.cache import IGenerationCache
+from openassistants.llm_function_calling.entity_index import EntityIndexManager
 from openassistants.llm_function_calling.infilling import generate_arguments
-
-
-async def _vec_search(
-    documents: List[Document],
-    query: str,
-    embeddings: Embeddings,
-) -> List[Document]:
-    search: USearch = await USearch.afrom_documents(
-        embedding=embeddings,
-        documents=documents,
-    )
-    results = await search.asimilarity_search(
-        query,
-        k=3,
-    )
-    return results
-
-
-def entity_to_document(entity: IEntity) -> Document:
-    doc = Document(
-        metadata=dict(id=entity.get_identity()), page_content=entity.get_identity()
-    )
-
-    if entity.get_description():
-        doc.page_content += f" ({entity.get_description()})"
-
-    return doc
+from openassistants.llm_function_calling.prompt_context import PromptContext
 
 
 async def _get_entities(
     entity_cfg: IEntityConfig,
     entity_key: str,
     preliminary_arguments: Dict[str, Any],
-    embeddings: Embeddings,
+    entity_index_manager: EntityIndexManager,
 ) -> Tuple[str, List[IEntity]]:
-    documents = [entity_to_document(entity) for entity in entity_cfg.get_entities()]
+    all_entities = entity_cfg.get_entities()
 
     query = str(preliminary_arguments[entity_key])
 
-    vec_result = await _vec_search(documents, query, embeddings)
-
-    # filter for entities that in vec result
-    ids: set[str] = set([doc.metadata["id"] for doc in vec_result])
+    # filter for entities that are in the vector search result
+    ids: set[str] = set(await entity_index_manager.search(all_entities, query, k=3))
 
-    entities = [
-        entity for entity in entity_cfg.get_entities() if entity.get_identity() in ids
-    ]
+    entities = [entity for entity in all_entities if entity.get_identity() in ids]
 
     return entity_key, entities
 
 
-async def resolve_entities(
+async def resolve_entities_with_arguments(
     function: IFunction,
     function_infilling_llm: BaseChatModel,
-    embeddings: Embeddings,
+    entity_index_manager: EntityIndexManager,
     user_query: str,
-    chat_history: List[OpasMessage],
-) -> Dict[str, List[IEntity]]:
+    chat_history: Union[List[OpasMessage], PromptContext],
+    preliminary_arguments: Optional[Dict[str, Any]] = None,
+    cache: Optional[IGenerationCache] = None,
+) -> Tuple[Dict[str, List[IEntity]], Dict[str, Any]]:
+    """
+    Resolve entities and also return the preliminary arguments used to look them up
+    """
     entity_configs = await function.get_entity_configs()
 
     # skip if no entity configs
     if len(entity_configs) == 0:
-        return {}
-
-    preliminary_arguments = await generate_arguments(
-        function,
-        function_infilling_llm,
-        user_query,
-        chat_history,
-        {},
-    )
+        return {}, preliminary_arguments or {}
+
+    # only ask the LLM when the caller couldn't provide every entity argument
+    if preliminary_arguments is None or not all(
+        key in preliminary_arguments for key in entity_configs
+    ):
+        preliminary_arguments = await generate_arguments(
+            function,
+            function_infilling_llm,
+            user_query,
+            chat_history,
+            {},
+            cache,
+        )
 
     results = await asyncio.gather(
         *[
-            _get_entities(entity_cfg, param_name, preliminary_arguments, embeddings)
+            _get_entities(
+                entity_cfg, param_name, preliminary_arguments, entity_index_manager
+            )
             for param_name, entity_cfg in entity_configs.items()
         ]
     )
 
-    return {key: entities for key, entities in results}
+    return {key: entities for key, entities in results}, preliminary_arguments
+
+
+async def resolve_entities(
+    function: IFunction,
+    function_infilling_llm: BaseChatModel,
+    embeddings: Union[EntityIndexManager, Embeddings],
+    user_query: str,
+    chat_history: Union[List[OpasMessage], PromptContext],
+    preliminary_arguments: Optional[Dict[str, Any]] = None,
+    cache: Optional[IGenerationCache] = None,
+) -> Dict[str, List[IEntity]]:
+    """
+    Pass an EntityIndexManager to reuse the entity indexes across calls, plain
+    embeddings build them for this call only
+    """
+    entities_info, _ = await resolve_entities_with_arguments(
+        function,
+        function_infilling_llm,
+        embeddings
+        if isinstance(embeddings, EntityIndexManager)
+        else EntityIndexManager(embeddings),
+        user_query,
+        chat_history,
+        preliminary_arguments,
+        cache,
+    )
+    return entities_info
+
+
+def entity_arguments_resolved(
+    arguments: Dict[str, Any],
+    entities_info: Dict[str, List[IEntity]],
+) -> bool:
+    """
+    Whether every entity argument is exactly the identity of a resolved entity
+    """
+    return all(
+        arguments.get(param) in {entity.get_identity() for entity in entities}
+        for param, entities in entities_info.items()
+    )
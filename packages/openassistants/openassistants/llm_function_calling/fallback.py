@@ -1,24 +1,28 @@
-from typing import List
+from typing import List, Union
 
 from langchain.chat_models.base import BaseChatModel
-from langchain.schema.messages import HumanMessage, SystemMessage
+from langchain.schema.messages import BaseMessage, HumanMessage, SystemMessage
 from openassistants.data_models.chat_messages import OpasMessage
 from openassistants.functions.utils import AsyncStreamVersion
-from openassistants.llm_function_calling.utils import build_chat_history_prompt
+from openassistants.llm_function_calling.prompt_context import PromptContext
 from openassistants.utils.langchain_util import string_from_message
+from openassistants.utils.llm_scheduler import astream_in_slot, token_counting_enabled
+from openassistants.utils.tokens import count_message_tokens, count_tokens
+from openassistants.utils.tracing import record_llm_call, span
 
 
 async def perform_general_qa(
     chat: BaseChatModel,
     user_query: str,
-    chat_history: List[OpasMessage],
+    chat_history: Union[List[OpasMessage], PromptContext],
     scope_description: str,
 ) -> AsyncStreamVersion[str]:
-    final_messages = [
+    prompt_context = PromptContext.of(chat_history)
+    final_messages: List[BaseMessage] = [
         SystemMessage(content="You are a helpful assistant."),
         HumanMessage(
             content=f"""
-{build_chat_history_prompt(chat_history)}
+{prompt_context.chat_history_prompt}
 
 Try to answer the user's question based on the chat history: {user_query}.
 
@@ -32,9 +36,18 @@ SCOPE DESCRIPTION END
     ]
 
     full = ""
-    async for response_message in chat.astream(
-        final_messages,
-        {"tags": ["fallback"]},
-    ):
-        full += string_from_message(response_message)
-        yield full
+    prompt_tokens = (
+        count_message_tokens(final_messages) if token_counting_enabled() else 0
+    )
+    with span("fallback") as active:
+        async for response_message in astream_in_slot(
+            chat,
+            final_messages,
+            {"tags": ["fallback"]},
+            prompt_tokens,
+        ):
+            full += string_from_message(response_message)
+            yield full
+
+        if active is not None:
+            record_llm_call(prompt_tokens, count_tokens(full))
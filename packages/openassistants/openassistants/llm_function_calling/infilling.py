@@ -1,29 +1,41 @@
+import json
 from copy import deepcopy
-from typing import Dict, List, TypedDict
+from typing import Any, Dict, List, Optional, Tuple, TypedDict, Union
 
 from langchain.chat_models.base import BaseChatModel
-from langchain.schema.messages import HumanMessage
+from langchain.schema.messages import BaseMessage, HumanMessage
 from openassistants.data_models.chat_messages import OpasMessage
 from openassistants.functions.base import IEntity, IFunction
-from openassistants.llm_function_calling.utils import (
-    build_chat_history_prompt,
-    generate_to_json,
-)
+from openassistants.llm_function_calling.cache import IGenerationCache
+from openassistants.llm_function_calling.prompt_context import PromptContext
+from openassistants.llm_function_calling.utils import generate_to_json
 
 
-async def generate_argument_decisions_schema(function: IFunction):
+def _known_arguments_prompt(known_arguments: Optional[Dict[str, Any]]) -> str:
+    if not known_arguments:
+        return ""
+    return f"""
+These arguments are already known: {json.dumps(known_arguments, default=str)}
+"""
+
+
+async def generate_argument_decisions_schema(
+    function: IFunction,
+    known_arguments: Optional[Dict[str, Any]] = None,
+):
     # Start with the base schema
     json_schema = function.get_parameters_json_schema()
 
     properties = {
         key: {"$ref": "#/definitions/nestedObject"}
         for key in json_schema["properties"].keys()
+        if key not in (known_arguments or {})
     }
 
     argument_decision_json_schema = {
         "type": "object",
         "properties": properties,
-        "required": list(json_schema["properties"].keys()),
+        "required": list(properties.keys()),
         "additionalProperties": False,
         "definitions": {
             "nestedObject": {
@@ -49,22 +61,40 @@ class NestedObject(TypedDict):
 ArgumentDecisionDict = Dict[str, NestedObject]
 
 
+def _known_argument_decisions(
+    known_arguments: Optional[Dict[str, Any]],
+) -> ArgumentDecisionDict:
+    return {
+        arg_name: {"needed": True, "can_be_found": True}
+        for arg_name in known_arguments or {}
+    }
+
+
 async def generate_argument_decisions(
     function: IFunction,
     chat: BaseChatModel,
     user_query: str,
-    chat_history: List[OpasMessage],
+    chat_history: Union[List[OpasMessage], PromptContext],
+    cache: Optional[IGenerationCache] = None,
+    known_arguments: Optional[Dict[str, Any]] = None,
 ) -> ArgumentDecisionDict:
-    json_schema = await generate_argument_decisions_schema(function)
+    """
+    known_arguments, e.g. captured from a sample question, are needed and can be
+    found, only the other arguments are decided by the LLM
+    """
+    json_schema = await generate_argument_decisions_schema(function, known_arguments)
+    if not json_schema["properties"]:
+        return _known_argument_decisions(known_arguments)
 
-    final_messages = [
+    prompt_context = PromptContext.of(chat_history)
+    final_messages: List[BaseMessage] = [
         HumanMessage(
             content=f"""
-{build_chat_history_prompt(chat_history)}
+{prompt_context.chat_history_prompt}
 
 We are analyzing the following function:
-{function.get_signature()}
-
+{prompt_context.function_signature(function)}
+{_known_arguments_prompt(known_arguments)}
 For each of the arguments decide:
 - Should the argument be used?
 - Can we find the right value for the argument from the user_prompt or from CHAT HISTORY?
@@ -80,9 +110,10 @@ Respond in JSON.
         json_schema,
         "generate_argument_decisions",
         tags=["generate_argument_decisions"],
+        cache=cache,
     )
 
-    return result
+    return result | _known_argument_decisions(known_arguments)
 
 
 def entity_to_json_schema_obj(entity: IEntity):
@@ -92,12 +123,10 @@ def entity_to_json_schema_obj(entity: IEntity):
     return d
 
 
-async def generate_arguments(
+def _arguments_json_schema(
     function: IFunction,
-    chat: BaseChatModel,
-    user_query: str,
-    chat_history: List[OpasMessage],
     entities_info: Dict[str, List[IEntity]],
+    known_arguments: Optional[Dict[str, Any]] = None,
 ) -> dict:
     json_schema = deepcopy(function.get_parameters_json_schema())
 
@@ -108,14 +137,42 @@ async def generate_arguments(
         }
         json_schema["properties"][param] |= {"$ref": f"#/definitions/{param}"}
 
-    final_messages = [
+    # only ask for the arguments that are not known yet
+    for param in known_arguments or {}:
+        json_schema["properties"].pop(param, None)
+    if known_arguments and "required" in json_schema:
+        json_schema["required"] = [
+            param for param in json_schema["required"] if param not in known_arguments
+        ]
+
+    return json_schema
+
+
+async def generate_arguments(
+    function: IFunction,
+    chat: BaseChatModel,
+    user_query: str,
+    chat_history: Union[List[OpasMessage], PromptContext],
+    entities_info: Dict[str, List[IEntity]],
+    cache: Optional[IGenerationCache] = None,
+    known_arguments: Optional[Dict[str, Any]] = None,
+) -> dict:
+    """
+    known_arguments are kept as they are, the LLM only provides the others
+    """
+    json_schema = _arguments_json_schema(function, entities_info, known_arguments)
+    if not json_schema["properties"]:
+        return dict(known_arguments or {})
+
+    prompt_context = PromptContext.of(chat_history)
+    final_messages: List[BaseMessage] = [
         HumanMessage(
             content=f"""
-{build_chat_history_prompt(chat_history)}
+{prompt_context.chat_history_prompt}
 
 We want to invoke the following function:
-{function.get_signature()}
-
+{prompt_context.function_signature(function)}
+{_known_arguments_prompt(known_arguments)}
 Provide the arguments for the function call that match the user_prompt.
 
 Respond in JSON.
@@ -129,6 +186,109 @@ Respond in JSON.
         json_schema,
         "generate_arguments",
         tags=["generate_arguments"],
+        cache=cache,
+    )
+
+    return result | (known_arguments or {})
+
+
+def _arguments_and_decisions_json_schema(
+    function: IFunction,
+    entities_info: Dict[str, List[IEntity]],
+    known_arguments: Optional[Dict[str, Any]] = None,
+) -> dict:
+    arguments_json_schema = _arguments_json_schema(
+        function, entities_info, known_arguments
+    )
+
+    properties = {
+        key: {
+            "type": "object",
+            "properties": {
+                "needed": {"type": "boolean"},
+                "can_be_found": {"type": "boolean"},
+                "value": value_schema,
+            },
+            "required": ["needed", "can_be_found"],
+            "additionalProperties": False,
+        }
+        for key, value_schema in arguments_json_schema["properties"].items()
+    }
+
+    json_schema = {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties.keys()),
+        "additionalProperties": False,
+    }
+
+    # keep definitions at the root so that existing $refs still resolve
+    if "definitions" in arguments_json_schema:
+        json_schema["definitions"] = arguments_json_schema["definitions"]
+
+    return json_schema
+
+
+async def generate_arguments_and_decisions(
+    function: IFunction,
+    chat: BaseChatModel,
+    user_query: str,
+    chat_history: Union[List[OpasMessage], PromptContext],
+    entities_info: Dict[str, List[IEntity]],
+    cache: Optional[IGenerationCache] = None,
+    known_arguments: Optional[Dict[str, Any]] = None,
+) -> Tuple[dict, ArgumentDecisionDict]:
+    """
+    Single call equivalent of generate_arguments and generate_argument_decisions
+    """
+    json_schema = _arguments_and_decisions_json_schema(
+        function, entities_info, known_arguments
     )
+    if not json_schema["properties"]:
+        return dict(known_arguments or {}), _known_argument_decisions(known_arguments)
 
-    return result
+    prompt_context = PromptContext.of(chat_history)
+    final_messages: List[BaseMessage] = [
+        HumanMessage(
+            content=f"""
+{prompt_context.chat_history_prompt}
+
+We want to invoke the following function:
+{prompt_context.function_signature(function)}
+{_known_arguments_prompt(known_arguments)}
+For each of the arguments decide:
+- needed: Should the argument be used?
+- can_be_found: Can we find the right value for the argument from the user_prompt or from CHAT HISTORY?
+- value: If so, the value of the argument that matches the user_prompt.
+
+Respond in JSON.
+"""  # noqa: E501
+        )
+    ]
+
+    result = await generate_to_json(
+        chat,
+        final_messages,
+        json_schema,
+        "generate_arguments_and_decisions",
+        tags=["generate_arguments_and_decisions"],
+        cache=cache,
+    )
+
+    arguments = {
+        arg_name: arg_result["value"]
+        for arg_name, arg_result in result.items()
+        if "value" in arg_result
+    }
+    argument_decisions: ArgumentDecisionDict = {
+        arg_name: {
+            "needed": arg_result["needed"],
+            "can_be_found": arg_result["can_be_found"],
+        }
+        for arg_name, arg_result in result.items()
+    }
+
+    return (
+        arguments | (known_arguments or {}),
+        argument_decisions | _known_argument_decisions(known_arguments),
+    )
@@ -0,0 +1,65 @@
+import functools
+from typing import Dict, List, Optional, Union
+
+from openassistants.data_models.chat_messages import OpasMessage
+from openassistants.functions.base import IFunction
+from openassistants.functions.registry import FunctionRegistry
+from openassistants.llm_function_calling.utils import (
+    build_chat_history_prompt,
+    previous_interactions,
+)
+from openassistants.utils.history_representation import Interaction
+
+
+class PromptContext:
+    """
+    The prompt fragments shared by the LLM calls of one turn: the rendered chat
+    history, its interactions and the function signatures.
+    Each is computed on first use and reused by every later stage.
+    """
+
+    def __init__(
+        self,
+        chat_history: List[OpasMessage],
+        history_token_budget: Optional[int] = None,
+        registry: Optional[FunctionRegistry] = None,
+        history_dataframe_max_rows: Optional[int] = 50,
+    ):
+        self.chat_history = chat_history
+        self.history_token_budget = history_token_budget
+        self.history_dataframe_max_rows = history_dataframe_max_rows
+        self.registry = registry
+        self._signatures: Dict[str, str] = {}
+
+    @classmethod
+    def of(
+        cls, chat_history: Union[List[OpasMessage], "PromptContext"]
+    ) -> "PromptContext":
+        """
+        The stages take either the shared PromptContext of the turn or, like
+        before it existed, the bare chat history
+        """
+        if isinstance(chat_history, PromptContext):
+            return chat_history
+        return cls(chat_history)
+
+    @functools.cached_property
+    def interactions(self) -> List[Interaction]:
+        return previous_interactions(self.chat_history, self.history_token_budget)
+
+    @functools.cached_property
+    def chat_history_prompt(self) -> str:
+        return build_chat_history_prompt(
+            self.chat_history,
+            self.history_token_budget,
+            self.interactions,
+            self.history_dataframe_max_rows,
+        )
+
+    def function_signature(self, function: IFunction) -> str:
+        if self.registry is not None:
+            return self.registry.signature(function)
+        function_id = function.get_id()
+        if (signature := self._signatures.get(function_id)) is None:
+            signature = self._signatures[function_id] = function.get_signature()
+        return signature
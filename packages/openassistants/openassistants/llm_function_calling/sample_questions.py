@@ -0,0 +1,136 @@
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from openassistants.functions.base import IFunction
+from pydantic import BaseModel, InstanceOf
+
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+_QUOTES = str.maketrans({"‘": "'", "’": "'", "“": '"', "”": '"'})
+
+
+def normalize_question(text: str) -> str:
+    """
+    Normalize quotes and whitespace, and drop trailing punctuation
+    """
+    text = " ".join(text.translate(_QUOTES).split())
+    return text.rstrip("?.! ")
+
+
+class SampleQuestionMatch(BaseModel):
+    function: InstanceOf[IFunction]
+    arguments: Dict[str, Any] = {}
+
+
+def _argument_value(property_schema: dict, value: str) -> Optional[Any]:
+    value = value.strip(" '\"")
+    if value == "":
+        return None
+    match property_schema.get("type"):
+        case "string":
+            return value
+        case "integer":
+            return int(value) if re.fullmatch(r"-?\d+", value) else None
+        case "number":
+            try:
+                return float(value)
+            except ValueError:
+                return None
+    return None
+
+
+class _Template:
+    def __init__(self, function: IFunction, question: str):
+        self.function = function
+        self.placeholders: List[str] = []
+
+        pattern = ""
+        position = 0
+        for match in _PLACEHOLDER.finditer(question):
+            pattern += self._literal(question[position : match.start()])
+            name = match.group(1)
+            if name in self.placeholders:
+                pattern += f"(?P=p{self.placeholders.index(name)})"
+            else:
+                pattern += f"(?P<p{len(self.placeholders)}>.+?)"
+                self.placeholders.append(name)
+            position = match.end()
+        pattern += self._literal(question[position:])
+
+        self.regex = re.compile(pattern, re.IGNORECASE)
+
+    @staticmethod
+    def _literal(text: str) -> str:
+        words = text.split(" ")
+        return r"\s+".join(re.escape(word) for word in words)
+
+    def match(self, query: str) -> Optional[Dict[str, str]]:
+        if (match := self.regex.fullmatch(query)) is None:
+            return None
+        return {name: match.group(f"p{i}") for i, name in enumerate(self.placeholders)}
+
+    def arguments(self, values: Dict[str, str]) -> Dict[str, Any]:
+        properties: Dict[str, dict] = self.function.get_parameters_json_schema()[
+            "properties"
+        ]
+
+        # a single placeholder can fill a single parameter, whatever its name
+        if len(values) == 1 and len(properties) == 1:
+            values = {next(iter(properties)): next(iter(values.values()))}
+
+        arguments = {}
+        for name, value in values.items():
+            if name not in properties:
+                continue
+            if (parsed := _argument_value(properties[name], value)) is not None:
+                arguments[name] = parsed
+        return arguments
+
+
+class SampleQuestionMatcher:
+    """
+    Matches the user query against the sample questions of all functions.
+
+    Placeholders like {employee} in sample questions match any text. When exactly
+    one function matches, it can be selected without asking the LLM, and the text
+    captured by the placeholders pre-seeds the function arguments.
+    """
+
+    def __init__(self, functions: Sequence[IFunction]):
+        self._exact: Dict[str, List[IFunction]] = {}
+        self._templates: List[_Template] = []
+
+        for function in functions:
+            for question in function.get_sample_questions():
+                question = normalize_question(question)
+                literal = _PLACEHOLDER.sub("", question)
+                if not re.search(r"\w", literal):
+                    # a question made only of placeholders matches everything
+                    continue
+                if literal == question:
+                    self._exact.setdefault(question.casefold(), []).append(function)
+                else:
+                    self._templates.append(_Template(function, question))
+
+    def _candidates(self, query: str) -> List[Tuple[IFunction, Dict[str, Any]]]:
+        if (exact := self._exact.get(query.casefold())) is not None:
+            return [(function, {}) for function in exact]
+
+        candidates = []
+        for template in self._templates:
+            if (values := template.match(query)) is not None:
+                candidates.append((template.function, template.arguments(values)))
+        return candidates
+
+    def match(self, user_query: str) -> Optional[SampleQuestionMatch]:
+        """
+        Returns the matching function, or None if no function or more than one
+        function matches
+        """
+        candidates = self._candidates(normalize_question(user_query))
+
+        if len({function.get_id() for function, _ in candidates}) != 1:
+            return None
+
+        # prefer the template that fills the most arguments
+        function, arguments = max(candidates, key=lambda c: len(c[1]))
+        return SampleQuestionMatch(function=function, arguments=arguments)
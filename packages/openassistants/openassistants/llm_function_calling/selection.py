@@ -1,20 +1,33 @@
+import abc
 import asyncio
-from typing import List, Optional
+from typing import Callable, List, Optional, Union
 
 from langchain.chat_models.base import BaseChatModel
 from langchain.schema.messages import HumanMessage
 from openassistants.functions.base import IFunction
+from openassistants.functions.registry import FunctionRegistry
+from openassistants.llm_function_calling.cache import IGenerationCache
+from openassistants.llm_function_calling.shortlist import FunctionShortlist
 from openassistants.llm_function_calling.utils import (
     chunk_list_by_max_size,
+    chunk_list_by_token_budget,
     generate_to_json,
 )
+from openassistants.utils.stage_policy import StagePolicy, stage_policy
+from openassistants.utils.tracing import set_attribute, span
 from pydantic import BaseModel, InstanceOf
 
 
 async def filter_functions(
-    chat: BaseChatModel, functions: List[IFunction], user_query: str
+    chat: BaseChatModel,
+    functions: List[IFunction],
+    user_query: str,
+    cache: Optional[IGenerationCache] = None,
+    registry: Optional[FunctionRegistry] = None,
 ) -> Optional[str]:
-    functions_text = "\n".join([f.get_signature() for f in functions])
+    if registry is None:
+        registry = FunctionRegistry(functions)
+    functions_text = registry.functions_text(functions)
     json_schema = {
         "type": "object",
         "properties": {"function_name": {"$ref": "#/definitions/functions"}},
@@ -42,6 +55,7 @@ Respond in JSON.
             json_schema,
             "filter_functions",
             tags=["select_function_pre"],
+            cache=cache,
         )
     ).get("function_name")
 
@@ -53,35 +67,185 @@ class SelectFunctionResult(BaseModel):
     suggested_functions: Optional[List[InstanceOf[IFunction]]] = None
 
 
+class FunctionPrediction(BaseModel):
+    function: InstanceOf[IFunction]
+    confidence: float
+
+
+class IFunctionSelector(abc.ABC):
+    """
+    Picks a function without an LLM call, e.g. a local classifier.
+    select_function only uses predictions that are confident enough.
+    """
+
+    @abc.abstractmethod
+    async def predict(
+        self, registry: FunctionRegistry, user_query: str
+    ) -> Optional[FunctionPrediction]:
+        """
+        The most likely non fallback function, or None if there is no candidate
+        """
+        pass
+
+
+async def _prefilter(
+    chat: BaseChatModel,
+    registry: FunctionRegistry,
+    subsets: List[List[IFunction]],
+    user_query: str,
+    semaphore: asyncio.Semaphore,
+    cache: Optional[IGenerationCache],
+) -> List[str]:
+    async def filter_subset(subset: List[IFunction]) -> Optional[str]:
+        if len(subset) == 1:
+            # nothing to choose from
+            return subset[0].get_id()
+        async with semaphore:
+            return await filter_functions(chat, subset, user_query, cache, registry)
+
+    # Make LLM calls in parallel
+    tasks = [asyncio.create_task(filter_subset(subset)) for subset in subsets]
+
+    policy = stage_policy("filter_functions") or StagePolicy()
+    if tasks and policy.stage_deadline_ms is not None:
+        # also bounds the time the calls wait for the semaphore and for slots
+        _, pending = await asyncio.wait(tasks, timeout=policy.stage_deadline_ms / 1000)
+        for task in pending:
+            task.cancel()
+        if pending and not policy.partial_results:
+            raise asyncio.TimeoutError()
+
+    if not policy.partial_results:
+        results = await asyncio.gather(*tasks)
+        return list(filter(None, results))
+
+    # proceed with the chunks that answered, e.g. within the stage deadline
+    outcomes = [
+        # chunks cancelled at the stage deadline timed out
+        asyncio.TimeoutError() if isinstance(o, asyncio.CancelledError) else o
+        for o in await asyncio.gather(*tasks, return_exceptions=True)
+    ]
+    failures = [o for o in outcomes if isinstance(o, BaseException)]
+    if failures and len(failures) == len(outcomes):
+        raise failures[0]
+    if failures:
+        set_attribute("failed_chunks", len(failures))
+    return [o for o in outcomes if o and not isinstance(o, BaseException)]
+
+
 async def select_function(
     chat: BaseChatModel,
-    functions: List[IFunction],
+    functions: Union[FunctionRegistry, List[IFunction]],
     user_query: str,
+    chunk_token_budget: Optional[int] = None,
+    max_concurrency: Optional[int] = 8,
+    shortlist: Optional[FunctionShortlist] = None,
+    cache: Optional[IGenerationCache] = None,
+    hierarchical: bool = False,
+    max_rounds: int = 4,
+    selector: Optional[IFunctionSelector] = None,
+    selector_threshold: float = 0.8,
+    on_candidates: Optional[Callable[[List[IFunction]], None]] = None,
     chunk_size: int = 4,
 ) -> SelectFunctionResult:
-    non_fallbacks = [f for f in functions if not f.get_is_fallback()]
-    fallbacks = [f for f in functions if f.get_is_fallback()]
+    """
+    The candidates are split into chunks of chunk_size functions, one
+    prefiltering LLM call per chunk. With a chunk_token_budget, they are packed
+    into chunks of about that many tokens of signatures instead, so that chunks
+    of long signatures don't overflow the prompt. At most max_concurrency of
+    these calls run at the same time, None for no limit.
 
-    subsets = chunk_list_by_max_size(non_fallbacks, chunk_size)
+    With hierarchical, prefiltering runs as a tournament: related functions (see
+    FunctionRegistry.cluster_key) compete in the same chunk, and the winners of a
+    round compete again until they fit in one chunk, or for at most max_rounds
+    rounds. The final prompt then stays small however many functions
+    there are, and the rounds grow logarithmically with the number of functions.
 
-    # Make LLM calls in parallel
-    tasks = [
-        asyncio.create_task(filter_functions(chat, subset, user_query))
-        for subset in subsets
-    ]
-    results = await asyncio.gather(*tasks)
-    function_names: set[str] = set(filter(None, results))
+    A selector prediction with a confidence of at least selector_threshold is
+    used without any LLM call.
+
+    on_candidates is called with the prefiltered candidates before the final
+    selection call, e.g. to start work on them speculatively.
+    """
+
+    registry = (
+        functions
+        if isinstance(functions, FunctionRegistry)
+        else FunctionRegistry(functions)
+    )
+
+    if selector is not None:
+        with span("local_selection"):
+            prediction = await selector.predict(registry, user_query)
+            if prediction is not None:
+                set_attribute("function_id", prediction.function.get_id())
+                set_attribute("confidence", prediction.confidence)
+        if prediction is not None and prediction.confidence >= selector_threshold:
+            return SelectFunctionResult(function=prediction.function)
+
+    non_fallbacks = registry.non_fallbacks
+    fallbacks = registry.fallbacks
+
+    # Narrow down the candidates by embedding similarity before any LLM call
+    if shortlist is not None:
+        non_fallbacks = await shortlist.shortlist(
+            non_fallbacks, user_query, registry.signature
+        )
+
+    def chunk(candidates: List[IFunction], keep_order: bool) -> List[List[IFunction]]:
+        if chunk_token_budget is None:
+            return chunk_list_by_max_size(candidates, chunk_size) if candidates else []
+        return chunk_list_by_token_budget(
+            candidates,
+            [registry.signature_tokens(f) for f in candidates],
+            chunk_token_budget,
+            keep_order=keep_order,
+        )
+
+    def fits_one_chunk(candidates: List[IFunction]) -> bool:
+        if chunk_token_budget is None:
+            return len(candidates) <= chunk_size
+        return (
+            sum(registry.signature_tokens(f) for f in candidates) <= chunk_token_budget
+        )
+
+    semaphore = asyncio.Semaphore(max_concurrency or len(non_fallbacks) or 1)
+
+    if not hierarchical:
+        subsets = chunk(non_fallbacks, keep_order=False)
+        function_names = await _prefilter(
+            chat, registry, subsets, user_query, semaphore, cache
+        )
+    else:
+        candidates = non_fallbacks
+        for round_index in range(max_rounds):
+            if round_index > 0 and fits_one_chunk(candidates):
+                break
+            with span("selection_round", round=round_index, candidates=len(candidates)):
+                clustered = sorted(candidates, key=registry.cluster_key)
+                subsets = chunk(clustered, keep_order=True)
+                winners = registry.get_many(
+                    await _prefilter(
+                        chat, registry, subsets, user_query, semaphore, cache
+                    )
+                )
+            if len(winners) == len(candidates):
+                # no chunk could be narrowed down any further
+                break
+            candidates = winners
+        function_names = [f.get_id() for f in candidates]
 
     # Ensure the selected function names are in the loaded signatures
-    selected_functions = [f for f in functions if f.get_id() in function_names]
+    selected_functions = registry.get_many(function_names)
+
+    if on_candidates is not None:
+        on_candidates(selected_functions)
 
     if len(selected_functions) == 0 and len(fallbacks) == 0:
         return SelectFunctionResult()
 
     # Include the signatures of all the selected functions in the final evaluation
-    selected_functions_signatures = "\n".join(
-        [f.get_signature() for f in selected_functions]
-    )
+    selected_functions_signatures = registry.functions_text(selected_functions)
 
     json_schema = {
         "type": "object",
@@ -100,7 +264,7 @@ async def select_function(
         },
     }
 
-    fallbacks_signatures = "\n".join([f.get_signature() for f in fallbacks])
+    fallbacks_signatures = registry.functions_text(fallbacks)
 
     selection_messages = [
         HumanMessage(
@@ -135,18 +299,17 @@ Respond in JSON.
         json_schema,
         "select_function",
         tags=["select_function"],
+        cache=cache,
     )
 
     function_name = json_result.get("function_name")
     suggested_function_names = json_result.get("related_function_names", [])
 
-    selected_function = next(
-        (f for f in selected_functions + fallbacks if f.get_id() == function_name), None
-    )
+    candidates_by_id = {f.get_id(): f for f in selected_functions + fallbacks}
+
+    selected_function = candidates_by_id.get(function_name)  # type: ignore
     suggested_functions = [
-        f
-        for f in selected_functions + fallbacks
-        if f.get_id() in suggested_function_names
+        f for f_id, f in candidates_by_id.items() if f_id in suggested_function_names
     ] or None
 
     return SelectFunctionResult(
@@ -0,0 +1,102 @@
+import asyncio
+import hashlib
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from openassistants.functions.base import IFunction
+from openassistants.llm_function_calling.entity_index import embeddings_namespace
+
+
+def function_to_text(function: IFunction) -> str:
+    # the signature contains the name, parameters, description and sample questions
+    return function.get_signature()
+
+
+class FunctionShortlist:
+    """
+    Ranks functions against the user query by cosine similarity of their embeddings
+    so that only the top_k most similar functions are sent to LLM selection.
+
+    Each function is embedded once, keyed by a hash of its text, so the per-request
+    cost is a single query embedding plus one matrix-vector product.
+    """
+
+    def __init__(self, embeddings: Embeddings, top_k: int = 8):
+        self.embeddings = embeddings
+        self.top_k = top_k
+        self._namespace = embeddings_namespace(embeddings)
+        self._vectors: Dict[str, np.ndarray] = {}
+        self._matrices: Dict[Tuple[str, ...], np.ndarray] = {}
+        self._lock = asyncio.Lock()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self._namespace}\x00{text}".encode()).hexdigest()
+
+    def add_precomputed(self, vectors: Dict[str, List[float]]) -> None:
+        """
+        Seed the cache with function text embeddings, keyed by function text
+        """
+        for text, vector in vectors.items():
+            self._vectors[self._key(text)] = _normalize(np.array(vector))
+
+    async def embed_functions(
+        self,
+        functions: Sequence[IFunction],
+        function_text: Callable[[IFunction], str] = function_to_text,
+    ) -> np.ndarray:
+        """
+        Returns the matrix of normalized embeddings, one row per function.
+        function_text can return cached signatures, e.g. FunctionRegistry.signature
+        """
+        keys = tuple(self._key(function_text(f)) for f in functions)
+
+        if (matrix := self._matrices.get(keys)) is not None:
+            return matrix
+
+        async with self._lock:
+            missing = {
+                key: function_text(f)
+                for key, f in zip(keys, functions)
+                if key not in self._vectors
+            }
+            if missing:
+                vectors = await self.embeddings.aembed_documents(list(missing.values()))
+                for key, vector in zip(missing.keys(), vectors):
+                    self._vectors[key] = _normalize(np.array(vector))
+
+        matrix = np.stack([self._vectors[key] for key in keys])
+        if len(self._matrices) >= 16:
+            # function sets only change on library reloads
+            self._matrices.clear()
+        self._matrices[keys] = matrix
+        return matrix
+
+    async def shortlist(
+        self,
+        functions: Sequence[IFunction],
+        user_query: str,
+        function_text: Callable[[IFunction], str] = function_to_text,
+    ) -> List[IFunction]:
+        """
+        Returns the top_k functions most similar to the user query, best match first
+        """
+        if len(functions) <= self.top_k:
+            return list(functions)
+
+        matrix, query_vector = await asyncio.gather(
+            self.embed_functions(functions, function_text),
+            self.embeddings.aembed_query(user_query),
+        )
+
+        scores = matrix @ _normalize(np.array(query_vector))
+        top = np.argpartition(-scores, self.top_k)[: self.top_k]
+        top = top[np.argsort(-scores[top])]
+
+        return [functions[i] for i in top]
+
+
+def _normalize(vector: np.ndarray) -> np.ndarray:
+    vector = vector.astype(np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
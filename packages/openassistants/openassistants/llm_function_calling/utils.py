@@ -1,5 +1,5 @@
 import json
-from typing import List, Optional
+from typing import Iterator, List, Optional, Sequence, TypeVar
 
 import numpy as np
 from langchain.chat_models.base import BaseChatModel
@@ -10,9 +10,25 @@ from openassistants.data_models.chat_messages import (
     OpasUserMessage,
     ensure_alternating,
 )
+from openassistants.llm_function_calling.cache import (
+    IGenerationCache,
+    generation_cache_key,
+)
 from openassistants.utils import yaml
-from openassistants.utils.history_representation import opas_to_interactions
+from openassistants.utils.history_representation import (
+    Interaction,
+    opas_to_interactions,
+)
 from openassistants.utils.langchain_util import openai_function_call_enabled
+from openassistants.utils.llm_scheduler import llm_slot, token_counting_enabled
+from openassistants.utils.stage_policy import run_stage
+from openassistants.utils.tokens import count_message_tokens, count_tokens
+from openassistants.utils.tracing import (
+    current_span,
+    record_cache_hit,
+    record_llm_call,
+    span,
+)
 
 OUTPUT_FORMAT_INSTRUCTION = """\
 You are a helpful assistant.
@@ -22,8 +38,85 @@ Your responses MUST be formatted as a valid JSON instance that conforms to the J
 {schema}
 """  # noqa: E501
 
+T = TypeVar("T")
+
+
+def _interaction_dict(interaction: Interaction) -> dict:
+    return interaction.model_dump(
+        mode="json",
+        include={
+            "user_prompt",
+            "assistant_response",
+            "function_name",
+            "function_arguments",
+            "function_output_data",
+            "function_output_summary",
+        },
+        exclude_none=True,
+    )
+
 
-def build_chat_history_prompt(chat_history: List[OpasMessage]) -> str:
+def _renderings(
+    interaction: Interaction, newest: bool, dataframe_max_rows: Optional[int]
+) -> Iterator[Interaction]:
+    """
+    The ways to render an interaction, from the most to the least verbose
+    """
+    if newest:
+        yield interaction.render()
+    if dataframe_max_rows is not None:
+        yield interaction.render(dataframe_max_rows)
+    yield interaction.compact()
+
+
+def _budgeted_interaction_dicts(
+    interactions: List[Interaction],
+    token_budget: int,
+    dataframe_max_rows: Optional[int] = 50,
+) -> List[dict]:
+    """
+    Keep the newest interactions that fit in the budget, walking from the newest
+    to the oldest. The newest interaction is kept verbatim if it fits. Older ones
+    have their dataframes with more than dataframe_max_rows rows summarized, and
+    are compacted if they still don't fit. Once an interaction doesn't fit at
+    all, it and all older interactions are dropped without being rendered.
+    """
+    kept: List[dict] = []
+    remaining = token_budget
+    for index, interaction in enumerate(reversed(interactions)):
+        # a csv row is at least one token, skip renderings that can't fit
+        newest = index == 0 and interaction.num_dataframe_rows <= remaining
+        for candidate in _renderings(interaction, newest, dataframe_max_rows):
+            interaction_dict = _interaction_dict(candidate)
+            tokens = count_tokens(yaml.dumps(interaction_dict))
+            if tokens <= remaining:
+                break
+        else:
+            break
+        kept.append(interaction_dict)
+        remaining -= tokens
+    return kept[::-1]
+
+
+def previous_interactions(
+    chat_history: List[OpasMessage], token_budget: Optional[int] = None
+) -> List[Interaction]:
+    """
+    The interactions before the last user message. With a token_budget, their
+    dataframes are only rendered when the prompt is built, for the interactions
+    that fit.
+    """
+    return opas_to_interactions(
+        chat_history[:-1], render_dataframes=token_budget is None
+    )
+
+
+def build_chat_history_prompt(
+    chat_history: List[OpasMessage],
+    token_budget: Optional[int] = None,
+    interactions: Optional[List[Interaction]] = None,
+    dataframe_max_rows: Optional[int] = 50,
+) -> str:
     """
     Build a string that looks like
 
@@ -37,29 +130,33 @@ def build_chat_history_prompt(chat_history: List[OpasMessage]) -> str:
     user: ...
     ---
     END OF CHAT HISTORY
+
+    With a token_budget, the previous interactions are shortened to fit in about
+    that many tokens, see _budgeted_interaction_dicts for dataframe_max_rows.
+    interactions can be passed if already computed with previous_interactions.
     """
 
-    previous_history, last_message = chat_history[:-1], chat_history[-1]
+    last_message = chat_history[-1]
 
     assert isinstance(last_message, OpasUserMessage)
 
-    interactions = opas_to_interactions(previous_history)
-
-    interactions_dicts = [
-        interaction.model_dump(
-            mode="json",
-            include={
-                "user_prompt",
-                "assistant_response",
-                "function_name",
-                "function_arguments",
-                "function_output_data",
-                "function_output_summary",
-            },
-            exclude_none=True,
+    if interactions is None:
+        interactions = previous_interactions(chat_history, token_budget)
+
+    last_dict = {"user_prompt": last_message.content.strip()}
+
+    if token_budget is None:
+        interactions_dicts = [
+            _interaction_dict(interaction) for interaction in interactions
+        ]
+    else:
+        interactions_dicts = _budgeted_interaction_dicts(
+            interactions,
+            token_budget - count_tokens(yaml.dumps(last_dict)),
+            dataframe_max_rows,
         )
-        for interaction in interactions
-    ] + [{"user_prompt": last_message.content.strip()}]
+
+    interactions_dicts.append(last_dict)
 
     message_yaml_str = yaml.dumps_all(interactions_dicts)
 
@@ -77,6 +174,46 @@ def chunk_list_by_max_size(lst, max_size):
     return [chunk.tolist() for chunk in np.array_split(lst, n)]
 
 
+def chunk_list_by_token_budget(
+    lst: Sequence[T],
+    token_counts: Sequence[int],
+    token_budget: int,
+    keep_order: bool = False,
+) -> List[List[T]]:
+    """
+    Pack the items into as few chunks as possible, each chunk totalling at most
+    token_budget tokens. An item larger than the budget gets a chunk of its own.
+
+    First fit decreasing, the items of a chunk keep their order in lst.
+    With keep_order, the chunks are consecutive runs of lst instead, so that
+    neighbouring items end up in the same chunk.
+    """
+    if keep_order:
+        chunks: List[List[T]] = []
+        used = 0
+        for item, tokens in zip(lst, token_counts):
+            if not chunks or used + tokens > token_budget:
+                chunks.append([])
+                used = 0
+            chunks[-1].append(item)
+            used += tokens
+        return chunks
+
+    chunk_indexes: List[List[int]] = []
+    chunk_tokens: List[int] = []
+    for index in sorted(range(len(lst)), key=lambda i: -token_counts[i]):
+        tokens = token_counts[index]
+        for chunk_index, used in enumerate(chunk_tokens):
+            if used + tokens <= token_budget:
+                chunk_indexes[chunk_index].append(index)
+                chunk_tokens[chunk_index] += tokens
+                break
+        else:
+            chunk_indexes.append([index])
+            chunk_tokens.append(tokens)
+    return [[lst[index] for index in sorted(indexes)] for indexes in chunk_indexes]
+
+
 def find_indexes_of_char(string: str, char: str):
     return [index for index, c in enumerate(string) if c == char]
 
@@ -103,17 +240,55 @@ async def generate_to_json(
     output_json_schema: Optional[dict],
     task_name: str,
     tags: Optional[list[str]] = None,
+    cache: Optional[IGenerationCache] = None,
 ) -> dict:
-    if output_json_schema is not None and openai_function_call_enabled(chat):
-        assert isinstance(chat, ChatOpenAI)
-        return await generate_to_json_openai(
-            chat, messages, output_json_schema, task_name, tags or []
-        )
-    else:
-        return await generate_to_json_generic(
-            chat, messages, output_json_schema, tags or []
+    with span(task_name):
+        if cache is not None:
+            key = generation_cache_key(chat, messages, output_json_schema, task_name)
+            if (cached := await cache.aget(key)) is not None:
+                record_cache_hit()
+                return json.loads(cached)
+
+        # only the trace and the scheduler use token counts
+        counting = token_counting_enabled()
+        prompt_tokens = (
+            count_message_tokens(messages)
+            + count_tokens(json.dumps(output_json_schema))
+            if counting
+            else 0
         )
 
+        async def generate() -> dict:
+            if output_json_schema is not None and openai_function_call_enabled(chat):
+                assert isinstance(chat, ChatOpenAI)
+                return await generate_to_json_openai(
+                    chat, messages, output_json_schema, task_name, tags or []
+                )
+            return await generate_to_json_generic(
+                chat, messages, output_json_schema, tags or []
+            )
+
+        async with llm_slot(chat, prompt_tokens) as slot:
+
+            def on_hedge() -> None:
+                # the duplicate call is made in the same slot
+                slot.add_tokens(prompt_tokens)
+                record_llm_call(prompt_tokens, 0)
+
+            # the task name is the stage, for deadlines and hedging
+            result = await run_stage(task_name, generate, on_hedge)
+            result_str = json.dumps(result)
+            completion_tokens = count_tokens(result_str) if counting else 0
+            slot.add_tokens(completion_tokens)
+
+        if current_span() is not None:
+            record_llm_call(prompt_tokens, completion_tokens)
+
+        if cache is not None:
+            await cache.aset(key, result_str)
+
+        return result
+
 
 async def generate_to_json_generic(
     chat: BaseChatModel,
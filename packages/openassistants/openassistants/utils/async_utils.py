@@ -1,5 +1,7 @@
+import asyncio
 import logging
-from typing import AsyncGenerator, TypeVar
+import time
+from typing import Any, AsyncGenerator, Callable, Generic, Optional, TypeVar
 
 T = TypeVar("T")
 
@@ -20,3 +22,117 @@ async def last_value(src: AsyncStreamVersion) -> T:
         raise e
 
     return last
+
+
+_NOTHING: Any = object()
+
+
+async def coalesce(
+    src: AsyncStreamVersion[T],
+    max_interval_ms: float,
+    max_pending: Optional[int] = None,
+    structure_key: Optional[Callable[[T], Any]] = None,
+) -> AsyncStreamVersion[T]:
+    """
+    Skip intermediate versions of a stream that updates faster than its consumers
+    need, e.g. one version per LLM token.
+
+    A version is held back until max_interval_ms have passed since the last one
+    that was passed on, or until max_pending versions in a row were held back.
+    A version whose structure_key differs from the key of the last version passed
+    on is passed on right away. The key is computed when a version is passed on,
+    so producers may keep mutating the versions they yield, e.g. append outputs
+    to the same list. The first and the final version are always passed on.
+
+    The stream is consumed in a background task, so a held back version is passed
+    on after max_interval_ms even when the producer stalls.
+    """
+    prefetch = Prefetch(src)
+    last_key: Any = _NOTHING
+    last_emitted_at: Optional[float] = None
+    held_back: Any = _NOTHING
+    num_held_back = 0
+
+    try:
+        while True:
+            timeout = None
+            if held_back is not _NOTHING:
+                elapsed = time.monotonic() - last_emitted_at  # type: ignore
+                timeout = max(max_interval_ms / 1000 - elapsed, 0)
+            stalled = False
+            try:
+                version = await prefetch.next(timeout)
+            except asyncio.TimeoutError:
+                version, stalled = held_back, True
+            except StopAsyncIteration:
+                break
+
+            key = _NOTHING if structure_key is None else structure_key(version)
+            if not (
+                stalled
+                or last_emitted_at is None
+                or (time.monotonic() - last_emitted_at) * 1000 >= max_interval_ms
+                or (max_pending is not None and num_held_back >= max_pending)
+                or key != last_key
+            ):
+                held_back = version
+                num_held_back += 1
+                continue
+
+            last_key = key
+            last_emitted_at = time.monotonic()
+            held_back = _NOTHING
+            num_held_back = 0
+            yield version
+
+        if held_back is not _NOTHING:
+            yield held_back
+    finally:
+        prefetch.cancel()
+
+
+class Prefetch(Generic[T]):
+    """
+    Consume a stream in a background task, ahead of its consumer, e.g. to start
+    work speculatively before knowing whether it is needed.
+
+    At most maxsize versions are buffered, after that the stream is paused until
+    the consumer catches up, which bounds the work that a cancel discards.
+    """
+
+    def __init__(self, src: AsyncStreamVersion[T], maxsize: int = 1):
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self._task = asyncio.create_task(self._produce(src))
+
+    async def _produce(self, src: AsyncStreamVersion[T]) -> None:
+        try:
+            async for version in src:
+                await self._queue.put((version, None))
+        except Exception as e:
+            await self._queue.put((None, e))
+            return
+        await self._queue.put((None, StopAsyncIteration()))
+
+    async def next(self, timeout: Optional[float] = None) -> T:
+        """
+        The next version. Raises StopAsyncIteration at the end of the stream and
+        asyncio.TimeoutError when no version arrives within timeout seconds.
+        """
+        version, error = await asyncio.wait_for(self._queue.get(), timeout)
+        if error is not None:
+            raise error
+        return version
+
+    async def stream(self) -> AsyncStreamVersion[T]:
+        try:
+            while True:
+                try:
+                    version = await self.next()
+                except StopAsyncIteration:
+                    return
+                yield version
+        finally:
+            self.cancel()
+
+    def cancel(self) -> None:
+        self._task.cancel()
@@ -0,0 +1,180 @@
+from typing import Annotated, List, Literal, Union
+
+from openassistants.data_models.chat_messages import (
+    OpasAssistantMessage,
+    OpasFunctionMessage,
+    OpasMessage,
+)
+from openassistants.data_models.function_output import FunctionOutput, TextOutput
+from openassistants.utils.async_utils import AsyncStreamVersion
+from pydantic import BaseModel, Field
+
+
+class AddMessage(BaseModel):
+    type: Literal["add_message"] = "add_message"
+    message_index: int
+    message: OpasMessage
+
+
+class ReplaceMessage(BaseModel):
+    type: Literal["replace_message"] = "replace_message"
+    message_index: int
+    message: OpasMessage
+
+
+class AppendContent(BaseModel):
+    """
+    Text was appended to the content of an assistant message
+    """
+
+    type: Literal["append_content"] = "append_content"
+    message_index: int
+    text: str
+
+
+class AddOutput(BaseModel):
+    type: Literal["add_output"] = "add_output"
+    message_index: int
+    output_index: int
+    output: FunctionOutput
+
+
+class ReplaceOutput(BaseModel):
+    type: Literal["replace_output"] = "replace_output"
+    message_index: int
+    output_index: int
+    output: FunctionOutput
+
+
+class AppendOutputText(BaseModel):
+    """
+    Text was appended to a text output of a function message
+    """
+
+    type: Literal["append_output_text"] = "append_output_text"
+    message_index: int
+    output_index: int
+    text: str
+
+
+MessageDelta = Annotated[
+    Union[
+        AddMessage,
+        ReplaceMessage,
+        AppendContent,
+        AddOutput,
+        ReplaceOutput,
+        AppendOutputText,
+    ],
+    Field(json_schema_extra={"descriminator": "type"}),
+]
+
+
+def _diff_outputs(
+    message_index: int,
+    old: List[FunctionOutput],
+    new: List[FunctionOutput],
+) -> List[MessageDelta]:
+    deltas: List[MessageDelta] = []
+    for output_index, new_output in enumerate(new):
+        if output_index >= len(old):
+            deltas.append(
+                AddOutput(
+                    message_index=message_index,
+                    output_index=output_index,
+                    output=new_output,
+                )
+            )
+            continue
+
+        old_output = old[output_index]
+        if old_output is new_output:
+            continue
+
+        if (
+            isinstance(old_output, TextOutput)
+            and isinstance(new_output, TextOutput)
+            and new_output.text.startswith(old_output.text)
+        ):
+            if new_output.text != old_output.text:
+                deltas.append(
+                    AppendOutputText(
+                        message_index=message_index,
+                        output_index=output_index,
+                        text=new_output.text[len(old_output.text) :],
+                    )
+                )
+        elif old_output != new_output:
+            deltas.append(
+                ReplaceOutput(
+                    message_index=message_index,
+                    output_index=output_index,
+                    output=new_output,
+                )
+            )
+    return deltas
+
+
+def _diff_message(
+    message_index: int, old: OpasMessage, new: OpasMessage
+) -> List[MessageDelta]:
+    if old is new:
+        return []
+
+    replace: List[MessageDelta] = [
+        ReplaceMessage(message_index=message_index, message=new)
+    ]
+
+    if isinstance(old, OpasFunctionMessage) and isinstance(new, OpasFunctionMessage):
+        if old.name != new.name or len(new.outputs) < len(old.outputs):
+            return replace
+        return _diff_outputs(message_index, old.outputs, new.outputs)
+
+    if isinstance(old, OpasAssistantMessage) and isinstance(new, OpasAssistantMessage):
+        if (
+            old.function_call != new.function_call
+            or old.input_request != new.input_request
+            or not new.content.startswith(old.content)
+        ):
+            return replace
+        if new.content == old.content:
+            return []
+        return [
+            AppendContent(
+                message_index=message_index,
+                text=new.content[len(old.content) :],
+            )
+        ]
+
+    return [] if old == new else replace
+
+
+def diff_messages(old: List[OpasMessage], new: List[OpasMessage]) -> List[MessageDelta]:
+    """
+    The structural changes between two versions of a message list.
+
+    Unchanged messages and outputs are skipped by identity, so the cost depends on
+    what changed between the versions rather than on the size of the response.
+    """
+    if len(new) < len(old):
+        raise ValueError("message list versions must not shrink")
+
+    deltas: List[MessageDelta] = []
+    for message_index, new_message in enumerate(new):
+        if message_index >= len(old):
+            deltas.append(AddMessage(message_index=message_index, message=new_message))
+        else:
+            deltas.extend(_diff_message(message_index, old[message_index], new_message))
+    return deltas
+
+
+async def stream_deltas(
+    src: AsyncStreamVersion[List[OpasMessage]],
+) -> AsyncStreamVersion[List[MessageDelta]]:
+    """
+    Turn a stream of message list versions into a stream of deltas
+    """
+    old: List[OpasMessage] = []
+    async for new in src:
+        yield diff_messages(old, new)
+        old = new
@@ -8,13 +8,48 @@ from openassistants.data_models.chat_messages import (
     OpasUserMessage,
 )
 from openassistants.data_models.function_output import DataFrameOutput, TextOutput
-from pydantic import BaseModel
-
-
-def _render_df_for_llm(df: pd.DataFrame) -> str:
+from openassistants.data_models.serialized_dataframe import SerializedDataFrame
+from pydantic import BaseModel, PrivateAttr
+
+
+def _value_counts(series: pd.Series) -> Optional[pd.Series]:
+    try:
+        return series.value_counts()
+    except TypeError:
+        # unhashable values, e.g. lists or dicts from JSON columns
+        return None
+
+
+def _summarize_df_for_llm(df: pd.DataFrame, head_rows: int) -> str:
+    """
+    Schema, column statistics and the first rows of a dataframe
+    """
+    lines = [f"{len(df)} rows. Columns:"]
+    for column in df.columns:
+        series = df[column]
+        line = f"- {column} ({series.dtype})"
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(
+            series
+        ):
+            line += f": min {series.min()}, max {series.max()}, mean {series.mean():g}"
+        elif (counts := _value_counts(series)) is not None and len(counts) > 0:
+            line += f": {len(counts)} distinct, most common {counts.index[0]!r}"
+        lines.append(line)
+
+    if head_rows > 0:
+        lines.append(f"First {head_rows} rows:")
+        lines.append(df.head(head_rows).to_csv(index=False, date_format="iso"))
+
+    return "\n".join(lines)
+
+
+def _render_df_for_llm(df: pd.DataFrame, max_rows: Optional[int] = None) -> str:
     if len(df) == 0:
         return "Data Not Available."
 
+    if max_rows is not None and len(df) > max_rows:
+        return _summarize_df_for_llm(df, head_rows=min(5, max_rows))
+
     return df.to_csv(index=False, date_format="iso")
 
 
@@ -35,10 +70,52 @@ class Interaction(BaseModel):
     function_output_data: Optional[str] = None
     function_output_summary: Optional[str] = None
 
+    _dataframes: List[SerializedDataFrame] = PrivateAttr(default_factory=list)
+
+    @property
+    def num_dataframe_rows(self) -> int:
+        return sum(len(dataframe.to_pd()) for dataframe in self._dataframes)
+
+    def render(self, dataframe_max_rows: Optional[int] = None) -> "Interaction":
+        """
+        A copy with the output dataframes rendered into function_output_data.
+        Dataframes with more than dataframe_max_rows rows are summarized.
+        """
+        if len(self._dataframes) == 0:
+            return self
+        return self.model_copy(
+            update={
+                "function_output_data": "\n\n".join(
+                    _render_df_for_llm(dataframe.to_pd(), dataframe_max_rows)
+                    for dataframe in self._dataframes
+                ).strip()
+            }
+        )
+
+    def compact(self) -> "Interaction":
+        """
+        A copy with the output dataframes reduced to their schema and statistics
+        """
+        non_empty = [df for df in (d.to_pd() for d in self._dataframes) if len(df) > 0]
+        if len(non_empty) == 0:
+            return self.render()
+        return self.model_copy(
+            update={
+                "function_output_data": "\n\n".join(
+                    _summarize_df_for_llm(df, head_rows=0) for df in non_empty
+                )
+            }
+        )
+
 
 def opas_to_interactions(
     chat_history: List[OpasMessage],
+    render_dataframes: bool = True,
 ) -> List[Interaction]:
+    """
+    Without render_dataframes, function_output_data is left empty, see
+    Interaction.render
+    """
     current_interaction = Interaction(user_prompt="PLACEHOLDER")
 
     interaction_list = []
@@ -69,17 +146,9 @@ def opas_to_interactions(
             case OpasFunctionMessage(role="function", outputs=outputs):
                 for output in outputs:
                     if isinstance(output, DataFrameOutput):
-                        current_interaction.function_output_data = (
-                            (current_interaction.function_output_data or "")
-                            + "\n\n"
-                            + _render_df_for_llm(output.dataframe.to_pd())
-                        )
+                        current_interaction._dataframes.append(output.dataframe)
                     elif isinstance(output, TextOutput):
                         current_interaction.function_output_summary = output.text
-                if current_interaction.function_output_data is not None:
-                    current_interaction.function_output_data = (
-                        current_interaction.function_output_data.strip()
-                    )
                 if current_interaction.function_output_summary is not None:
                     current_interaction.function_output_summary = (
                         current_interaction.function_output_summary.strip()
@@ -90,4 +159,6 @@ def opas_to_interactions(
     # drop placeholder
     interaction_list = interaction_list[1:]
 
+    if render_dataframes:
+        return [interaction.render() for interaction in interaction_list]
     return interaction_list
@@ -0,0 +1,10 @@
+import importlib
+from typing import Any
+
+
+def import_object(path: str) -> Any:
+    """
+    The object at an import path like my_app.main:assistant, for command lines
+    """
+    module_name, _, attribute = path.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)
@@ -57,6 +57,8 @@ class LangChainCachedEmbeddings(Embeddings):
             f"{langchain_underlying_embedder.__class__.__name__}({embedder_params})"
         )
 
+        self.namespace = namespace
+
         self.embedder = CacheBackedEmbeddings.from_bytes_store(
             langchain_underlying_embedder,
             langchain_embedding_store,
@@ -0,0 +1,320 @@
+import asyncio
+import contextlib
+import contextvars
+import dataclasses
+import enum
+import heapq
+import itertools
+import time
+from typing import AsyncIterator, Dict, Iterator, List, Mapping, Optional, Sequence
+
+from langchain.chat_models.base import BaseChatModel
+from langchain.schema.messages import BaseMessage, BaseMessageChunk
+from langchain_core.runnables import RunnableConfig
+from openassistants.utils.async_utils import AsyncStreamVersion, Prefetch
+from openassistants.utils.langchain_util import string_from_message
+from openassistants.utils.tokens import count_tokens
+from openassistants.utils.tracing import current_span, set_attribute
+from pydantic import BaseModel
+
+
+class LLMPriority(enum.IntEnum):
+    """
+    Lower values are served first
+    """
+
+    INTERACTIVE = 0
+    SUMMARIZATION = 1
+    EVAL = 2
+
+
+class ModelLimits(BaseModel):
+    max_concurrency: Optional[int] = None
+    tokens_per_minute: Optional[int] = None
+
+
+class ModelMetrics(BaseModel):
+    in_flight: int = 0
+    queue_depth: Dict[str, int] = {}
+    requests: int = 0
+    total_wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+    tokens: int = 0
+
+
+@dataclasses.dataclass(order=True)
+class _Waiter:
+    priority: int
+    sequence: int
+    tokens: int = dataclasses.field(compare=False)
+    future: asyncio.Future = dataclasses.field(compare=False)
+
+
+class _ModelLimiter:
+    """
+    Grants calls to one model in priority order, first come first served within
+    a priority, while in flight calls and the token bucket allow
+    """
+
+    def __init__(self, limits: ModelLimits):
+        self.limits = limits
+        self.in_flight = 0
+        self.stats = ModelMetrics()
+        self._waiters: List[_Waiter] = []
+        self._sequence = itertools.count()
+        self._available = float(limits.tokens_per_minute or 0)
+        self._refilled_at = time.monotonic()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _refill(self) -> None:
+        if (tpm := self.limits.tokens_per_minute) is None:
+            return
+        now = time.monotonic()
+        self._available = min(
+            tpm, self._available + (now - self._refilled_at) * tpm / 60
+        )
+        self._refilled_at = now
+
+    def _missing_tokens(self, tokens: int) -> float:
+        if (tpm := self.limits.tokens_per_minute) is None:
+            return 0
+        # a call larger than the whole budget waits for a full bucket
+        return max(min(tokens, tpm) - self._available, 0)
+
+    def _redispatch(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        self._timer = None
+        self._refill()
+        while self._waiters:
+            waiter = self._waiters[0]
+            if waiter.future.done():
+                # cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            max_concurrency = self.limits.max_concurrency
+            if max_concurrency is not None and self.in_flight >= max_concurrency:
+                # a release dispatches again
+                return
+            if (missing := self._missing_tokens(waiter.tokens)) > 0:
+                tpm: int = self.limits.tokens_per_minute  # type: ignore
+                self._timer = asyncio.get_running_loop().call_later(
+                    missing * 60 / tpm, self._dispatch
+                )
+                return
+            heapq.heappop(self._waiters)
+            self.in_flight += 1
+            self._available -= waiter.tokens
+            waiter.future.set_result(None)
+
+    async def acquire(self, priority: LLMPriority, tokens: int) -> float:
+        """
+        Wait for a slot, returns the time waited in seconds
+        """
+        started_at = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(
+            self._waiters, _Waiter(priority, next(self._sequence), tokens, future)
+        )
+        self._redispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # granted, but the caller is gone
+                self.release()
+            else:
+                future.cancel()
+                self._redispatch()
+            raise
+
+        waited = time.monotonic() - started_at
+        self.stats.requests += 1
+        self.stats.total_wait_seconds += waited
+        self.stats.max_wait_seconds = max(self.stats.max_wait_seconds, waited)
+        self.stats.tokens += tokens
+        return waited
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._redispatch()
+
+    def charge(self, tokens: int) -> None:
+        """
+        Tokens used on top of the estimate the slot was granted with
+        """
+        self._refill()
+        self._available -= tokens
+        self.stats.tokens += tokens
+
+    def metrics(self) -> ModelMetrics:
+        queue_depth: Dict[str, int] = {}
+        for waiter in self._waiters:
+            if not waiter.future.done():
+                name = LLMPriority(waiter.priority).name.lower()
+                queue_depth[name] = queue_depth.get(name, 0) + 1
+        return self.stats.model_copy(
+            update={"in_flight": self.in_flight, "queue_depth": queue_depth}
+        )
+
+
+class LLMSlot:
+    def __init__(self, limiter: Optional[_ModelLimiter] = None):
+        self._limiter = limiter
+
+    def add_tokens(self, tokens: int) -> None:
+        """
+        Charge the completion tokens to the token budget of the model
+        """
+        if self._limiter is not None:
+            self._limiter.charge(tokens)
+
+
+class LLMScheduler:
+    """
+    Shared limits for the LLM calls of all requests, by model name: how many
+    calls may run at the same time and how many tokens may be used per minute.
+
+    Waiting calls are served by priority, see LLMPriority. Models without an
+    entry in limits use default_limits, no limits by default.
+    """
+
+    def __init__(
+        self,
+        limits: Optional[Mapping[str, ModelLimits]] = None,
+        default_limits: Optional[ModelLimits] = None,
+    ):
+        self.limits = dict(limits or {})
+        self.default_limits = default_limits or ModelLimits()
+        self._limiters: Dict[str, _ModelLimiter] = {}
+
+    def _limiter(self, model: str) -> _ModelLimiter:
+        if (limiter := self._limiters.get(model)) is None:
+            limiter = _ModelLimiter(self.limits.get(model, self.default_limits))
+            self._limiters[model] = limiter
+        return limiter
+
+    @contextlib.asynccontextmanager
+    async def slot(
+        self, model: str, priority: LLMPriority, prompt_tokens: int
+    ) -> AsyncIterator[LLMSlot]:
+        limiter = self._limiter(model)
+        waited = await limiter.acquire(priority, prompt_tokens)
+        if waited >= 0.001:
+            set_attribute("llm_queue_wait_ms", round(waited * 1000, 1))
+        try:
+            yield LLMSlot(limiter)
+        finally:
+            limiter.release()
+
+    def metrics(self) -> Dict[str, ModelMetrics]:
+        """
+        Queue depth by priority, calls in flight and time waited, by model name
+        """
+        return {model: limiter.metrics() for model, limiter in self._limiters.items()}
+
+
+_current_scheduler: contextvars.ContextVar[Optional[LLMScheduler]] = (
+    contextvars.ContextVar("llm_scheduler", default=None)
+)
+_current_priority: contextvars.ContextVar[LLMPriority] = contextvars.ContextVar(
+    "llm_priority", default=LLMPriority.INTERACTIVE
+)
+
+
+@contextlib.contextmanager
+def use_llm_scheduler(scheduler: LLMScheduler) -> Iterator[None]:
+    # set and restore explicitly rather than with a reset token, because the
+    # context may be held open across yields of async generators that are
+    # finalized in other contexts, e.g. after a client disconnect
+    previous = _current_scheduler.get()
+    _current_scheduler.set(scheduler)
+    try:
+        yield
+    finally:
+        _current_scheduler.set(previous)
+
+
+@contextlib.contextmanager
+def llm_priority(priority: LLMPriority) -> Iterator[None]:
+    """
+    The priority of the LLM calls made in this context, e.g. EVAL for eval runs.
+    A call never gets a higher priority than its context.
+    """
+    previous = _current_priority.get()
+    _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.set(previous)
+
+
+def model_key(chat: BaseChatModel) -> str:
+    return (
+        getattr(chat, "model_name", None)
+        or getattr(chat, "model", None)
+        or chat._llm_type
+    )
+
+
+def token_counting_enabled() -> bool:
+    """
+    Whether the current request traces or schedules its LLM calls, otherwise
+    nothing uses token counts and counting them can be skipped
+    """
+    return _current_scheduler.get() is not None or current_span() is not None
+
+
+@contextlib.asynccontextmanager
+async def llm_slot(
+    chat: BaseChatModel,
+    prompt_tokens: int = 0,
+    priority: LLMPriority = LLMPriority.INTERACTIVE,
+) -> AsyncIterator[LLMSlot]:
+    """
+    Hold a slot of the current scheduler for one LLM call. Does nothing when no
+    scheduler is in use.
+    """
+    if (scheduler := _current_scheduler.get()) is None:
+        yield LLMSlot()
+        return
+
+    priority = max(priority, _current_priority.get())
+    async with scheduler.slot(model_key(chat), priority, prompt_tokens) as slot:
+        yield slot
+
+
+async def _astream_chunks(
+    chat: BaseChatModel,
+    messages: Sequence[BaseMessage],
+    config: Optional[RunnableConfig],
+    prompt_tokens: int,
+    priority: LLMPriority,
+) -> AsyncStreamVersion[BaseMessageChunk]:
+    completion = ""
+    async with llm_slot(chat, prompt_tokens, priority) as slot:
+        async for chunk in chat.astream(messages, config):
+            completion += string_from_message(chunk)
+            yield chunk
+        if _current_scheduler.get() is not None:
+            slot.add_tokens(count_tokens(completion))
+
+
+def astream_in_slot(
+    chat: BaseChatModel,
+    messages: Sequence[BaseMessage],
+    config: Optional[RunnableConfig] = None,
+    prompt_tokens: int = 0,
+    priority: LLMPriority = LLMPriority.INTERACTIVE,
+) -> AsyncIterator[BaseMessageChunk]:
+    """
+    chat.astream, holding a slot of the current scheduler only while the provider
+    streams. The chunks are read ahead in a background task, so a slow or gone
+    consumer doesn't keep the slot.
+    """
+    return Prefetch(
+        _astream_chunks(chat, messages, config, prompt_tokens, priority), maxsize=0
+    ).stream()
@@ -0,0 +1,182 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+import time
+from typing import (
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    TypeVar,
+)
+
+from openassistants.utils.tracing import set_attribute
+from pydantic import BaseModel
+
+T = TypeVar("T")
+
+
+class StagePolicy(BaseModel):
+    """
+    How the LLM calls of one stage, e.g. "filter_functions", are bounded.
+
+    Deadlines and latencies are measured from the time a call was granted a slot
+    by the LLM scheduler, waiting for the slot doesn't count.
+
+    deadline_ms: a call that takes longer fails with asyncio.TimeoutError
+    hedge: when a call takes longer than the hedge_quantile latency of the stage,
+        a duplicate call is made in the same slot and the first answer wins.
+        Hedging starts once hedge_min_samples latencies were recorded.
+    stage_deadline_ms: for stages that fan out, e.g. "filter_functions", a
+        deadline for all of their calls, including the time they wait for slots
+    partial_results: for stages that fan out, proceed with the calls that
+        succeeded when others fail or miss a deadline
+    """
+
+    deadline_ms: Optional[float] = None
+    stage_deadline_ms: Optional[float] = None
+    hedge: bool = False
+    hedge_quantile: float = 0.95
+    hedge_min_samples: int = 20
+    partial_results: bool = False
+
+
+class LatencyTracker:
+    """
+    The latencies of the most recent calls, by stage
+    """
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._latencies: Dict[str, Deque[float]] = {}
+
+    def record(self, stage: str, seconds: float) -> None:
+        self._latencies.setdefault(stage, collections.deque(maxlen=self.window)).append(
+            seconds
+        )
+
+    def quantile(self, stage: str, q: float, min_samples: int = 1) -> Optional[float]:
+        latencies = self._latencies.get(stage)
+        if latencies is None or len(latencies) < max(min_samples, 1):
+            return None
+        ordered = sorted(latencies)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+async def _first_success(tasks: List["asyncio.Task[T]"]) -> T:
+    """
+    The result of the first task that succeeds, or the error of the last one
+    """
+    pending = set(tasks)
+    while True:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is None:
+                return task.result()
+        if not pending:
+            raise done.pop().exception()  # type: ignore
+
+
+class StageRunner:
+    def __init__(
+        self,
+        policies: Mapping[str, StagePolicy],
+        latencies: Optional[LatencyTracker] = None,
+    ):
+        self.policies = dict(policies)
+        self.latencies = latencies or LatencyTracker()
+
+    async def _timed(self, stage: str, make_call: Callable[[], Awaitable[T]]) -> T:
+        started_at = time.monotonic()
+        result = await make_call()
+        self.latencies.record(stage, time.monotonic() - started_at)
+        return result
+
+    async def _hedged(
+        self,
+        stage: str,
+        policy: StagePolicy,
+        make_call: Callable[[], Awaitable[T]],
+        on_hedge: Optional[Callable[[], None]],
+    ) -> T:
+        hedge_delay = (
+            self.latencies.quantile(
+                stage, policy.hedge_quantile, policy.hedge_min_samples
+            )
+            if policy.hedge
+            else None
+        )
+
+        first = asyncio.create_task(self._timed(stage, make_call))
+        tasks = [first]
+        try:
+            if hedge_delay is not None:
+                done, _ = await asyncio.wait([first], timeout=hedge_delay)
+                if not done:
+                    set_attribute("hedged", True)
+                    if on_hedge is not None:
+                        on_hedge()
+                    tasks.append(asyncio.create_task(self._timed(stage, make_call)))
+            return await _first_success(tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def run(
+        self,
+        stage: str,
+        make_call: Callable[[], Awaitable[T]],
+        on_hedge: Optional[Callable[[], None]] = None,
+    ) -> T:
+        if (policy := self.policies.get(stage)) is None:
+            return await self._timed(stage, make_call)
+
+        call = self._hedged(stage, policy, make_call, on_hedge)
+        if policy.deadline_ms is None:
+            return await call
+        return await asyncio.wait_for(call, policy.deadline_ms / 1000)
+
+
+_current_runner: contextvars.ContextVar[Optional[StageRunner]] = contextvars.ContextVar(
+    "stage_runner", default=None
+)
+
+
+@contextlib.contextmanager
+def use_stage_runner(runner: StageRunner) -> Iterator[None]:
+    # set and restore explicitly rather than with a reset token, see
+    # use_llm_scheduler
+    previous = _current_runner.get()
+    _current_runner.set(runner)
+    try:
+        yield
+    finally:
+        _current_runner.set(previous)
+
+
+def stage_policy(stage: str) -> Optional[StagePolicy]:
+    if (runner := _current_runner.get()) is None:
+        return None
+    return runner.policies.get(stage)
+
+
+async def run_stage(
+    stage: str,
+    make_call: Callable[[], Awaitable[T]],
+    on_hedge: Optional[Callable[[], None]] = None,
+) -> T:
+    """
+    Make one LLM call of a stage, applying the policy of the stage if any.
+    Call this once the call holds its scheduler slot.
+
+    on_hedge is called when a duplicate call is made, e.g. to account for its
+    tokens.
+    """
+    if (runner := _current_runner.get()) is None:
+        return await make_call()
+    return await runner.run(stage, make_call, on_hedge)
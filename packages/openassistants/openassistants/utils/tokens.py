@@ -0,0 +1,39 @@
+import functools
+import logging
+from typing import Optional, Sequence
+
+import tiktoken
+from langchain.schema.messages import BaseMessage
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding() -> Optional[tiktoken.Encoding]:
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # tiktoken downloads the encoding on first use, which fails offline
+        logger.warning("tiktoken encoding unavailable, approximating token counts")
+        return None
+
+
+def load_encoding() -> None:
+    """
+    Load the encoding ahead of the first count_tokens call, e.g. at startup.
+    The first load reads or even downloads it, blocking the event loop.
+    """
+    _encoding()
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count tokens locally, as the OpenAI chat models would
+    """
+    if (encoding := _encoding()) is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: Sequence[BaseMessage]) -> int:
+    return sum(count_tokens(str(message.content)) for message in messages)
@@ -0,0 +1,179 @@
+import abc
+import contextlib
+import contextvars
+import logging
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from pydantic import BaseModel, Field, computed_field
+
+logger = logging.getLogger(__name__)
+
+
+class Span(BaseModel):
+    name: str
+    attributes: Dict[str, Any] = {}
+    start_time: float = Field(default_factory=time.time)
+    end_time: Optional[float] = None
+    llm_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cache_hits: int = 0
+    children: List["Span"] = []
+
+    @computed_field  # type: ignore[misc]
+    @property
+    def duration_ms(self) -> Optional[float]:
+        if self.end_time is None:
+            return None
+        return (self.end_time - self.start_time) * 1000
+
+    def totals(self) -> Dict[str, int]:
+        """
+        LLM call, token and cache hit counts of this span and all its descendants
+        """
+        totals = {
+            "llm_calls": self.llm_calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cache_hits": self.cache_hits,
+        }
+        for child in self.children:
+            for key, value in child.totals().items():
+                totals[key] += value
+        return totals
+
+
+class ITraceHook(abc.ABC):
+    @abc.abstractmethod
+    def on_trace_end(self, trace: Span) -> None:
+        """
+        Called with the root span once a traced request has finished
+        """
+        pass
+
+
+class TraceCollector(ITraceHook):
+    """
+    Keeps the finished traces, e.g. to attach them to a response
+    """
+
+    def __init__(self):
+        self.traces: List[Span] = []
+
+    def on_trace_end(self, trace: Span) -> None:
+        self.traces.append(trace)
+
+    @property
+    def last(self) -> Optional[Span]:
+        return self.traces[-1] if self.traces else None
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "openassistants_current_span", default=None
+)
+_current_trace: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "openassistants_current_trace", default=None
+)
+
+
+def current_span() -> Optional[Span]:
+    """
+    The innermost active span, or None when the request isn't traced
+    """
+    return _current_span.get()
+
+
+def _restore(
+    var: contextvars.ContextVar[Optional[Span]],
+    token: contextvars.Token,
+    previous: Optional[Span],
+) -> None:
+    try:
+        var.reset(token)
+    except ValueError:
+        # spans may be held open across yields of async generators, which can
+        # resume in another context where the token is not valid
+        var.set(previous)
+
+
+@contextlib.contextmanager
+def _activate(span: Span, parent: Optional[Span]) -> Iterator[Span]:
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        span.end_time = time.time()
+        _restore(_current_span, token, parent)
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """
+    Open a child span of the current span. Does nothing when tracing is inactive.
+    """
+    if (parent := _current_span.get()) is None:
+        yield None
+        return
+
+    child = Span(name=name, attributes=attributes)
+    parent.children.append(child)
+    with _activate(child, parent) as active:
+        yield active
+
+
+@contextlib.contextmanager
+def trace(
+    name: str, hooks: Sequence[ITraceHook], **attributes: Any
+) -> Iterator[Optional[Span]]:
+    """
+    Open a root span that is handed to the hooks when it ends.
+    Without hooks this is a plain child span.
+    """
+    if len(hooks) == 0:
+        with span(name, **attributes) as child:
+            yield child
+        return
+
+    root = Span(name=name, attributes=attributes)
+    parent_trace = _current_trace.get()
+    token = _current_trace.set(root)
+    with _activate(root, _current_span.get()):
+        try:
+            yield root
+        finally:
+            root.end_time = time.time()
+            _restore(_current_trace, token, parent_trace)
+            for hook in hooks:
+                try:
+                    hook.on_trace_end(root)
+                except Exception:
+                    logger.exception("Trace hook failed")
+
+
+def set_attribute(key: str, value: Any) -> None:
+    """
+    Set an attribute on the current span
+    """
+    if (active := _current_span.get()) is not None:
+        active.attributes[key] = value
+
+
+def set_trace_attribute(key: str, value: Any) -> None:
+    """
+    Set an attribute on the root span, e.g. to group traces by function id
+    """
+    if (root := _current_trace.get()) is not None:
+        root.attributes[key] = value
+
+
+def record_llm_call(prompt_tokens: int, completion_tokens: int) -> None:
+    if (active := _current_span.get()) is not None:
+        active.llm_calls += 1
+        active.prompt_tokens += prompt_tokens
+        active.completion_tokens += completion_tokens
+
+
+def record_cache_hit() -> None:
+    if (active := _current_span.get()) is not None:
+        active.cache_hits += 1
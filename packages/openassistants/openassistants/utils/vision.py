@@ -1,26 +1,88 @@
+import hashlib
+from typing import List, Optional
+
 from langchain.chat_models.base import BaseChatModel
-from langchain.schema.messages import HumanMessage
+from langchain.schema.messages import BaseMessage, HumanMessage
+from openassistants.utils.llm_scheduler import llm_slot, token_counting_enabled
+from openassistants.utils.lru_cache import LRUCache
+from openassistants.utils.tokens import count_tokens
+from openassistants.utils.tracing import record_llm_call, span
 
 
-def image_url_to_text(
-    vision_model: BaseChatModel, image_url: str, text_context: str
-) -> str:
-    description_prompt = (
+def _description_prompt(text_context: str) -> str:
+    return (
         "Describe this image in detail."
         " Only use one or two sentences, but include specific details."
         "The image needs to be described in the context"
         " of the following user question:"
         f"START_CONTEXT\n{text_context}\nEND_CONTEXT."
     )
-    msg = vision_model.invoke(
-        [
-            HumanMessage(
-                content=[
-                    {"type": "text", "text": description_prompt},
-                    {"type": "image_url", "image_url": image_url},
-                ]
+
+
+def _description_messages(image_url: str, description_prompt: str) -> List[BaseMessage]:
+    return [
+        HumanMessage(
+            content=[
+                {"type": "text", "text": description_prompt},
+                {"type": "image_url", "image_url": image_url},
+            ]
+        )
+    ]
+
+
+def image_cache_key(image_url: str, text_context: str) -> str:
+    """
+    Image URLs are usually data URLs, so this hashes the image content
+    """
+    digest = hashlib.sha256(image_url.encode())
+    digest.update(b"\0")
+    digest.update(text_context.encode())
+    return digest.hexdigest()
+
+
+def image_url_to_text(
+    vision_model: BaseChatModel, image_url: str, text_context: str
+) -> str:
+    description_prompt = _description_prompt(text_context)
+    with span("vision") as active:
+        msg = vision_model.invoke(_description_messages(image_url, description_prompt))
+        if active is not None:
+            record_llm_call(
+                count_tokens(description_prompt), count_tokens(str(msg.content))
             )
-        ]
-    )
 
     return msg.content
+
+
+async def aimage_url_to_text(
+    vision_model: BaseChatModel,
+    image_url: str,
+    text_context: str,
+    cache: Optional[LRUCache[str, str]] = None,
+) -> str:
+    """
+    Async version of image_url_to_text, that doesn't block the event loop.
+    Descriptions are cached by image content and text context.
+    """
+    key = image_cache_key(image_url, text_context)
+    if cache is not None and (description := cache.get(key)) is not None:
+        return description
+
+    description_prompt = _description_prompt(text_context)
+    counting = token_counting_enabled()
+    prompt_tokens = count_tokens(description_prompt) if counting else 0
+    with span("vision") as active:
+        async with llm_slot(vision_model, prompt_tokens) as slot:
+            msg = await vision_model.ainvoke(
+                _description_messages(image_url, description_prompt)
+            )
+            description = str(msg.content)
+            completion_tokens = count_tokens(description) if counting else 0
+            slot.add_tokens(completion_tokens)
+        if active is not None:
+            record_llm_call(prompt_tokens, completion_tokens)
+
+    if cache is not None:
+        cache.set(key, description)
+
+    return description
@@ -0,0 +1,69 @@
+import asyncio
+from typing import List, Sequence
+
+import pytest
+from langchain.chat_models.fake import FakeListChatModel
+from langchain.embeddings import FakeEmbeddings
+from openassistants.contrib.text_response import TextResponseFunction
+from openassistants.core.assistant import Assistant
+from openassistants.functions.base import IFunction, IFunctionLibrary
+
+
+class _SlowLibrary(IFunctionLibrary):
+    def __init__(self):
+        self.loads = 0
+        self.running = 0
+        self.max_running = 0
+
+    async def get_all_functions(self) -> Sequence[IFunction]:
+        self.loads += 1
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        return [
+            TextResponseFunction(
+                id=f"version_{self.loads}",
+                type="TextResponseFunction",
+                description="a function",
+                text_response="hi",
+            )
+        ]
+
+
+def _assistant(libraries: List[IFunctionLibrary]) -> Assistant:
+    chat = FakeListChatModel(responses=["{}"])
+    return Assistant(
+        libraries=libraries,
+        function_identification=chat,
+        function_infilling=chat,
+        function_summarization=chat,
+        function_fallback=chat,
+        vision_model=chat,
+        entity_embedding_model=FakeEmbeddings(size=4),
+        add_index=False,
+    )
+
+
+@pytest.mark.asyncio
+async def test_concurrent_reloads_run_one_after_the_other():
+    library = _SlowLibrary()
+    assistant = _assistant([library])
+
+    registries = await asyncio.gather(*[assistant.reload_functions() for _ in range(3)])
+
+    assert library.max_running == 1
+    assert library.loads == 3
+    assert (await assistant.get_registry()) is registries[-1]
+    assert (await assistant.get_function_by_id("version_3")) is not None
+
+
+@pytest.mark.asyncio
+async def test_first_requests_load_the_functions_once():
+    library = _SlowLibrary()
+    assistant = _assistant([library])
+
+    registries = await asyncio.gather(*[assistant.get_registry() for _ in range(3)])
+
+    assert library.loads == 1
+    assert registries[0] is registries[1] is registries[2]
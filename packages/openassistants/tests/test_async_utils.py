@@ -0,0 +1,102 @@
+import asyncio
+from typing import List
+
+import pytest
+from openassistants.utils.async_utils import Prefetch, coalesce
+
+
+async def _versions(versions, delay: float = 0.0):
+    for version in versions:
+        yield version
+        await asyncio.sleep(delay)
+
+
+async def _collect(stream) -> list:
+    return [version async for version in stream]
+
+
+@pytest.mark.asyncio
+async def test_coalesce_skips_intermediate_versions():
+    emitted = await _collect(coalesce(_versions(range(100)), max_interval_ms=10_000))
+    assert emitted == [0, 99]
+
+
+@pytest.mark.asyncio
+async def test_coalesce_without_interval_limit_passes_everything():
+    emitted = await _collect(coalesce(_versions(range(5), 0.001), max_interval_ms=0))
+    assert emitted == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.asyncio
+async def test_coalesce_max_pending():
+    emitted = await _collect(
+        coalesce(_versions(range(10)), max_interval_ms=10_000, max_pending=3)
+    )
+    assert emitted == [0, 4, 8, 9]
+
+
+@pytest.mark.asyncio
+async def test_coalesce_structure_of_a_mutated_version():
+    # the producer appends to the list it already yielded
+    async def outputs():
+        results: List[str] = []
+        for output in ["text", "text", "table", "table", "chart"]:
+            if results and results[-1] == output:
+                results[-1] = output
+            else:
+                results.append(output)
+            yield results
+
+    emitted = []
+    async for version in coalesce(outputs(), 10_000, structure_key=tuple):
+        emitted.append(list(version))
+    # every new output is passed on right away, not only at the end
+    assert emitted[0] == ["text"]
+    assert ["text", "table"] in emitted
+    assert emitted[-1] == ["text", "table", "chart"]
+
+
+@pytest.mark.asyncio
+async def test_coalesce_flushes_when_the_producer_stalls():
+    async def stalling():
+        yield "a"
+        yield "ab"
+        await asyncio.sleep(0.5)
+        yield "abc"
+
+    loop = asyncio.get_running_loop()
+    started_at = loop.time()
+    arrivals = []
+    async for version in coalesce(stalling(), max_interval_ms=20):
+        arrivals.append((version, loop.time() - started_at))
+
+    assert [version for version, _ in arrivals] == ["a", "ab", "abc"]
+    assert arrivals[1][1] < 0.25
+
+
+@pytest.mark.asyncio
+async def test_coalesce_raises_producer_errors():
+    async def failing():
+        yield 1
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        await _collect(coalesce(failing(), 10_000))
+
+
+@pytest.mark.asyncio
+async def test_prefetch_runs_ahead_and_cancels():
+    produced = []
+
+    async def producer():
+        for i in range(10):
+            produced.append(i)
+            yield i
+
+    prefetch = Prefetch(producer(), maxsize=1)
+    await asyncio.sleep(0.01)
+    # one version buffered, one waiting to be put
+    assert produced == [0, 1]
+    prefetch.cancel()
+
+    assert await _collect(Prefetch(producer()).stream()) == list(range(10))
@@ -0,0 +1,162 @@
+from typing import List, Optional
+
+import pytest
+from langchain.chat_models.fake import FakeListChatModel
+from openassistants.contrib.text_response import TextResponseFunction
+from openassistants.functions.registry import FunctionRegistry
+from openassistants.llm_function_calling import selection
+from openassistants.llm_function_calling.classifier import (
+    TfidfFunctionSelector,
+    evaluate,
+    split_examples,
+)
+from openassistants.llm_function_calling.selection import (
+    FunctionPrediction,
+    IFunctionSelector,
+)
+
+
+def _function(function_id: str, description: str, sample_questions: List[str]):
+    return TextResponseFunction(
+        id=function_id,
+        type="TextResponseFunction",
+        description=description,
+        text_response="hi",
+        sample_questions=sample_questions,
+    )
+
+
+def _registry() -> FunctionRegistry:
+    return FunctionRegistry(
+        [
+            _function(
+                "sales_by_region",
+                "Total sales revenue per region",
+                ["What were the sales in {region}?", "Show revenue by region"],
+            ),
+            _function(
+                "employee_headcount",
+                "Number of employees per department",
+                ["How many employees work in {department}?", "Show the headcount"],
+            ),
+        ]
+    )
+
+
+def test_fit_and_predict():
+    registry = _registry()
+    selector = TfidfFunctionSelector()
+    model = selector.fit(registry.non_fallbacks)
+
+    prediction = selector.predict_with_model(model, "show me sales revenue by region")
+    assert prediction is not None
+    assert prediction.function.get_id() == "sales_by_region"
+    assert 0.5 < prediction.confidence <= 1
+
+    prediction = selector.predict_with_model(model, "how many employees are there")
+    assert prediction is not None
+    assert prediction.function.get_id() == "employee_headcount"
+
+    # unrelated questions are left to the fallback
+    assert selector.predict_with_model(model, "tell me a joke") is None
+
+
+def test_examples_are_trained_on():
+    registry = _registry()
+    query = "who joined us lately"
+    selector = TfidfFunctionSelector({"employee_headcount": [query]})
+
+    prediction = selector.predict_with_model(
+        selector.fit(registry.non_fallbacks), query
+    )
+    assert prediction is not None
+    assert prediction.function.get_id() == "employee_headcount"
+    assert evaluate(selector, registry, [(query, "employee_headcount")], 0.0) == {
+        "accuracy": 1.0,
+        "coverage": 1.0,
+        "confident_accuracy": 1.0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_model_is_fitted_once_per_registry(monkeypatch):
+    selector = TfidfFunctionSelector()
+    fits = []
+    fit = selector.fit
+    monkeypatch.setattr(
+        selector, "fit", lambda functions: fits.append(1) or fit(functions)
+    )
+
+    registry = _registry()
+    await selector.predict(registry, "revenue by region")
+    await selector.predict(registry, "headcount")
+    assert len(fits) == 1
+
+    # a reload creates a new registry
+    await selector.predict(_registry(), "headcount")
+    assert len(fits) == 2
+
+
+def test_split_examples_holds_out_a_share():
+    examples = [(f"question {i}", "f") for i in range(10)]
+    training, held_out = split_examples(examples, 0.2)
+
+    assert len(training) == 8
+    assert len(held_out) == 2
+    assert sorted(training + held_out) == sorted(examples)
+    assert split_examples(examples, 0.2) == (training, held_out)
+    training, held_out = split_examples(examples, 0)
+    assert sorted(training) == sorted(examples)
+    assert held_out == []
+
+
+class _FixedSelector(IFunctionSelector):
+    def __init__(self, function_id: str, confidence: float):
+        self.function_id = function_id
+        self.confidence = confidence
+
+    async def predict(
+        self, registry: FunctionRegistry, user_query: str
+    ) -> Optional[FunctionPrediction]:
+        return FunctionPrediction(
+            function=registry.get(self.function_id), confidence=self.confidence
+        )
+
+
+@pytest.mark.asyncio
+async def test_confident_predictions_skip_the_llm(monkeypatch):
+    async def filter_functions(*args) -> None:
+        raise AssertionError("no LLM call expected")
+
+    monkeypatch.setattr(selection, "filter_functions", filter_functions)
+
+    result = await selection.select_function(
+        FakeListChatModel(responses=[]),
+        _registry(),
+        "revenue by region",
+        selector=_FixedSelector("sales_by_region", 0.9),
+        selector_threshold=0.8,
+    )
+    assert result.function is not None
+    assert result.function.get_id() == "sales_by_region"
+
+
+@pytest.mark.asyncio
+async def test_unconfident_predictions_fall_back_to_the_llm(monkeypatch):
+    prefiltered: List[str] = []
+
+    async def filter_functions(chat, functions, *args) -> None:
+        prefiltered.extend(f.get_id() for f in functions)
+        return None
+
+    monkeypatch.setattr(selection, "filter_functions", filter_functions)
+
+    result = await selection.select_function(
+        FakeListChatModel(responses=[]),
+        _registry(),
+        "revenue by region",
+        selector=_FixedSelector("sales_by_region", 0.5),
+        selector_threshold=0.8,
+    )
+    assert result.function is None
+    assert sorted(prefiltered) == ["employee_headcount", "sales_by_region"]
@@ -0,0 +1,90 @@
+import pytest
+from openassistants.data_models.chat_messages import (
+    OpasAssistantMessage,
+    OpasFunctionMessage,
+    OpasUserMessage,
+)
+from openassistants.data_models.function_input import FunctionCall
+from openassistants.data_models.function_output import FollowUpsOutput, TextOutput
+from openassistants.utils.deltas import (
+    AddMessage,
+    AddOutput,
+    AppendContent,
+    AppendOutputText,
+    ReplaceMessage,
+    ReplaceOutput,
+    diff_messages,
+    stream_deltas,
+)
+
+CALL = OpasAssistantMessage(
+    content="", function_call=FunctionCall(name="f", arguments={"a": 1})
+)
+
+
+def test_add_messages():
+    user = OpasUserMessage(content="hi")
+    assert diff_messages([], [user, CALL]) == [
+        AddMessage(message_index=0, message=user),
+        AddMessage(message_index=1, message=CALL),
+    ]
+
+
+def test_unchanged_messages_are_skipped():
+    assert diff_messages([CALL], [CALL]) == []
+    assert diff_messages([CALL], [CALL.model_copy()]) == []
+
+
+def test_append_content_sends_only_the_suffix():
+    old = OpasAssistantMessage(content="Hello")
+    new = OpasAssistantMessage(content="Hello world")
+    assert diff_messages([old], [new]) == [
+        AppendContent(message_index=0, text=" world")
+    ]
+
+
+def test_rewritten_content_replaces_the_message():
+    old = OpasAssistantMessage(content="Hello")
+    new = OpasAssistantMessage(content="Goodbye")
+    assert diff_messages([old], [new]) == [ReplaceMessage(message_index=0, message=new)]
+
+
+def test_output_deltas():
+    text = TextOutput(text="x")
+    old = OpasFunctionMessage(name="f", outputs=[text, TextOutput(text="ab")])
+    new = OpasFunctionMessage(
+        name="f",
+        outputs=[text, TextOutput(text="abcd"), FollowUpsOutput(follow_ups=[])],
+    )
+    assert diff_messages([CALL, old], [CALL, new]) == [
+        AppendOutputText(message_index=1, output_index=1, text="cd"),
+        AddOutput(message_index=1, output_index=2, output=new.outputs[2]),
+    ]
+
+    replaced = OpasFunctionMessage(name="f", outputs=[TextOutput(text="y")])
+    assert diff_messages([old], [replaced]) == [
+        ReplaceMessage(message_index=0, message=replaced)
+    ]
+
+    changed = OpasFunctionMessage(name="f", outputs=[FollowUpsOutput(), old.outputs[1]])
+    assert diff_messages([old], [changed]) == [
+        ReplaceOutput(message_index=0, output_index=0, output=changed.outputs[0])
+    ]
+
+
+def test_shrinking_versions_are_rejected():
+    with pytest.raises(ValueError):
+        diff_messages([CALL, CALL], [CALL])
+
+
+@pytest.mark.asyncio
+async def test_stream_deltas():
+    async def versions():
+        yield [OpasAssistantMessage(content="a")]
+        yield [OpasAssistantMessage(content="ab")]
+
+    deltas = [delta async for delta in stream_deltas(versions())]
+    assert deltas == [
+        [AddMessage(message_index=0, message=OpasAssistantMessage(content="a"))],
+        [AppendContent(message_index=0, text="b")],
+    ]
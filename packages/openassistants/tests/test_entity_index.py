@@ -0,0 +1,103 @@
+import string
+from typing import List
+
+import pytest
+from langchain.embeddings.base import Embeddings
+from openassistants.contrib.text_response import TextResponseFunction
+from openassistants.data_models.chat_messages import OpasUserMessage
+from openassistants.functions.base import Entity, EntityConfig
+from openassistants.llm_function_calling.entity_index import EntityIndexManager
+from openassistants.llm_function_calling.entity_resolution import resolve_entities
+
+
+class _LetterEmbeddings(Embeddings):
+    """
+    Letter counts, so that a query is closest to the entity it spells
+    """
+
+    def __init__(self, model: str = "letters"):
+        self.model = model
+        self.embedded: List[str] = []
+
+    def _embed(self, text: str) -> List[float]:
+        return [text.lower().count(c) + 0.01 for c in string.ascii_lowercase]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.embedded.extend(texts)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+ENTITIES = [Entity(identity=name) for name in ["Jane", "Bob", "Alice"]]
+
+
+@pytest.mark.asyncio
+async def test_index_is_built_once_and_reused():
+    embeddings = _LetterEmbeddings()
+    manager = EntityIndexManager(embeddings)
+
+    assert await manager.search(ENTITIES, "alice", k=1) == ["Alice"]
+    assert await manager.search(list(ENTITIES), "bob", k=1) == ["Bob"]
+    assert embeddings.embedded == ["Jane", "Bob", "Alice"]
+
+    assert await manager.search([], "bob") == []
+
+
+@pytest.mark.asyncio
+async def test_changed_entities_or_model_invalidate_the_index():
+    embeddings = _LetterEmbeddings()
+    manager = EntityIndexManager(embeddings)
+    await manager.search(ENTITIES, "jane")
+
+    changed = ENTITIES + [Entity(identity="Zed")]
+    assert await manager.search(changed, "zed", k=1) == ["Zed"]
+    assert len(embeddings.embedded) == 3 + 4
+
+    other_model = _LetterEmbeddings(model="other")
+    await EntityIndexManager(other_model).search(ENTITIES, "jane")
+    assert len(other_model.embedded) == 3
+
+
+@pytest.mark.asyncio
+async def test_nothing_is_persisted_by_default(tmp_path):
+    assert EntityIndexManager(_LetterEmbeddings()).directory is None
+
+    await EntityIndexManager(_LetterEmbeddings(), str(tmp_path)).search(
+        ENTITIES, "jane"
+    )
+    embeddings = _LetterEmbeddings()
+    restarted = EntityIndexManager(embeddings, str(tmp_path))
+    assert await restarted.search(ENTITIES, "alice", k=1) == ["Alice"]
+    # loaded from the directory
+    assert embeddings.embedded == []
+
+
+@pytest.mark.asyncio
+async def test_resolve_entities_still_takes_embeddings():
+    class _Function(TextResponseFunction):
+        async def get_entity_configs(self):
+            names = ["Jane", "Bob", "Alice", "Zed", "Tom"]
+            return {
+                "employee": EntityConfig(entities=[Entity(identity=n) for n in names])
+            }
+
+    function = _Function(
+        id="sales",
+        type="TextResponseFunction",
+        description="sales of an employee",
+        text_response="hi",
+    )
+    entities = await resolve_entities(
+        function,
+        None,  # type: ignore
+        _LetterEmbeddings(),
+        "sales of alice",
+        [OpasUserMessage(content="sales of alice")],
+        preliminary_arguments={"employee": "alice"},
+    )
+    # the 3 closest
+    identities = [entity.get_identity() for entity in entities["employee"]]
+    assert len(identities) == 3
+    assert "Alice" in identities
@@ -0,0 +1,190 @@
+import threading
+import time
+from pathlib import Path
+from typing import List
+
+import pytest
+from langchain.chat_models.fake import FakeListChatModel
+from openassistants.contrib.text_response import TextResponseFunction
+from openassistants.data_models.chat_messages import OpasUserMessage
+from openassistants.functions.catalog import (
+    CatalogError,
+    FunctionCatalog,
+    compile_catalog,
+)
+from openassistants.functions.crud import LocalYAMLLibrary
+from openassistants.functions.registry import FunctionRegistry
+from openassistants.llm_function_calling.infilling import generate_argument_decisions
+from openassistants.llm_function_calling.prompt_context import PromptContext
+from openassistants.llm_function_calling.selection import select_function
+
+
+def _function(function_id: str, **kwargs) -> TextResponseFunction:
+    return TextResponseFunction(
+        id=function_id,
+        type="TextResponseFunction",
+        description=f"about {function_id}",
+        text_response="hi",
+        **kwargs,
+    )
+
+
+def test_lookup():
+    a, b, c = _function("a"), _function("b"), _function("c", is_fallback=True)
+    duplicate = _function("a")
+    registry = FunctionRegistry([a, b, duplicate, c])
+
+    assert len(registry) == 3
+    assert registry.get("a") is a
+    assert registry.get("missing") is None
+    assert "b" in registry
+    assert list(registry) == [a, b, c]
+    assert registry.get_many(["c", "a", "missing"]) == [a, c]
+    assert registry.fallbacks == [c]
+    assert registry.non_fallbacks == [a, b]
+    assert registry.by_type == {"TextResponseFunction": [a, b, c]}
+
+
+def test_cluster_key():
+    a, b = _function("a"), _function("b")
+    registry = FunctionRegistry([a, b], groups={"a": "library"})
+    assert registry.cluster_key(a) == ("library", "TextResponseFunction")
+    assert registry.cluster_key(b) == ("", "TextResponseFunction")
+
+
+def test_signatures_are_cached():
+    a, b = _function("a"), _function("b")
+    registry = FunctionRegistry([a, b])
+
+    assert registry.signature(a) == a.get_signature()
+    assert registry.signature_tokens(a) > 0
+    assert registry.functions_text([a, b]) == "\n".join(
+        [a.get_signature(), b.get_signature()]
+    )
+    assert registry.functions_text([a, b]) is registry.functions_text([a, b])
+
+    # unchanged functions keep their signatures across reloads
+    changed_b = _function("b", sample_questions=["about b?"])
+    reloaded = FunctionRegistry([a, changed_b], previous=registry)
+    assert reloaded._signatures[id(a)] is registry._signatures[id(a)]
+    assert "about b?" in reloaded.signature(changed_b)
+
+
+class _CountingFunction(TextResponseFunction):
+    signature_calls: int = 0
+
+    def get_signature(self) -> str:
+        self.signature_calls += 1
+        return super().get_signature()
+
+
+@pytest.mark.asyncio
+async def test_selection_and_infilling_build_each_signature_once():
+    functions = [
+        _CountingFunction(
+            id=f"f{i}",
+            type="TextResponseFunction",
+            description=f"about f{i}",
+            text_response="hi",
+        )
+        for i in range(3)
+    ]
+    registry = FunctionRegistry(functions)
+    chat = FakeListChatModel(responses=['{"function_name": "f0"}'])
+
+    result = await select_function(chat, registry, "query", chunk_size=2)
+    assert result.function is functions[0]
+    prompt_context = PromptContext([OpasUserMessage(content="query")], None, registry)
+    await generate_argument_decisions(functions[0], chat, "query", prompt_context)
+
+    assert [f.signature_calls for f in functions] == [1, 1, 1]
+
+
+def test_prompt_context_without_registry_caches_signatures():
+    function = _CountingFunction(
+        id="f", type="TextResponseFunction", description="about f", text_response="hi"
+    )
+    prompt_context = PromptContext([OpasUserMessage(content="query")])
+
+    signature = prompt_context.function_signature(function)
+    assert prompt_context.function_signature(function) is signature
+    assert function.signature_calls == 1
+
+
+def test_seeded_signatures():
+    a = _function("a")
+    registry = FunctionRegistry([a], signatures={"a": "precomputed", "b": "unknown"})
+    assert registry.signature(a) == "precomputed"
+
+
+def _write(directory: Path, function_id: str, description: str) -> None:
+    (directory / f"{function_id}.yaml").write_text(
+        f"type: TextResponseFunction\ndescription: {description}\ntext_response: hi\n"
+    )
+
+
+def test_catalog_round_trip(tmp_path: Path):
+    directory = tmp_path / "library"
+    directory.mkdir()
+    _write(directory, "a", "first")
+    _write(directory, "b", "second")
+
+    library = LocalYAMLLibrary(
+        "library", TextResponseFunction.model_validate, str(tmp_path)
+    )
+    catalog = compile_catalog(library)
+    catalog.save(str(tmp_path / "catalog.bin"))
+    loaded = FunctionCatalog.load(str(tmp_path / "catalog.bin"))
+
+    assert loaded.is_fresh(directory)
+    assert loaded.signatures == catalog.signatures
+    assert loaded.functions["a"].get_description() == "first"
+
+    _write(directory, "a", "changed")
+    assert not loaded.is_fresh(directory)
+
+
+def test_catalog_rejects_other_files(tmp_path: Path):
+    path = tmp_path / "catalog.bin"
+    path.write_bytes(b"something else")
+    with pytest.raises(CatalogError):
+        FunctionCatalog.load(str(path))
+
+
+@pytest.mark.asyncio
+async def test_library_parses_the_changed_files_concurrently(tmp_path: Path):
+    directory = tmp_path / "library"
+    directory.mkdir()
+    for function_id in "abc":
+        _write(directory, function_id, f"about {function_id}")
+
+    library = LocalYAMLLibrary(
+        "library", TextResponseFunction.model_validate, str(tmp_path)
+    )
+    read = library.read
+    reads: List[str] = []
+    running = [0, 0]  # now, most at once
+    lock = threading.Lock()
+
+    def slow_read(function_id: str):
+        with lock:
+            reads.append(function_id)
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return read(function_id)
+
+    library.read = slow_read  # type: ignore[method-assign]
+
+    functions = await library.get_all_functions()
+    assert sorted(f.get_id() for f in functions) == ["a", "b", "c"]
+    assert running[1] > 1
+
+    # only the changed file is parsed again
+    reads.clear()
+    _write(directory, "b", "changed")
+    functions = await library.get_all_functions()
+    assert reads == ["b"]
+    assert {f.get_id(): f.get_description() for f in functions}["b"] == "changed"
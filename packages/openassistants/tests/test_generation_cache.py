@@ -0,0 +1,101 @@
+import pytest
+from langchain.chat_models.fake import FakeListChatModel
+from langchain.schema.messages import HumanMessage
+from openassistants.llm_function_calling import cache as cache_module
+from openassistants.llm_function_calling.cache import (
+    InMemoryGenerationCache,
+    SQLiteGenerationCache,
+    generation_cache_key,
+)
+from openassistants.utils import lru_cache
+from openassistants.utils.lru_cache import LRUCache
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_lru_eviction():
+    cache: LRUCache[str, int] = LRUCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    # b is now the least recently used
+    cache.set("c", 3)
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_lru_ttl(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(lru_cache.time, "monotonic", clock)
+    cache: LRUCache[str, int] = LRUCache(ttl_seconds=10)
+    cache.set("a", 1)
+
+    clock.now += 10
+    assert cache.get("a") == 1
+    clock.now += 1
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_cache_key():
+    messages = [HumanMessage(content="hi")]
+    chat = FakeListChatModel(responses=["{}"])
+    key = generation_cache_key(chat, messages, {"type": "object"}, "task")
+
+    assert key == generation_cache_key(
+        FakeListChatModel(responses=["{}"]), messages, {"type": "object"}, "task"
+    )
+    assert key != generation_cache_key(
+        FakeListChatModel(responses=["[]"]), messages, {"type": "object"}, "task"
+    )
+    assert key != generation_cache_key(chat, messages, None, "task")
+    assert key != generation_cache_key(chat, messages, {"type": "object"}, "other")
+
+
+@pytest.mark.asyncio
+async def test_in_memory_cache_stats():
+    cache = InMemoryGenerationCache()
+    assert await cache.aget("key") is None
+    await cache.aset("key", "{}")
+    assert await cache.aget("key") == "{}"
+    assert cache.stats() == {"hits": 1, "misses": 1}
+
+
+@pytest.mark.asyncio
+async def test_sqlite_cache_deletes_expired_rows(tmp_path, monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(cache_module.time, "time", clock)
+    cache = SQLiteGenerationCache(str(tmp_path / "cache.sqlite"), ttl_seconds=10)
+
+    def keys():
+        rows = cache._connection.execute("SELECT key FROM generations").fetchall()
+        return sorted(key for (key,) in rows)
+
+    await cache.aset("a", "1")
+    clock.now += 5
+    await cache.aset("b", "2")
+    assert await cache.aget("a") == "1"
+
+    # a expires, reading it deletes it
+    clock.now += 6
+    assert await cache.aget("a") is None
+    assert keys() == ["b"]
+
+    # b expires, any write deletes it
+    clock.now += 5
+    await cache.aset("c", "3")
+    assert keys() == ["c"]
+
+    reopened = SQLiteGenerationCache(str(tmp_path / "cache.sqlite"))
+    assert await reopened.aget("c") == "3"
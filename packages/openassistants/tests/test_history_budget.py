@@ -0,0 +1,140 @@
+from typing import List
+
+import pandas as pd
+import pytest
+from langchain.chat_models.fake import FakeListChatModel
+from langchain.embeddings import FakeEmbeddings
+from openassistants.core.assistant import Assistant
+from openassistants.data_models.chat_messages import (
+    OpasAssistantMessage,
+    OpasFunctionMessage,
+    OpasMessage,
+    OpasUserMessage,
+)
+from openassistants.data_models.function_input import FunctionCall
+from openassistants.data_models.function_output import DataFrameOutput, TextOutput
+from openassistants.data_models.serialized_dataframe import SerializedDataFrame
+from openassistants.llm_function_calling.prompt_context import PromptContext
+from openassistants.llm_function_calling.utils import (
+    _budgeted_interaction_dicts,
+    build_chat_history_prompt,
+    previous_interactions,
+)
+from openassistants.utils import tokens
+from openassistants.utils.history_representation import _summarize_df_for_llm
+
+
+@pytest.fixture(autouse=True)
+def approximate_token_counts(monkeypatch):
+    # the budgets below assume the offline approximation of 4 characters a token
+    monkeypatch.setattr(tokens, "_encoding", lambda: None)
+
+
+def _turn(question: str, num_rows: int) -> List[OpasMessage]:
+    dataframe = SerializedDataFrame(
+        columns=["id", "name"], data=[[i, f"name {i % 7}"] for i in range(num_rows)]
+    )
+    return [
+        OpasUserMessage(content=question),
+        OpasAssistantMessage(
+            content="", function_call=FunctionCall(name="lookup", arguments={})
+        ),
+        OpasFunctionMessage(
+            name="lookup",
+            outputs=[
+                DataFrameOutput(dataframe=dataframe),
+                TextOutput(text=f"summary of {question}"),
+            ],
+        ),
+    ]
+
+
+def _history(*num_rows: int) -> List[OpasMessage]:
+    history: List[OpasMessage] = []
+    for index, rows in enumerate(num_rows):
+        history += _turn(f"question {index}", rows)
+    return history + [OpasUserMessage(content="last question")]
+
+
+def test_without_budget_everything_is_rendered():
+    history = _history(100, 100)
+    prompt = build_chat_history_prompt(history)
+    assert "99,name 1" in prompt
+    assert prompt.count("user_prompt") == 3
+    assert prompt.endswith("user_prompt: last question\n---\nEND OF CHAT HISTORY\n")
+
+
+def test_assistant_renders_everything_by_default():
+    chat = FakeListChatModel(responses=["{}"])
+    assistant = Assistant(
+        libraries=[],
+        function_identification=chat,
+        function_infilling=chat,
+        function_summarization=chat,
+        function_fallback=chat,
+        vision_model=chat,
+        entity_embedding_model=FakeEmbeddings(size=4),
+        add_index=False,
+    )
+    history = _history(100, 100)
+    prompt_context = PromptContext(
+        history,
+        assistant.history_token_budget,
+        None,
+        assistant.history_dataframe_max_rows,
+    )
+    assert prompt_context.chat_history_prompt == build_chat_history_prompt(history)
+
+
+def test_newest_interaction_is_kept_verbatim():
+    interactions = previous_interactions(_history(100, 100), token_budget=2000)
+    kept = _budgeted_interaction_dicts(interactions, 2000, dataframe_max_rows=50)
+
+    assert [d["user_prompt"] for d in kept] == ["question 0", "question 1"]
+    # the newest one has all its rows, the older one is summarized
+    assert "99,name 1" in kept[1]["function_output_data"]
+    assert kept[0]["function_output_data"].startswith("100 rows. Columns:")
+
+
+def test_newest_interaction_is_summarized_when_it_does_not_fit():
+    interactions = previous_interactions(_history(1000), token_budget=300)
+    kept = _budgeted_interaction_dicts(interactions, 300, dataframe_max_rows=50)
+    assert kept[0]["function_output_data"].startswith("1000 rows. Columns:")
+    assert "First 5 rows:" in kept[0]["function_output_data"]
+
+
+def test_compacts_and_drops_older_interactions():
+    interactions = previous_interactions(_history(10, 10, 10, 1000), 10**6)
+    kept = _budgeted_interaction_dicts(interactions, 70, dataframe_max_rows=50)
+
+    assert [d["user_prompt"] for d in kept] == ["question 3"]
+    # compacted: schema and statistics, no rows
+    assert "First" not in kept[0]["function_output_data"]
+
+
+def test_dropped_interactions_are_not_rendered():
+    history = _history(10, 10, 10, 1000)
+    interactions = previous_interactions(history, token_budget=70)
+    _budgeted_interaction_dicts(interactions, 70)
+
+    dataframes = [
+        output.dataframe
+        for message in history
+        if isinstance(message, OpasFunctionMessage)
+        for output in message.outputs
+        if isinstance(output, DataFrameOutput)
+    ]
+    # the third one was rendered to find that it doesn't fit, the older ones not
+    assert [dataframe._df is not None for dataframe in dataframes] == [
+        False,
+        False,
+        True,
+        True,
+    ]
+
+
+def test_summarize_unhashable_columns():
+    df = pd.DataFrame({"tags": [["a", "b"], ["c"]], "meta": [{"k": 1}, {"k": 2}]})
+    summary = _summarize_df_for_llm(df, head_rows=1)
+    assert summary.startswith("2 rows. Columns:")
+    assert "- tags (object)" in summary
@@ -0,0 +1,393 @@
+import asyncio
+import json
+from typing import List, Mapping
+
+import pytest
+from langchain.chat_models.fake import FakeListChatModel
+from langchain.embeddings import FakeEmbeddings
+from openassistants.contrib.text_response import TextResponseFunction
+from openassistants.core import assistant as assistant_module
+from openassistants.core.assistant import Assistant
+from openassistants.data_models.chat_messages import OpasUserMessage
+from openassistants.functions.base import (
+    BaseFunctionParameters,
+    Entity,
+    EntityConfig,
+    IEntityConfig,
+)
+from openassistants.functions.registry import FunctionRegistry
+from openassistants.llm_function_calling.infilling import (
+    generate_arguments_and_decisions,
+)
+from openassistants.llm_function_calling.prompt_context import PromptContext
+from openassistants.llm_function_calling.selection import SelectFunctionResult
+
+MESSAGE = OpasUserMessage(content="sales of Jane")
+DECISION = {"needed": True, "can_be_found": True}
+
+
+class _EmployeeFunction(TextResponseFunction):
+    async def get_entity_configs(self) -> Mapping[str, IEntityConfig]:
+        return {"employee": EntityConfig(entities=[Entity(identity="Jane")])}
+
+
+FUNCTION = _EmployeeFunction(
+    id="sales",
+    type="TextResponseFunction",
+    description="sales of an employee",
+    text_response="hi",
+    parameters=BaseFunctionParameters(
+        json_schema={
+            "type": "object",
+            "properties": {"employee": {"type": "string"}},
+            "required": ["employee"],
+        }
+    ),
+)
+
+
+PLAIN_FUNCTION = TextResponseFunction(
+    id="revenue",
+    type="TextResponseFunction",
+    description="revenue in a year",
+    text_response="hi",
+    parameters=BaseFunctionParameters(
+        json_schema={
+            "type": "object",
+            "properties": {"year": {"type": "integer"}},
+            "required": ["year"],
+        }
+    ),
+)
+
+
+def _stub_llm_stages(monkeypatch, arguments: dict, decisions: dict) -> List[str]:
+    """
+    Replaces the infilling LLM calls, returns the log of their starts and ends
+    """
+    events: List[str] = []
+
+    async def generate_arguments(*args, **kwargs):
+        events.append("arguments started")
+        await asyncio.sleep(0.05)
+        events.append("arguments done")
+        return arguments
+
+    async def generate_argument_decisions(*args, **kwargs):
+        events.append("decisions started")
+        await asyncio.sleep(0.05)
+        events.append("decisions done")
+        return decisions
+
+    monkeypatch.setattr(assistant_module, "generate_arguments", generate_arguments)
+    monkeypatch.setattr(
+        assistant_module, "generate_argument_decisions", generate_argument_decisions
+    )
+    return events
+
+
+def _assistant(responses: List[str], **kwargs) -> Assistant:
+    chat = FakeListChatModel(responses=responses)
+    return Assistant(
+        libraries=[],
+        function_identification=chat,
+        function_infilling=chat,
+        function_summarization=chat,
+        function_fallback=chat,
+        vision_model=chat,
+        entity_embedding_model=FakeEmbeddings(size=4),
+        add_index=False,
+        **kwargs,
+    )
+
+
+@pytest.mark.asyncio
+async def test_combined_infilling_passes_on_the_arguments():
+    assistant = _assistant(
+        [json.dumps({"employee": DECISION | {"value": "Jane"}})],
+        combined_infilling=True,
+    )
+    received: List[dict] = []
+
+    complete, arguments = await assistant.infill_arguments(
+        PromptContext([MESSAGE]), MESSAGE, FUNCTION, None, received.append
+    )
+
+    assert complete
+    assert received == [arguments] == [{"employee": "Jane"}]
+
+
+TWO_ARGUMENT_FUNCTION = TextResponseFunction(
+    id="sales_in_year",
+    type="TextResponseFunction",
+    description="sales of an employee in a year",
+    text_response="hi",
+    parameters=BaseFunctionParameters(
+        json_schema={
+            "type": "object",
+            "properties": {
+                "employee": {"type": "string"},
+                "year": {"type": "integer"},
+            },
+            "required": ["employee", "year"],
+        }
+    ),
+)
+
+
+@pytest.mark.asyncio
+async def test_combined_infilling_splits_values_and_decisions():
+    chat = FakeListChatModel(
+        responses=[
+            json.dumps(
+                {
+                    "employee": DECISION | {"value": "Jane"},
+                    "year": {"needed": True, "can_be_found": False},
+                }
+            )
+        ]
+    )
+
+    arguments, decisions = await generate_arguments_and_decisions(
+        TWO_ARGUMENT_FUNCTION, chat, "sales of Jane", [MESSAGE], {}
+    )
+
+    assert arguments == {"employee": "Jane"}
+    assert decisions == {
+        "employee": DECISION,
+        "year": {"needed": True, "can_be_found": False},
+    }
+
+
+@pytest.mark.asyncio
+async def test_combined_infilling_makes_a_single_call(monkeypatch):
+    events = _stub_llm_stages(monkeypatch, {}, {})
+    assistant = _assistant(
+        [
+            json.dumps(
+                {
+                    "employee": DECISION | {"value": "Jane"},
+                    "year": {"needed": True, "can_be_found": False},
+                }
+            )
+        ],
+        combined_infilling=True,
+    )
+
+    complete, arguments = await assistant.do_infilling(
+        PromptContext([MESSAGE]),
+        MESSAGE,
+        TWO_ARGUMENT_FUNCTION,
+        TWO_ARGUMENT_FUNCTION.get_parameters_json_schema(),
+        {},
+    )
+
+    # the separate calls are not made, the year is asked for
+    assert events == []
+    assert not complete
+    assert arguments == {"employee": "Jane"}
+
+
+@pytest.mark.asyncio
+async def test_pipelined_infilling_passes_on_the_preliminary_arguments():
+    assistant = _assistant(
+        [json.dumps({"employee": DECISION})], pipelined_entity_resolution=True
+    )
+    received: List[dict] = []
+
+    complete, arguments = await assistant.infill_arguments(
+        PromptContext([MESSAGE]),
+        MESSAGE,
+        FUNCTION,
+        {"employee": "Jane"},
+        received.append,
+    )
+
+    assert complete
+    assert received == [arguments] == [{"employee": "Jane"}]
+
+
+@pytest.mark.asyncio
+async def test_pipelined_infilling_without_entities_runs_both_calls_at_once(
+    monkeypatch,
+):
+    events = _stub_llm_stages(monkeypatch, {"year": 2023}, {"year": DECISION})
+    assistant = _assistant([], pipelined_entity_resolution=True)
+
+    complete, arguments = await assistant.infill_arguments(
+        PromptContext([MESSAGE]), MESSAGE, PLAIN_FUNCTION, None
+    )
+
+    assert complete and arguments == {"year": 2023}
+    assert set(events[:2]) == {"arguments started", "decisions started"}
+
+
+@pytest.mark.asyncio
+async def test_pipelined_infilling_reuses_resolved_preliminary_arguments(
+    monkeypatch,
+):
+    events = _stub_llm_stages(monkeypatch, {}, {"employee": DECISION})
+    assistant = _assistant([], pipelined_entity_resolution=True)
+
+    complete, arguments = await assistant.infill_arguments(
+        PromptContext([MESSAGE]), MESSAGE, FUNCTION, {"employee": "Jane"}
+    )
+
+    assert complete and arguments == {"employee": "Jane"}
+    assert events == ["decisions started", "decisions done"]
+
+
+@pytest.mark.asyncio
+async def test_pipelined_infilling_infills_alongside_the_decisions(monkeypatch):
+    events = _stub_llm_stages(monkeypatch, {"employee": "Jane"}, {"employee": DECISION})
+    assistant = _assistant([], pipelined_entity_resolution=True)
+
+    # "Jayne" finds Jane, but doesn't name her exactly
+    complete, arguments = await assistant.infill_arguments(
+        PromptContext([MESSAGE]), MESSAGE, FUNCTION, {"employee": "Jayne"}
+    )
+
+    assert complete and arguments == {"employee": "Jane"}
+    assert events.index("arguments started") < events.index("decisions done")
+
+
+class _ReadOnlyFunction(TextResponseFunction):
+    executions: List[dict] = []
+
+    async def execute(self, deps):
+        self.executions.append(deps.arguments)
+        async for version in super().execute(deps):
+            yield version
+
+
+@pytest.mark.asyncio
+async def test_speculative_execution_of_a_candidate_during_selection(monkeypatch):
+    function = _ReadOnlyFunction(
+        id="revenue",
+        type="TextResponseFunction",
+        description="revenue in a year",
+        text_response="hi",
+        side_effect_free=True,
+        parameters=PLAIN_FUNCTION.parameters,
+    )
+    executions = function.executions
+    infilling_done = asyncio.Event()
+
+    async def generate_arguments(*args, **kwargs):
+        return {"year": 2023}
+
+    async def generate_argument_decisions(*args, **kwargs):
+        # the decisions only arrive once the execution has started
+        while not executions:
+            await asyncio.sleep(0.01)
+        infilling_done.set()
+        return {"year": DECISION}
+
+    async def select_function(*args, on_candidates, **kwargs):
+        on_candidates([function])
+        # the final selection call is still running when the infilling ends
+        await asyncio.wait_for(infilling_done.wait(), 1)
+        return SelectFunctionResult(function=function)
+
+    monkeypatch.setattr(assistant_module, "generate_arguments", generate_arguments)
+    monkeypatch.setattr(
+        assistant_module, "generate_argument_decisions", generate_argument_decisions
+    )
+    monkeypatch.setattr(assistant_module, "select_function", select_function)
+
+    assistant = _assistant([], speculative_infilling=True, speculative_execution=True)
+    chat_history = [OpasUserMessage(content="revenue in 2023")]
+    versions = [
+        version
+        async for version in assistant.handle_user_plaintext(
+            chat_history[-1],
+            FunctionRegistry([function]),
+            {"chat_history": chat_history, "summarization_chat_model": None},
+            autorun=True,
+            force_select_function=None,
+        )
+    ]
+
+    assert versions[-1][-1].outputs[0].text == "hi"
+    # the speculative execution is the one whose outputs are shown
+    assert executions == [{"year": 2023}]
+
+
+def _revenue_function(function_id: str) -> TextResponseFunction:
+    return TextResponseFunction(
+        id=function_id,
+        type="TextResponseFunction",
+        description="revenue in a year",
+        text_response=f"{function_id} result",
+        parameters=PLAIN_FUNCTION.parameters,
+    )
+
+
+async def _run_with_candidates(
+    monkeypatch, candidates: List[TextResponseFunction], **kwargs
+) -> List[str]:
+    """
+    Selection offers the candidates, then picks the first one once the
+    infilling of every candidate started. Returns the log of the infilling.
+    """
+    events: List[str] = []
+
+    async def generate_arguments(function, *args, **kwargs):
+        events.append(f"{function.get_id()} started")
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            events.append(f"{function.get_id()} cancelled")
+            raise
+        return {"year": 2023}
+
+    async def generate_argument_decisions(*args, **kwargs):
+        return {"year": DECISION}
+
+    async def select_function(*args, on_candidates, **kwargs):
+        on_candidates(candidates)
+        await asyncio.sleep(0.01)
+        events.append("selected")
+        return SelectFunctionResult(function=candidates[0])
+
+    monkeypatch.setattr(assistant_module, "generate_arguments", generate_arguments)
+    monkeypatch.setattr(
+        assistant_module, "generate_argument_decisions", generate_argument_decisions
+    )
+    monkeypatch.setattr(assistant_module, "select_function", select_function)
+
+    assistant = _assistant([], speculative_infilling=True, **kwargs)
+    chat_history = [OpasUserMessage(content="revenue in 2023")]
+    versions = [
+        version
+        async for version in assistant.handle_user_plaintext(
+            chat_history[-1],
+            FunctionRegistry(candidates),
+            {"chat_history": chat_history, "summarization_chat_model": None},
+            autorun=True,
+            force_select_function=None,
+        )
+    ]
+    assert versions[-1][-1].outputs[0].text == f"{candidates[0].get_id()} result"
+    return events
+
+
+@pytest.mark.asyncio
+async def test_speculative_infilling_keeps_the_selected_candidate(monkeypatch):
+    events = await _run_with_candidates(
+        monkeypatch, [_revenue_function("a"), _revenue_function("b")]
+    )
+
+    # a is infilled once, during selection, and b is discarded
+    assert events == ["a started", "b started", "selected", "b cancelled"]
+
+
+@pytest.mark.asyncio
+async def test_no_speculative_infilling_for_too_many_candidates(monkeypatch):
+    events = await _run_with_candidates(
+        monkeypatch,
+        [_revenue_function("a"), _revenue_function("b")],
+        speculative_infilling_max_candidates=1,
+    )
+
+    assert events == ["selected", "a started"]
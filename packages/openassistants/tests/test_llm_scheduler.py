@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+from langchain.chat_models.fake import FakeListChatModel
+from langchain.schema.messages import HumanMessage
+from openassistants.llm_function_calling import utils
+from openassistants.utils.llm_scheduler import (
+    LLMPriority,
+    LLMScheduler,
+    ModelLimits,
+    _current_scheduler,
+    astream_in_slot,
+    llm_slot,
+    use_llm_scheduler,
+)
+
+
+def _chat() -> FakeListChatModel:
+    return FakeListChatModel(responses=["hello"])
+
+
+@pytest.mark.asyncio
+async def test_priority_order():
+    scheduler = LLMScheduler(default_limits=ModelLimits(max_concurrency=1))
+    chat = _chat()
+    order = []
+
+    async def call(name: str, priority: LLMPriority):
+        async with llm_slot(chat, priority=priority):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    with use_llm_scheduler(scheduler):
+        first = asyncio.create_task(call("first", LLMPriority.EVAL))
+        await asyncio.sleep(0)
+        await asyncio.gather(
+            call("eval", LLMPriority.EVAL),
+            call("summarization", LLMPriority.SUMMARIZATION),
+            call("interactive", LLMPriority.INTERACTIVE),
+        )
+        await first
+
+    assert order == ["first", "interactive", "summarization", "eval"]
+    metrics = scheduler.metrics()[chat._llm_type]
+    assert metrics.requests == 4
+    assert metrics.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_gives_up_its_place():
+    scheduler = LLMScheduler(default_limits=ModelLimits(max_concurrency=1))
+    chat = _chat()
+
+    with use_llm_scheduler(scheduler):
+        async with llm_slot(chat):
+            waiter = asyncio.create_task(llm_slot(chat).__aenter__())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+
+        async with llm_slot(chat):
+            pass
+
+    assert scheduler.metrics()[chat._llm_type].in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_releases_the_slot_before_the_consumer_finishes():
+    scheduler = LLMScheduler(default_limits=ModelLimits(max_concurrency=1))
+    chat = _chat()
+
+    with use_llm_scheduler(scheduler):
+        chunks = astream_in_slot(chat, [], prompt_tokens=1)
+        first = await chunks.__anext__()
+        assert first.content == "h"
+        # the consumer is slow, the provider stream is done in the background
+        await asyncio.sleep(0.01)
+        assert scheduler.metrics()[chat._llm_type].in_flight == 0
+        rest = [chunk.content async for chunk in chunks]
+
+    assert "".join([first.content, *rest]) == "hello"
+
+
+@pytest.mark.asyncio
+async def test_abandoned_stream_finalized_in_another_context():
+    scheduler = LLMScheduler()
+
+    async def stream():
+        with use_llm_scheduler(scheduler):
+            yield 1
+            yield 2
+
+    async def consume_one(generator):
+        await generator.__anext__()
+
+    # started in the context of a task, closed in this one
+    generator = stream()
+    await asyncio.create_task(consume_one(generator))
+    await generator.aclose()
+
+    assert _current_scheduler.get() is None
+
+
+@pytest.mark.asyncio
+async def test_tokens_are_counted_only_when_scheduled(monkeypatch):
+    counted = []
+    monkeypatch.setattr(utils, "count_tokens", lambda text: counted.append(text) or 1)
+    monkeypatch.setattr(
+        utils, "count_message_tokens", lambda messages: counted.append(messages) or 1
+    )
+    chat = FakeListChatModel(responses=['{"a": 1}'])
+    messages = [HumanMessage(content="hi")]
+
+    assert await utils.generate_to_json(chat, messages, None, "task") == {"a": 1}
+    assert counted == []
+
+    scheduler = LLMScheduler()
+    with use_llm_scheduler(scheduler):
+        assert await utils.generate_to_json(chat, messages, None, "task") == {"a": 1}
+    # prompt messages, output schema and completion
+    assert len(counted) == 3
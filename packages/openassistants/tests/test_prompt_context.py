@@ -0,0 +1,87 @@
+import json
+
+import pytest
+from langchain.chat_models.fake import FakeListChatModel
+from openassistants.contrib.text_response import TextResponseFunction
+from openassistants.data_models.chat_messages import OpasUserMessage
+from openassistants.functions.base import BaseFunctionParameters
+from openassistants.llm_function_calling import prompt_context as prompt_context_module
+from openassistants.llm_function_calling.fallback import perform_general_qa
+from openassistants.llm_function_calling.infilling import (
+    generate_argument_decisions,
+    generate_arguments,
+)
+from openassistants.llm_function_calling.prompt_context import PromptContext
+
+MESSAGES = [OpasUserMessage(content="revenue in 2023")]
+
+FUNCTION = TextResponseFunction(
+    id="revenue",
+    type="TextResponseFunction",
+    description="revenue in a year",
+    text_response="hi",
+    parameters=BaseFunctionParameters(
+        json_schema={
+            "type": "object",
+            "properties": {"year": {"type": "integer"}},
+            "required": ["year"],
+        }
+    ),
+)
+
+
+def test_of():
+    prompt_context = PromptContext(MESSAGES)
+    assert PromptContext.of(prompt_context) is prompt_context
+    assert PromptContext.of(MESSAGES).chat_history is MESSAGES
+
+
+@pytest.mark.asyncio
+async def test_the_stages_share_the_rendered_history(monkeypatch):
+    renders = []
+    build = prompt_context_module.build_chat_history_prompt
+
+    def build_chat_history_prompt(*args, **kwargs):
+        renders.append(args)
+        return build(*args, **kwargs)
+
+    monkeypatch.setattr(
+        prompt_context_module, "build_chat_history_prompt", build_chat_history_prompt
+    )
+    chat = FakeListChatModel(
+        responses=[
+            json.dumps({"year": 2023}),
+            json.dumps({"year": {"needed": True, "can_be_found": True}}),
+        ]
+    )
+    prompt_context = PromptContext(MESSAGES)
+
+    await generate_arguments(FUNCTION, chat, "revenue in 2023", prompt_context, {})
+    await generate_argument_decisions(FUNCTION, chat, "revenue", prompt_context)
+
+    assert len(renders) == 1
+
+
+@pytest.mark.asyncio
+async def test_the_chat_history_keyword_still_works():
+    chat = FakeListChatModel(responses=[json.dumps({"year": 2023}), "hello"])
+
+    arguments = await generate_arguments(
+        FUNCTION,
+        chat,
+        user_query="revenue in 2023",
+        chat_history=MESSAGES,
+        entities_info={},
+    )
+    answers = [
+        answer
+        async for answer in perform_general_qa(
+            chat,
+            user_query="hi",
+            chat_history=MESSAGES,
+            scope_description="anything",
+        )
+    ]
+
+    assert arguments == {"year": 2023}
+    assert answers[-1] == "hello"
@@ -0,0 +1,168 @@
+import json
+from typing import Any, List, Optional
+
+import pytest
+from langchain.chat_models.fake import FakeListChatModel
+from langchain.embeddings import FakeEmbeddings
+from openassistants.contrib.text_response import TextResponseFunction
+from openassistants.core.assistant import Assistant
+from openassistants.data_models.chat_messages import OpasUserMessage
+from openassistants.functions.base import BaseFunctionParameters
+from openassistants.functions.crud import PythonLibrary
+from openassistants.llm_function_calling.infilling import (
+    generate_argument_decisions,
+    generate_arguments,
+)
+from openassistants.llm_function_calling.prompt_context import PromptContext
+from openassistants.llm_function_calling.sample_questions import (
+    SampleQuestionMatcher,
+    normalize_question,
+)
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "employee": {"type": "string"},
+        "year": {"type": "integer"},
+    },
+    "required": ["employee", "year"],
+}
+
+
+def _function(
+    function_id: str, sample_questions: List[str], schema: Optional[dict] = SCHEMA
+):
+    return TextResponseFunction(
+        id=function_id,
+        type="TextResponseFunction",
+        description="a function",
+        text_response="hi",
+        sample_questions=sample_questions,
+        parameters=BaseFunctionParameters(json_schema=schema)
+        if schema is not None
+        else BaseFunctionParameters(),
+    )
+
+
+class _RecordingChatModel(FakeListChatModel):
+    prompts: List[str] = []
+
+    def _call(self, messages, *args: Any, **kwargs: Any) -> str:
+        self.prompts.append(messages[-1].content)
+        return super()._call(messages, *args, **kwargs)
+
+
+def test_normalize_question():
+    assert normalize_question("  What’s   the  revenue?! ") == "What's the revenue"
+
+
+def test_exact_match():
+    revenue = _function("revenue", ["What is the revenue?"], schema=None)
+    matcher = SampleQuestionMatcher([revenue])
+
+    match = matcher.match("what is  the revenue")
+    assert match is not None
+    assert match.function is revenue
+    assert match.arguments == {}
+    assert matcher.match("what is the profit?") is None
+
+
+def test_placeholders_seed_the_arguments():
+    sales = _function("sales", ["Sales of {employee} in {year}?"])
+    matcher = SampleQuestionMatcher([sales])
+
+    match = matcher.match("sales of 'Jane Doe' in 2023")
+    assert match is not None
+    assert match.function is sales
+    assert match.arguments == {"employee": "Jane Doe", "year": 2023}
+
+    # values that don't fit the schema are left to infilling
+    match = matcher.match("sales of Jane in last year")
+    assert match is not None
+    assert match.arguments == {"employee": "Jane"}
+
+
+def test_ambiguous_queries_are_not_matched():
+    matcher = SampleQuestionMatcher(
+        [
+            _function("sales", ["Sales of {employee} in {year}"]),
+            _function("visits", ["{employee} in {year}"]),
+            _function("anything", ["{employee}"]),
+        ]
+    )
+    assert matcher.match("sales of Jane in 2023") is None
+    # a question made only of placeholders never matches
+    assert matcher.match("Jane") is None
+
+
+@pytest.mark.asyncio
+async def test_infilling_keeps_the_known_arguments():
+    sales = _function("sales", [])
+    chat = _RecordingChatModel(
+        responses=[
+            json.dumps({"year": 2023}),
+            json.dumps({"year": {"needed": True, "can_be_found": True}}),
+        ]
+    )
+    prompt_context = PromptContext([OpasUserMessage(content="query")])
+
+    arguments = await generate_arguments(
+        sales, chat, "query", prompt_context, {}, known_arguments={"employee": "Jane"}
+    )
+    decisions = await generate_argument_decisions(
+        sales, chat, "query", prompt_context, known_arguments={"employee": "Jane"}
+    )
+
+    assert arguments == {"employee": "Jane", "year": 2023}
+    assert decisions == {
+        "employee": {"needed": True, "can_be_found": True},
+        "year": {"needed": True, "can_be_found": True},
+    }
+    assert all('already known: {"employee": "Jane"}' in p for p in chat.prompts)
+
+
+@pytest.mark.asyncio
+async def test_infilling_skips_the_llm_when_every_argument_is_known():
+    sales = _function("sales", [])
+    chat = _RecordingChatModel(responses=["{}"])
+    known = {"employee": "Jane", "year": 2023}
+
+    arguments = await generate_arguments(
+        sales,
+        chat,
+        "query",
+        PromptContext([OpasUserMessage(content="query")]),
+        {},
+        known_arguments=known,
+    )
+
+    assert arguments == known
+    assert chat.prompts == []
+
+
+@pytest.mark.asyncio
+async def test_assistant_matches_sample_questions_only_when_enabled():
+    library = PythonLibrary(
+        functions=[_function("sales", ["sales of {employee} in {year}"])]
+    )
+
+    async def matcher(**kwargs) -> Optional[SampleQuestionMatcher]:
+        chat = FakeListChatModel(responses=["{}"])
+        assistant = Assistant(
+            libraries=[library],
+            function_identification=chat,
+            function_infilling=chat,
+            function_summarization=chat,
+            function_fallback=chat,
+            vision_model=chat,
+            entity_embedding_model=FakeEmbeddings(size=4),
+            add_index=False,
+            **kwargs,
+        )
+        await assistant.get_registry()
+        return assistant._sample_question_matcher
+
+    assert await matcher() is None
+    enabled = await matcher(sample_question_matching=True)
+    assert enabled is not None
+    assert enabled.match("sales of Jane in 2023") is not None
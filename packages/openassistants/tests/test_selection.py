@@ -0,0 +1,189 @@
+import asyncio
+from typing import List
+
+import pytest
+from langchain.chat_models.fake import FakeListChatModel
+from openassistants.contrib.text_response import TextResponseFunction
+from openassistants.functions.base import IFunction
+from openassistants.functions.registry import FunctionRegistry
+from openassistants.llm_function_calling import selection
+from openassistants.llm_function_calling.utils import chunk_list_by_token_budget
+from openassistants.utils.stage_policy import (
+    StagePolicy,
+    StageRunner,
+    use_stage_runner,
+)
+
+
+def test_chunks_are_packed_first_fit_decreasing():
+    chunks = chunk_list_by_token_budget(
+        ["a", "b", "c", "d", "e"], [6, 3, 5, 4, 2], token_budget=10
+    )
+    # a + d, c + b + e, each chunk in the original order
+    assert chunks == [["a", "d"], ["b", "c", "e"]]
+
+
+def test_oversized_items_get_a_chunk_of_their_own():
+    assert chunk_list_by_token_budget(["a", "b", "c"], [15, 3, 4], 10) == [
+        ["a"],
+        ["b", "c"],
+    ]
+    assert chunk_list_by_token_budget([], [], 10) == []
+
+
+def test_chunks_keep_order():
+    chunks = chunk_list_by_token_budget(
+        ["a", "b", "c", "d", "e"], [6, 3, 5, 4, 2], 10, keep_order=True
+    )
+    assert chunks == [["a", "b"], ["c", "d"], ["e"]]
+
+
+def _function(function_id: str) -> TextResponseFunction:
+    return TextResponseFunction(
+        id=function_id,
+        type="TextResponseFunction",
+        description="a function",
+        text_response="hi",
+    )
+
+
+def _record_prefiltering(monkeypatch) -> List[List[str]]:
+    subsets: List[List[str]] = []
+
+    async def filter_functions(chat, functions: List[IFunction], *args) -> None:
+        subsets.append([f.get_id() for f in functions])
+        return None
+
+    monkeypatch.setattr(selection, "filter_functions", filter_functions)
+    return subsets
+
+
+@pytest.mark.asyncio
+async def test_chunks_of_chunk_size_functions_by_default(monkeypatch):
+    subsets = _record_prefiltering(monkeypatch)
+
+    functions = [_function(f"f{i}") for i in range(6)]
+    result = await selection.select_function(
+        FakeListChatModel(responses=["{}"]), functions, "query", chunk_size=2
+    )
+
+    assert result.function is None
+    assert sorted(subsets) == [["f0", "f1"], ["f2", "f3"], ["f4", "f5"]]
+
+
+@pytest.mark.asyncio
+async def test_chunks_by_token_budget(monkeypatch):
+    subsets = _record_prefiltering(monkeypatch)
+
+    functions = [_function(f"f{i}") for i in range(6)]
+    registry = FunctionRegistry(functions)
+    await selection.select_function(
+        FakeListChatModel(responses=["{}"]),
+        registry,
+        "query",
+        chunk_token_budget=3 * registry.signature_tokens(functions[0]),
+    )
+
+    assert sorted(subsets) == [["f0", "f1", "f2"], ["f3", "f4", "f5"]]
+
+
+async def _prefilter_with_deadline(monkeypatch, slow: List[str]) -> List[str]:
+    """
+    Prefilters f0 to f3 in chunks of two, the chunks holding a slow function
+    miss the stage deadline
+    """
+
+    async def filter_functions(chat, functions: List[IFunction], *args) -> str:
+        if any(f.get_id() in slow for f in functions):
+            await asyncio.sleep(1)
+        return functions[0].get_id()
+
+    monkeypatch.setattr(selection, "filter_functions", filter_functions)
+
+    functions = [_function(f"f{i}") for i in range(4)]
+    registry = FunctionRegistry(functions)
+    subsets = [functions[:2], functions[2:]]
+    runner = StageRunner(
+        {"filter_functions": StagePolicy(stage_deadline_ms=20, partial_results=True)}
+    )
+    with use_stage_runner(runner):
+        return await selection._prefilter(
+            FakeListChatModel(responses=["{}"]),
+            registry,
+            subsets,
+            "query",
+            asyncio.Semaphore(4),
+            None,
+        )
+
+
+@pytest.mark.asyncio
+async def test_partial_results_keep_the_chunks_within_the_deadline(monkeypatch):
+    assert await _prefilter_with_deadline(monkeypatch, slow=["f3"]) == ["f0"]
+
+
+@pytest.mark.asyncio
+async def test_every_chunk_missing_the_deadline_times_out(monkeypatch):
+    with pytest.raises(asyncio.TimeoutError):
+        await _prefilter_with_deadline(monkeypatch, slow=["f0", "f3"])
+
+
+@pytest.mark.asyncio
+async def test_hierarchical_selection(monkeypatch):
+    chunks: List[List[str]] = []
+
+    async def filter_functions(chat, functions: List[IFunction], *args) -> str:
+        chunks.append(sorted(f.get_id() for f in functions))
+        # the first function of every chunk wins
+        return functions[0].get_id()
+
+    monkeypatch.setattr(selection, "filter_functions", filter_functions)
+
+    functions = [_function(f"f{i}") for i in range(8)]
+    registry = FunctionRegistry(functions)
+    candidates: List[IFunction] = []
+
+    result = await selection.select_function(
+        FakeListChatModel(responses=['{"function_name": "f4"}']),
+        registry,
+        "query",
+        chunk_token_budget=2 * registry.signature_tokens(functions[0]),
+        hierarchical=True,
+        on_candidates=candidates.extend,
+    )
+
+    # the rounds run one after the other, the winners compete again
+    assert sorted(chunks[:4]) == [
+        ["f0", "f1"],
+        ["f2", "f3"],
+        ["f4", "f5"],
+        ["f6", "f7"],
+    ]
+    assert sorted(chunks[4:]) == [["f0", "f2"], ["f4", "f6"]]
+    # the last two winners fit in one chunk and go to the final selection
+    assert [f.get_id() for f in candidates] == ["f0", "f4"]
+    assert result.function is functions[4]
+
+
+@pytest.mark.asyncio
+async def test_hierarchical_selection_by_chunk_size(monkeypatch):
+    chunks: List[List[str]] = []
+
+    async def filter_functions(chat, functions: List[IFunction], *args) -> str:
+        chunks.append(sorted(f.get_id() for f in functions))
+        return functions[0].get_id()
+
+    monkeypatch.setattr(selection, "filter_functions", filter_functions)
+
+    functions = [_function(f"f{i}") for i in range(8)]
+    result = await selection.select_function(
+        FakeListChatModel(responses=['{"function_name": "f0"}']),
+        functions,
+        "query",
+        chunk_size=2,
+        hierarchical=True,
+    )
+
+    assert len(chunks) == 6
+    assert sorted(chunks[4:]) == [["f0", "f2"], ["f4", "f6"]]
+    assert result.function is functions[0]
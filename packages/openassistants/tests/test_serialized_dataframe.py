@@ -0,0 +1,97 @@
+import pandas as pd
+from openassistants.data_models.function_output import DataFrameOutput
+from openassistants.data_models.serialized_dataframe import SerializedDataFrame
+
+
+def _df() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "id": [1, 2, 3],
+            "score": [0.5, None, 1.5],
+            "name": ["a", "b", "c"],
+            "day": pd.to_datetime(["2023-01-01", "2023-01-02", "2023-01-03"]),
+        }
+    )
+
+
+def test_from_pd_renders_rows_lazily():
+    serialized = SerializedDataFrame.from_pd(_df())
+    assert serialized.data is None
+    assert serialized.to_rows() == [
+        [1, 0.5, "a", "2023-01-01T00:00:00.000"],
+        [2, None, "b", "2023-01-02T00:00:00.000"],
+        [3, 1.5, "c", "2023-01-03T00:00:00.000"],
+    ]
+    # rendered once
+    assert serialized.to_rows() is serialized.to_rows()
+
+
+def test_json_round_trip():
+    serialized = SerializedDataFrame.from_pd(_df())
+    parsed = SerializedDataFrame.model_validate_json(serialized.model_dump_json())
+
+    assert parsed.columns == ["id", "score", "name", "day"]
+    assert parsed.dtypes == serialized.dtypes
+    assert parsed == serialized
+
+    df = parsed.to_pd()
+    assert df["id"].dtype == "int64"
+    assert df["score"].isna().tolist() == [False, True, False]
+    assert str(df["day"].dtype).startswith("datetime64")
+
+
+def test_round_trip_inside_an_output():
+    output = DataFrameOutput(dataframe=SerializedDataFrame.from_pd(_df()))
+    parsed = DataFrameOutput.model_validate(output.model_dump(mode="json"))
+    assert parsed == output
+    assert parsed.model_dump(mode="json") == output.model_dump(mode="json")
+
+
+def test_without_dtypes():
+    # the format before dtypes were added
+    parsed = SerializedDataFrame.model_validate(
+        {"columns": ["a", "b"], "data": [[1, "x"], [2, "y"]]}
+    )
+    assert parsed.to_pd().to_dict("list") == {"a": [1, 2], "b": ["x", "y"]}
+    assert parsed.model_dump() == {
+        "columns": ["a", "b"],
+        "dtypes": None,
+        "data": [[1, "x"], [2, "y"]],
+    }
+
+
+def test_inequality():
+    serialized = SerializedDataFrame.from_pd(_df())
+    other = SerializedDataFrame.from_pd(_df().head(2))
+    assert serialized != other
+    assert serialized != "not a dataframe"
+
+
+def test_round_trip_mixed_dtypes_and_int_labels():
+    df = pd.DataFrame(
+        {
+            0: [1, 2],
+            1: [float("nan"), 2.5],
+            "at": pd.to_datetime(["2023-01-01 10:00", "2023-06-01 00:00"]),
+            "flag": [True, False],
+        }
+    )
+    serialized = SerializedDataFrame.from_pd(df)
+    parsed = SerializedDataFrame.model_validate_json(serialized.model_dump_json())
+
+    for frame in (serialized.to_pd(), parsed.to_pd()):
+        assert frame.columns.tolist() == ["0", "1", "at", "flag"]
+        assert frame["0"].tolist() == [1, 2]
+        assert frame["1"].isna().tolist() == [True, False]
+        assert frame["at"].tolist() == df["at"].tolist()
+        assert frame["flag"].dtype == "bool"
+    assert parsed == serialized
+    # the caller's frame keeps its labels
+    assert df.columns.tolist() == [0, 1, "at", "flag"]
+
+
+def test_later_changes_to_the_source_frame_are_not_seen():
+    df = _df()
+    serialized = SerializedDataFrame.from_pd(df)
+    df.loc[0, "id"] = 100
+    assert serialized.to_pd()["id"].tolist() == [1, 2, 3]
@@ -0,0 +1,98 @@
+from typing import List
+
+import pytest
+from langchain.chat_models.fake import FakeListChatModel
+from langchain.embeddings.base import Embeddings
+from openassistants.contrib.text_response import TextResponseFunction
+from openassistants.functions.base import IFunction
+from openassistants.llm_function_calling import selection
+from openassistants.llm_function_calling.shortlist import (
+    FunctionShortlist,
+    function_to_text,
+)
+
+TOPICS = ["sales", "weather", "employees", "invoices"]
+
+
+class _TopicEmbeddings(Embeddings):
+    """
+    How often each topic is mentioned
+    """
+
+    def __init__(self):
+        self.embedded: List[str] = []
+
+    def _embed(self, text: str) -> List[float]:
+        return [text.count(topic) for topic in TOPICS] + [0.01]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.embedded.extend(texts)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+FUNCTIONS = [
+    TextResponseFunction(
+        id=f"{topic}_report",
+        type="TextResponseFunction",
+        description=f"a report of {topic}",
+        text_response="hi",
+    )
+    for topic in TOPICS
+]
+
+
+@pytest.mark.asyncio
+async def test_top_k_most_similar_best_first():
+    embeddings = _TopicEmbeddings()
+    shortlist = FunctionShortlist(embeddings, top_k=2)
+
+    ranked = await shortlist.shortlist(FUNCTIONS, "sales and some weather, sales")
+    assert [f.get_id() for f in ranked] == ["sales_report", "weather_report"]
+
+    # the functions are only embedded once
+    await shortlist.shortlist(FUNCTIONS, "employees")
+    assert len(embeddings.embedded) == len(FUNCTIONS)
+
+
+@pytest.mark.asyncio
+async def test_small_function_sets_are_not_ranked():
+    embeddings = _TopicEmbeddings()
+    shortlist = FunctionShortlist(embeddings, top_k=8)
+
+    assert await shortlist.shortlist(FUNCTIONS, "sales") == FUNCTIONS
+    assert embeddings.embedded == []
+
+
+@pytest.mark.asyncio
+async def test_precomputed_embeddings_are_used():
+    embeddings = _TopicEmbeddings()
+    shortlist = FunctionShortlist(embeddings, top_k=1)
+    shortlist.add_precomputed(
+        {function_to_text(f): embeddings._embed(function_to_text(f)) for f in FUNCTIONS}
+    )
+
+    ranked = await shortlist.shortlist(FUNCTIONS, "invoices")
+    assert [f.get_id() for f in ranked] == ["invoices_report"]
+    assert embeddings.embedded == []
+
+
+@pytest.mark.asyncio
+async def test_selection_only_prefilters_the_shortlist(monkeypatch):
+    prefiltered: List[str] = []
+
+    async def filter_functions(chat, functions: List[IFunction], *args) -> None:
+        prefiltered.extend(f.get_id() for f in functions)
+        return None
+
+    monkeypatch.setattr(selection, "filter_functions", filter_functions)
+
+    await selection.select_function(
+        FakeListChatModel(responses=["{}"]),
+        FUNCTIONS,
+        "weather and employees",
+        shortlist=FunctionShortlist(_TopicEmbeddings(), top_k=2),
+    )
+    assert sorted(prefiltered) == ["employees_report", "weather_report"]
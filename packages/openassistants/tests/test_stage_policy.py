@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+from langchain.chat_models.fake import FakeListChatModel
+from langchain.schema.messages import HumanMessage
+from openassistants.llm_function_calling.utils import generate_to_json
+from openassistants.utils.llm_scheduler import (
+    LLMScheduler,
+    ModelLimits,
+    llm_slot,
+    use_llm_scheduler,
+)
+from openassistants.utils.stage_policy import (
+    LatencyTracker,
+    StagePolicy,
+    StageRunner,
+    run_stage,
+    use_stage_runner,
+)
+
+
+def test_latency_quantile():
+    latencies = LatencyTracker(window=10)
+    assert latencies.quantile("stage", 0.5) is None
+    for seconds in range(20):
+        latencies.record("stage", seconds)
+    # only the last 10 are kept
+    assert latencies.quantile("stage", 0.0) == 10
+    assert latencies.quantile("stage", 0.95) == 19
+    assert latencies.quantile("stage", 0.5, min_samples=11) is None
+
+
+@pytest.mark.asyncio
+async def test_deadline():
+    runner = StageRunner({"stage": StagePolicy(deadline_ms=10)})
+
+    async def slow():
+        await asyncio.sleep(1)
+
+    with use_stage_runner(runner):
+        with pytest.raises(asyncio.TimeoutError):
+            await run_stage("stage", slow)
+
+
+@pytest.mark.asyncio
+async def test_hedge_a_straggler():
+    runner = StageRunner({"stage": StagePolicy(hedge=True, hedge_min_samples=3)})
+    for _ in range(3):
+        runner.latencies.record("stage", 0.01)
+
+    calls = []
+    hedges = []
+
+    async def call():
+        calls.append(len(calls))
+        # the first call is a straggler
+        await asyncio.sleep(1 if len(calls) == 1 else 0.01)
+        return len(calls)
+
+    with use_stage_runner(runner):
+        result = await run_stage("stage", call, lambda: hedges.append(True))
+
+    assert result == 2
+    assert len(calls) == 2
+    assert hedges == [True]
+
+
+@pytest.mark.asyncio
+async def test_queue_time_does_not_count_toward_the_deadline():
+    chat = FakeListChatModel(responses=['{"answer": 1}'])
+    scheduler = LLMScheduler(default_limits=ModelLimits(max_concurrency=1))
+    runner = StageRunner({"task": StagePolicy(deadline_ms=100)})
+
+    async def hold_the_slot():
+        async with llm_slot(chat):
+            await asyncio.sleep(0.3)
+
+    with use_llm_scheduler(scheduler), use_stage_runner(runner):
+        holder = asyncio.create_task(hold_the_slot())
+        await asyncio.sleep(0)
+        result = await generate_to_json(
+            chat, [HumanMessage(content="question")], None, "task"
+        )
+        await holder
+
+    assert result == {"answer": 1}
+    assert runner.latencies.quantile("task", 0.5) < 0.1
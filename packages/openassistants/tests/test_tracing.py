@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+from openassistants.utils.tracing import (
+    TraceCollector,
+    current_span,
+    set_trace_attribute,
+    span,
+    trace,
+)
+
+
+def test_trace_state_is_reset():
+    collector = TraceCollector()
+    with trace("outer", [collector]) as root:
+        with span("child") as child:
+            assert current_span() is child
+            set_trace_attribute("function_id", "f")
+        assert current_span() is root
+
+    assert current_span() is None
+    # outside of a trace, nothing is recorded
+    set_trace_attribute("function_id", "other")
+    assert collector.last is root
+    assert root.attributes == {"function_id": "f"}
+    assert [c.name for c in root.children] == ["child"]
+
+
+@pytest.mark.asyncio
+async def test_traced_generator_resumed_in_another_context():
+    collector = TraceCollector()
+
+    async def traced():
+        with trace("run", [collector]):
+            with span("step"):
+                yield 1
+            yield 2
+
+    generator = traced()
+    # e.g. a server pulling every version from a new task, the tokens set in
+    # one context are not valid in the next
+    assert await asyncio.create_task(generator.__anext__()) == 1
+    assert await asyncio.create_task(generator.__anext__()) == 2
+    await asyncio.create_task(generator.aclose())
+
+    assert collector.last is not None
+    assert [c.name for c in collector.last.children] == ["step"]
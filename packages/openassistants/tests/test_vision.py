@@ -0,0 +1,121 @@
+from typing import Any, List
+
+import pytest
+from langchain.chat_models.fake import FakeListChatModel
+from langchain.embeddings import FakeEmbeddings
+from openassistants.core.assistant import Assistant
+from openassistants.data_models.chat_messages import OpasUserMessage
+from openassistants.utils.lru_cache import LRUCache
+from openassistants.utils.vision import aimage_url_to_text
+
+IMAGE = "data:image/png;base64,aW1hZ2U="
+
+
+class _VisionModel(FakeListChatModel):
+    calls: int = 0
+
+    def _call(self, messages, *args: Any, **kwargs: Any) -> str:
+        self.calls += 1
+        return super()._call(messages, *args, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_descriptions_are_cached_by_image_and_context():
+    vision = _VisionModel(responses=["a cat", "a cat on a sofa"])
+    cache: LRUCache[str, str] = LRUCache(8)
+
+    assert await aimage_url_to_text(vision, IMAGE, "what is it?", cache) == "a cat"
+    assert await aimage_url_to_text(vision, IMAGE, "what is it?", cache) == "a cat"
+    assert vision.calls == 1
+
+    described = await aimage_url_to_text(vision, IMAGE, "where is it?", cache)
+    assert described == "a cat on a sofa"
+    assert vision.calls == 2
+
+
+def _image_message(question: str) -> OpasUserMessage:
+    return OpasUserMessage(
+        content=[
+            {"type": "text", "text": question},
+            {"type": "image_url", "image_url": IMAGE, "filename": "cat.png"},
+        ]
+    )
+
+
+def _assistant(vision: _VisionModel) -> Assistant:
+    chat = FakeListChatModel(responses=["{}"])
+    return Assistant(
+        libraries=[],
+        function_identification=chat,
+        function_infilling=chat,
+        function_summarization=chat,
+        function_fallback=chat,
+        vision_model=vision,
+        entity_embedding_model=FakeEmbeddings(size=4),
+        add_index=False,
+    )
+
+
+@pytest.mark.asyncio
+async def test_history_reuses_the_description_of_a_sent_image():
+    vision = _VisionModel(responses=["a cat"])
+    assistant = _assistant(vision)
+
+    [sent] = await assistant.pre_process_messages([_image_message("what is it?")])
+    assert sent.content == "what is it? a cat"
+
+    # the same message in the history of the next turn, as a client resends it,
+    # with only the description cache to go by
+    assistant._flattened_messages = LRUCache(8)
+    messages: List[OpasUserMessage] = await assistant.pre_process_messages(
+        [_image_message("what is it?"), OpasUserMessage(content="and now?")]
+    )
+    assert messages[0].content == "what is it? a cat"
+    assert vision.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_older_images_are_not_described():
+    vision = _VisionModel(responses=["a cat"])
+    assistant = _assistant(vision)
+
+    messages = await assistant.pre_process_messages(
+        [_image_message("what is it?"), OpasUserMessage(content="and now?")]
+    )
+    assert messages[0].content == "what is it? Image described as cat.png"
+    assert vision.calls == 0
+
+
+@pytest.mark.asyncio
+async def test_flattened_history_messages_are_memoized(monkeypatch):
+    assistant = _assistant(_VisionModel(responses=["a cat"]))
+    converted: List[Any] = []
+    convert = assistant.convert_list_message
+
+    async def convert_list_message(messages, message, idx):
+        converted.append(list(message.content))
+        await convert(messages, message, idx)
+
+    monkeypatch.setattr(assistant, "convert_list_message", convert_list_message)
+
+    await assistant.pre_process_messages([_image_message("what is it?")])
+    history = await assistant.pre_process_messages(
+        [
+            _image_message("what is it?"),
+            OpasUserMessage(content="and now?"),
+            _image_message("and this one?"),
+        ]
+    )
+
+    # only the new message is converted again, the last one never comes from
+    # the memo because its images are described with the vision model
+    assert len(converted) == 2
+    assert [m.content for m in history] == [
+        "what is it? a cat",
+        "and now?",
+        "and this one? a cat",
+    ]
+
+    # a resent last message is converted again
+    await assistant.pre_process_messages([_image_message("and this one?")])
+    assert len(converted) == 3